@@ -0,0 +1,75 @@
+import hashlib
+from datetime import timedelta
+
+from django.utils.timezone import localtime
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+from .models import User
+
+# 用户被禁用或者 appkey 被重置的时候会主动删除缓存, 其他字段的修改最多延迟 APPKEY_CACHE_TTL 秒
+APPKEY_CACHE_TTL = 60
+# 不存在的 appkey 也缓存一小段时间, 避免错误的 key 反复查询数据库
+APPKEY_MISS_TTL = 10
+# 每个 key 每天的调用次数保留的天数
+APPKEY_USAGE_DAYS = 7
+
+
+def hash_appkey(appkey):
+    return hashlib.sha256(appkey.encode("utf-8")).hexdigest()
+
+
+def _cache_key(digest):
+    return f"{CacheKey.appkey_user}:{digest}"
+
+
+def _usage_key(date):
+    return f"{CacheKey.appkey_usage}:{date.strftime('%Y%m%d')}"
+
+
+def get_appkey_user(appkey):
+    """
+    :return: 开启了 open api 并且没有被禁用的用户, 否则返回 None
+    """
+    digest = hash_appkey(appkey)
+    key = _cache_key(digest)
+    user = cache.get(key)
+    if user is None:
+        user = User.objects.filter(open_api_appkey=appkey, open_api=True, is_disabled=False).first()
+        if user is None:
+            cache.set(key, 0, APPKEY_MISS_TTL)
+            return None
+        cache.set(key, user, APPKEY_CACHE_TTL)
+    if not user:
+        return None
+    _count_usage(digest)
+    return user
+
+
+def _count_usage(digest):
+    key = _usage_key(localtime())
+    pipe = cache.pipeline()
+    pipe.hincrby(key, digest, 1)
+    pipe.expire(key, 3600 * 24 * APPKEY_USAGE_DAYS)
+    pipe.execute()
+
+
+def get_appkey_usage(appkey):
+    """
+    :return: [{"date": "2020-01-01", "count": 1}], 最近 APPKEY_USAGE_DAYS 天, 从今天开始
+    """
+    digest = hash_appkey(appkey)
+    today = localtime()
+    dates = [today - timedelta(days=i) for i in range(APPKEY_USAGE_DAYS)]
+    pipe = cache.pipeline()
+    for date in dates:
+        pipe.hget(_usage_key(date), digest)
+    counts = pipe.execute()
+    return [{"date": date.strftime("%Y-%m-%d"), "count": int(count or 0)} for date, count in zip(dates, counts)]
+
+
+def invalidate_appkeys(*appkeys):
+    keys = [_cache_key(hash_appkey(appkey)) for appkey in appkeys if appkey]
+    if keys:
+        cache.delete_many(keys)
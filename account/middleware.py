@@ -1,36 +1,56 @@
+import random
+import time
+
 from django.conf import settings
 from django.db import connection
 from django.utils.timezone import now
 from django.utils.deprecation import MiddlewareMixin
 
 from utils.api import JSONResponse
-from account.models import User
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.profiler import QueryRecorder, record
+from account.appkey import get_appkey_user
+
+# last_activity 的精度, ip 和 user agent 不变的时候, 这段时间内的请求不会写入 session
+SESSION_ACTIVITY_INTERVAL = 60
+
+
+def user_sessions_key(user_id):
+    return f"{CacheKey.user_sessions}:{user_id}"
 
 
 class APITokenAuthMiddleware(MiddlewareMixin):
     def process_request(self, request):
         appkey = request.META.get("HTTP_APPKEY")
         if appkey:
-            try:
-                request.user = User.objects.get(open_api_appkey=appkey, open_api=True, is_disabled=False)
+            user = get_appkey_user(appkey)
+            if user:
+                request.user = user
                 request.csrf_processing_done = True
                 request.auth_method = "api_key"
-            except User.DoesNotExist:
-                pass
 
 
 class SessionRecordMiddleware(MiddlewareMixin):
     def process_request(self, request):
         request.ip = request.META.get(settings.IP_HEADER, request.META.get("REMOTE_ADDR"))
-        if request.user.is_authenticated:
+        # 通过 appkey 认证的请求没有 session
+        if request.user.is_authenticated and getattr(request, "auth_method", None) != "api_key":
             session = request.session
-            session["user_agent"] = request.META.get("HTTP_USER_AGENT", "")
+            user_agent = request.META.get("HTTP_USER_AGENT", "")
+            last_activity = session.get("last_activity")
+            if session.get("ip") == request.ip and session.get("user_agent") == user_agent and \
+                    last_activity and (now() - last_activity).total_seconds() < SESSION_ACTIVITY_INTERVAL:
+                return
+            session["user_agent"] = user_agent
             session["ip"] = request.ip
             session["last_activity"] = now()
-            user_sessions = request.user.session_keys
-            if session.session_key not in user_sessions:
-                user_sessions.append(session.session_key)
-                request.user.save()
+            # 每个用户的 session 列表, 过期的 session 在 SessionManagementAPI 中清理
+            key = user_sessions_key(request.user.id)
+            pipe = cache.pipeline()
+            pipe.sadd(key, session.session_key)
+            pipe.expire(key, settings.SESSION_COOKIE_AGE)
+            pipe.execute()
 
 
 class AdminRoleRequiredMiddleware(MiddlewareMixin):
@@ -41,13 +61,21 @@ class AdminRoleRequiredMiddleware(MiddlewareMixin):
                 return JSONResponse.response({"error": "login-required", "data": "Please login in first"})
 
 
-class LogSqlMiddleware(MiddlewareMixin):
-    def process_response(self, request, response):
-        print("\033[94m", "#" * 30, "\033[0m")
-        time_threshold = 0.03
-        for query in connection.queries:
-            if float(query["time"]) > time_threshold:
-                print("\033[93m", query, "\n", "-" * 30, "\033[0m")
-            else:
-                print(query, "\n", "-" * 30)
+class ProfilerMiddleware:
+    """
+    按照 PROFILER_SAMPLE_RATE 采样, 记录每个接口的查询次数、数据库耗时、重复查询和总耗时
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.PROFILER_SAMPLE_RATE:
+            return self.get_response(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        wall_time = time.perf_counter() - start
+        match = request.resolver_match
+        record(f"{request.method} {match.view_name if match else 'unresolved'}", recorder, wall_time)
         return response
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:46
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0013_auto_20250812_2044'),
+        ('problem', '0020_migrate_contest_problem_status'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='acm_problems_status',
+        ),
+        migrations.RemoveField(
+            model_name='userprofile',
+            name='oi_problems_status',
+        ),
+    ]
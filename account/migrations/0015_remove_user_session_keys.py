@@ -0,0 +1,17 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:17
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0014_remove_problems_status'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='user',
+            name='session_keys',
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0015_remove_user_session_keys'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='open_api_appkey',
+            field=models.TextField(db_index=True, null=True),
+        ),
+    ]
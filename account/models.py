@@ -1,7 +1,6 @@
 from django.contrib.auth.models import AbstractBaseUser
 from django.conf import settings
 from django.db import models
-from utils.models import JSONField
 
 
 class AdminType(object):
@@ -36,10 +35,9 @@ class User(AbstractBaseUser):
     auth_token = models.TextField(null=True)
     two_factor_auth = models.BooleanField(default=False)
     tfa_token = models.TextField(null=True)
-    session_keys = JSONField(default=list)
     # open api key
     open_api = models.BooleanField(default=False)
-    open_api_appkey = models.TextField(null=True)
+    open_api_appkey = models.TextField(null=True, db_index=True)
     is_disabled = models.BooleanField(default=False)
 
     USERNAME_FIELD = "username"
@@ -95,25 +93,6 @@ class User(AbstractBaseUser):
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    # acm_problems_status examples:
-    # {
-    #     "problems": {
-    #         "1": {
-    #             "status": JudgeStatus.ACCEPTED,
-    #             "_id": "1000"
-    #         }
-    #     },
-    #     "contest_problems": {
-    #         "1": {
-    #             "status": JudgeStatus.ACCEPTED,
-    #             "_id": "1000"
-    #         }
-    #     }
-    # }
-    acm_problems_status = JSONField(default=dict)
-    # like acm_problems_status, merely add "score" field
-    oi_problems_status = JSONField(default=dict)
-
     real_name = models.TextField(null=True)
     avatar = models.TextField(default=f"{settings.AVATAR_URI_PREFIX}/default.png")
     blog = models.URLField(null=True)
@@ -0,0 +1,147 @@
+import time
+
+from utils.cache import cache
+from utils.constants import CacheKey, ContestRuleType
+
+from .models import AdminType, UserProfile
+from .tasks import rebuild_user_rank
+
+# 排行榜定期整体重建一次, 修正增量更新中可能出现的偏差, 重建期间继续使用旧的排行榜
+RANK_INDEX_TTL = 3600 * 24
+# 同一时间只有一个重建任务, 任务异常退出之后锁自动过期
+RANK_REBUILD_LOCK_TTL = 600
+# 排行榜还不存在的时候, 其他请求最多等待 RANK_REBUILD_WAIT_TIMES * RANK_REBUILD_WAIT_INTERVAL 秒
+RANK_REBUILD_WAIT_TIMES = 50
+RANK_REBUILD_WAIT_INTERVAL = 0.1
+# ACM 排行先比较通过数, 再比较提交数, 两者合并为一个分数
+ACM_SCORE_BASE = 2 ** 32
+
+RANK_KEYS = {ContestRuleType.ACM: CacheKey.user_rank_acm, ContestRuleType.OI: CacheKey.user_rank_oi}
+
+
+def _scores(admin_type, is_disabled, accepted_number, submission_number, total_score):
+    """
+    :return: {rule_type: score}, 不应该出现在排行榜中的为 None
+    """
+    if admin_type != AdminType.REGULAR_USER or is_disabled:
+        return {ContestRuleType.ACM: None, ContestRuleType.OI: None}
+    return {ContestRuleType.ACM: accepted_number * ACM_SCORE_BASE - submission_number
+            if submission_number > 0 else None,
+            ContestRuleType.OI: total_score if total_score > 0 else None}
+
+
+def _profile_rows(**filters):
+    return UserProfile.objects.filter(**filters).values_list("user_id", "user__admin_type", "user__is_disabled",
+                                                             "accepted_number", "submission_number", "total_score")
+
+
+def rebuild_rank():
+    """
+    调用之前需要获得 CacheKey.user_rank_lock, 结束之后释放.
+    新的排行榜写入临时的 key, 完成之后替换旧的, 重建期间增量更新的用户在替换之后重新计算
+    """
+    try:
+        members = {ContestRuleType.ACM: {}, ContestRuleType.OI: {}}
+        for user_id, *row in _profile_rows(user__admin_type=AdminType.REGULAR_USER,
+                                           user__is_disabled=False).iterator():
+            for rule_type, score in _scores(*row).items():
+                if score is not None:
+                    members[rule_type][user_id] = score
+
+        pipe = cache.pipeline()
+        for rule_type, key in RANK_KEYS.items():
+            pipe.delete(f"{key}:tmp")
+            if members[rule_type]:
+                pipe.zadd(f"{key}:tmp", members[rule_type])
+        pipe.execute()
+
+        pipe = cache.pipeline(transaction=True)
+        for rule_type, key in RANK_KEYS.items():
+            if members[rule_type]:
+                pipe.rename(f"{key}:tmp", key)
+            else:
+                pipe.delete(key)
+        pipe.set(CacheKey.user_rank_ready, 1)
+        pipe.set(CacheKey.user_rank_fresh, 1, ex=RANK_INDEX_TTL)
+        pipe.execute()
+
+        pipe = cache.pipeline(transaction=True)
+        pipe.smembers(CacheKey.user_rank_dirty)
+        pipe.delete(CacheKey.user_rank_dirty)
+        dirty = pipe.execute()[0]
+        for user_id in dirty:
+            _apply_user_rank(int(user_id))
+    finally:
+        cache.delete(CacheKey.user_rank_lock)
+
+
+def _ensure_rank():
+    if cache.exists(CacheKey.user_rank_fresh):
+        return
+    if cache.add(CacheKey.user_rank_lock, 1, timeout=RANK_REBUILD_LOCK_TTL):
+        if cache.exists(CacheKey.user_rank_ready):
+            # 已经有旧的排行榜, 在后台重建
+            rebuild_user_rank.send()
+        else:
+            rebuild_rank()
+        return
+    for _ in range(RANK_REBUILD_WAIT_TIMES):
+        if cache.exists(CacheKey.user_rank_ready):
+            return
+        time.sleep(RANK_REBUILD_WAIT_INTERVAL)
+
+
+def _apply_user_rank(user_id):
+    row = _profile_rows(user_id=user_id).first()
+    scores = _scores(*row[1:]) if row else {ContestRuleType.ACM: None, ContestRuleType.OI: None}
+    pipe = cache.pipeline()
+    for rule_type, score in scores.items():
+        if score is None:
+            pipe.zrem(RANK_KEYS[rule_type], user_id)
+        else:
+            pipe.zadd(RANK_KEYS[rule_type], {user_id: score})
+    pipe.execute()
+
+
+def update_user_rank(user_id):
+    """
+    用户的通过数、提交数、分数或者类型、状态改变之后调用, 用户被删除之后也可以调用
+    """
+    if cache.exists(CacheKey.user_rank_lock):
+        # 正在重建, 重建读取数据库之后的修改会在替换之后重新计算
+        cache.sadd(CacheKey.user_rank_dirty, user_id)
+    if cache.exists(CacheKey.user_rank_ready):
+        _apply_user_rank(user_id)
+
+
+def invalidate_rank():
+    cache.delete_many([CacheKey.user_rank_ready, CacheKey.user_rank_fresh])
+
+
+class RankList:
+    """
+    可以传给 APIView.paginate_data 的排行榜, 切片和计数都直接读取 sorted set
+    """
+    def __init__(self, rule_type):
+        _ensure_rank()
+        self.key = RANK_KEYS[rule_type]
+
+    def __getitem__(self, item):
+        if item.stop <= item.start:
+            return []
+        user_ids = [int(user_id) for user_id in cache.zrevrange(self.key, item.start, item.stop - 1)]
+        profiles = {profile.user_id: profile
+                    for profile in UserProfile.objects.filter(user_id__in=user_ids).select_related("user")}
+        return [profiles[user_id] for user_id in user_ids if user_id in profiles]
+
+    def count(self):
+        return cache.zcard(self.key)
+
+
+def get_user_rank(rule_type, user_id):
+    """
+    :return: 从 1 开始的排名, 不在排行榜中返回 None
+    """
+    _ensure_rank()
+    rank = cache.zrevrank(RANK_KEYS[rule_type], user_id)
+    return rank + 1 if rank is not None else None
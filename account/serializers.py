@@ -1,5 +1,6 @@
 from django import forms
 
+from problem.models import ProblemRuleType, UserProblemStatus
 from utils.api import serializers, UsernameSerializer
 
 from .models import AdminType, ProblemPermission, User, UserProfile
@@ -70,6 +71,8 @@ class UserSerializer(serializers.ModelSerializer):
 class UserProfileSerializer(serializers.ModelSerializer):
     user = UserSerializer()
     real_name = serializers.SerializerMethodField()
+    acm_problems_status = serializers.SerializerMethodField()
+    oi_problems_status = serializers.SerializerMethodField()
 
     class Meta:
         model = UserProfile
@@ -82,6 +85,25 @@ class UserProfileSerializer(serializers.ModelSerializer):
     def get_real_name(self, obj):
         return obj.real_name if self.show_real_name else None
 
+    @staticmethod
+    def _get_problems_status(obj, rule_type):
+        # 保持原来 json 中 {"problems": {id: {"status": , "_id": }}} 的格式
+        problems = {}
+        statuses = UserProblemStatus.objects.filter(user_id=obj.user_id, contest__isnull=True,
+                                                    problem__rule_type=rule_type) \
+            .values_list("problem_id", "problem___id", "status", "score")
+        for problem_id, display_id, status, score in statuses:
+            problems[str(problem_id)] = {"status": status, "_id": display_id}
+            if rule_type == ProblemRuleType.OI:
+                problems[str(problem_id)]["score"] = score
+        return problems
+
+    def get_acm_problems_status(self, obj):
+        return {"problems": self._get_problems_status(obj, ProblemRuleType.ACM)}
+
+    def get_oi_problems_status(self, obj):
+        return {"problems": self._get_problems_status(obj, ProblemRuleType.OI)}
+
 
 class EditUserSerializer(serializers.Serializer):
     id = serializers.IntegerField()
@@ -1,11 +1,34 @@
 import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
 import dramatiq
+import xlsxwriter
+from django.contrib.auth.hashers import make_password
+from django.db import IntegrityError, transaction
 
 from options.options import SysOptions
-from utils.shortcuts import send_email, DRAMATIQ_WORKER_ARGS
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import send_email, rand_str, DRAMATIQ_WORKER_ARGS
+from utils.tasks import delete_files
+
+from .models import User, UserProfile
 
 logger = logging.getLogger(__name__)
 
+# 生成用户任务的状态和结果文件保留的时间, 文件下载一次之后就会被删除
+GENERATE_JOB_TTL = 3600
+# 每一批用户的密码并行计算, 然后一起插入数据库
+GENERATE_BATCH_SIZE = 500
+# 计算密码的进程数, 不超过 CPU 核数
+GENERATE_HASH_WORKERS = min(4, os.cpu_count() or 1)
+
+_hash_pool = None
+_hash_pool_lock = threading.Lock()
+
 
 @dramatiq.actor(**DRAMATIQ_WORKER_ARGS(max_retries=3))
 def send_email_async(from_name, to_email, to_name, subject, content):
@@ -20,3 +43,107 @@ def send_email_async(from_name, to_email, to_name, subject, content):
                    content=content)
     except Exception as e:
         logger.exception(e)
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS(time_limit=600_000))
+def rebuild_user_rank():
+    # 防止循环引入
+    from .rank import rebuild_rank
+    rebuild_rank()
+
+
+def generate_job_key(job_id):
+    return f"{CacheKey.generate_user}:{job_id}"
+
+
+def generate_job_path(job_id):
+    return f"/tmp/generate_user_{job_id}.xlsx"
+
+
+def _get_hash_pool():
+    """
+    每个 worker 进程共用一个进程池, 不会因为每个任务线程都创建一个进程池而启动过多的进程
+    """
+    global _hash_pool
+    with _hash_pool_lock:
+        if _hash_pool is None:
+            _hash_pool = ProcessPoolExecutor(max_workers=GENERATE_HASH_WORKERS)
+        return _hash_pool
+
+
+def _hash_passwords(passwords, progress=None):
+    global _hash_pool
+    hashed = []
+    try:
+        pool = _get_hash_pool()
+        for start in range(0, len(passwords), GENERATE_BATCH_SIZE):
+            hashed.extend(pool.map(make_password, passwords[start:start + GENERATE_BATCH_SIZE], chunksize=32))
+            if progress:
+                progress(len(hashed), len(passwords))
+    except BrokenProcessPool:
+        # 子进程异常退出之后进程池不能再使用, 下一次任务重新创建
+        with _hash_pool_lock:
+            _hash_pool = None
+        raise
+    return hashed
+
+
+def build_users(path, usernames, password_length, progress=None):
+    """
+    在一个事务中创建所有用户, 用户名和密码按顺序写入 xlsx, 有重复的用户名时抛出 IntegrityError
+    """
+    # PBKDF2 是 CPU 密集型的, 在事务开始之前使用多进程计算, 事务中只有插入
+    passwords = [rand_str(password_length) for _ in usernames]
+    hashed = _hash_passwords(passwords, progress)
+
+    # constant_memory 模式下每一行写完之后就写入临时文件, 不会在内存中保存整个表格
+    workbook = xlsxwriter.Workbook(path, {"constant_memory": True})
+    worksheet = workbook.add_worksheet()
+    worksheet.set_column("A:B", 20)
+    worksheet.write("A1", "Username")
+    worksheet.write("B1", "Password")
+    try:
+        with transaction.atomic():
+            for start in range(0, len(usernames), GENERATE_BATCH_SIZE):
+                batch = usernames[start:start + GENERATE_BATCH_SIZE]
+                User.objects.bulk_create([User(username=username, password=password)
+                                          for username, password in zip(batch, hashed[start:start + len(batch)])])
+                # 不是所有数据库都能在 bulk_create 之后得到主键
+                user_ids = User.objects.filter(username__in=batch).values_list("id", flat=True)
+                UserProfile.objects.bulk_create([UserProfile(user_id=user_id) for user_id in user_ids])
+                for index, username in enumerate(batch, start=start):
+                    worksheet.write_string(index + 1, 0, username)
+                    worksheet.write_string(index + 1, 1, passwords[index])
+    finally:
+        workbook.close()
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def generate_users(job_id, usernames, password_length):
+    key = generate_job_key(job_id)
+    job = cache.get(key)
+    if not job:
+        return
+    path = generate_job_path(job_id)
+
+    def progress(finished, total):
+        job.update({"status": "running", "finished": finished, "total": total})
+        cache.set(key, job, GENERATE_JOB_TTL)
+
+    try:
+        build_users(path, usernames, password_length, progress)
+    except IntegrityError as e:
+        # Extract detail from exception message
+        #    duplicate key value violates unique constraint "user_username_key"
+        #    DETAIL:  Key (username)=(root11) already exists.
+        lines = str(e).split("\n")
+        job.update({"status": "failed", "err": lines[1] if len(lines) > 1 else lines[0]})
+    except Exception as e:
+        logger.exception(e)
+        job.update({"status": "failed", "err": str(e)})
+    else:
+        job["status"] = "finished"
+    if job["status"] == "failed" and os.path.exists(path):
+        os.remove(path)
+    cache.set(key, job, GENERATE_JOB_TTL)
+    delete_files.send_with_options(args=(path,), delay=GENERATE_JOB_TTL * 1000)
@@ -1,3 +1,4 @@
+import os
 import time
 
 from unittest import mock
@@ -9,11 +10,18 @@ from django.utils.timezone import now
 from otpauth import OtpAuth
 
 from utils.api.tests import APIClient, APITestCase
+from utils.cache import cache
 from utils.shortcuts import rand_str
 from options.options import SysOptions
+from problem.models import Problem, UserProblemStatus
+from problem.tests import DEFAULT_PROBLEM_DATA
 
-from .models import AdminType, ProblemPermission, User
-from utils.constants import ContestRuleType
+from .middleware import user_sessions_key
+from .models import AdminType, ProblemPermission, User, UserProfile
+from . import rank
+from .rank import invalidate_rank, update_user_rank
+from .tasks import generate_job_path, generate_users
+from utils.constants import CacheKey, ContestRuleType
 
 
 class PermissionDecoratorTest(APITestCase):
@@ -159,6 +167,16 @@ class UserLoginAPITest(APITestCase):
                                                       "password": self.password})
         self.assertDictEqual(resp.data, {"error": "error", "data": "Your account has been disabled"})
 
+    def test_login_rate_limit(self):
+        SysOptions.throttling = {"login": {"limit": 2, "window": 60}}
+        cache.delete("throttling:login:ip:127.0.0.1")
+        self.addCleanup(cache.delete, "throttling:login:ip:127.0.0.1")
+        for _ in range(2):
+            resp = self.client.post(self.login_url, data={"username": self.username, "password": "wrong"})
+            self.assertDictEqual(resp.data, {"error": "error", "data": "Invalid username or password"})
+        resp = self.client.post(self.login_url, data={"username": self.username, "password": self.password})
+        self.assertDictEqual(resp.data, {"error": "error", "data": "Too many requests, please wait 60 seconds"})
+
 
 class CaptchaTest(APITestCase):
     def _set_captcha(self, session):
@@ -216,7 +234,8 @@ class UserRegisterAPITest(CaptchaTest):
 
 class SessionManagementAPITest(APITestCase):
     def setUp(self):
-        self.create_user("test", "test123")
+        self.user = self.create_user("test", "test123")
+        cache.delete(user_sessions_key(self.user.id))
         self.url = self.reverse("session_management_api")
         # launch a request to provide session data
         login_url = self.reverse("user_login_api")
@@ -228,9 +247,21 @@ class SessionManagementAPITest(APITestCase):
         data = resp.data["data"]
         self.assertEqual(len(data), 1)
 
-    # def test_delete_session_key(self):
-    #     resp = self.client.delete(self.url + "?session_key=" + self.session_key)
-    #     self.assertSuccess(resp)
+    def test_delete_session_key(self):
+        session_key = self.client.session.session_key
+        resp = self.client.delete(self.url + "?session_key=" + session_key)
+        self.assertSuccess(resp)
+        self.assertEqual(cache.smembers(user_sessions_key(self.user.id)), set())
+
+    def test_activity_write_throttled(self):
+        self.client.get(self.url)
+        last_activity = self.client.session["last_activity"]
+        self.client.get(self.url)
+        self.assertEqual(self.client.session["last_activity"], last_activity)
+        # ip 改变之后马上记录
+        self.client.get(self.url, HTTP_X_REAL_IP="10.0.0.1")
+        self.assertEqual(self.client.session["ip"], "10.0.0.1")
+        self.assertNotEqual(self.client.session["last_activity"], last_activity)
 
     def test_delete_session_with_invalid_key(self):
         resp = self.client.delete(self.url + "?session_key=aaaaaaaaaa")
@@ -250,6 +281,17 @@ class UserProfileAPITest(APITestCase):
         resp = self.client.get(self.url)
         self.assertSuccess(resp)
 
+    def test_get_profile_with_problems_status(self):
+        user = self.create_user("test", "test123")
+        problem_data = deepcopy(DEFAULT_PROBLEM_DATA)
+        problem_data.pop("tags")
+        problem = Problem.objects.create(created_by=user, **problem_data)
+        UserProblemStatus.objects.create(user=user, problem=problem, status=0)
+        resp = self.client.get(self.url)
+        self.assertSuccess(resp)
+        self.assertDictEqual(resp.data["data"]["acm_problems_status"]["problems"],
+                             {str(problem.id): {"status": 0, "_id": problem._id}})
+
     def test_update_profile(self):
         self.create_user("test", "test123")
         update_data = {"real_name": "zemal", "submission_number": 233, "language": "en-US"}
@@ -460,6 +502,8 @@ class UserRankAPITest(APITestCase):
         profile2.accepted_number = 10
         profile2.total_score = 700
         profile2.save()
+        invalidate_rank()
+        cache.delete(CacheKey.user_rank_lock)
 
     def test_get_acm_rank(self):
         resp = self.client.get(self.url, data={"rule": ContestRuleType.ACM})
@@ -491,6 +535,55 @@ class UserRankAPITest(APITestCase):
         self.assertSuccess(resp)
         self.assertEqual(len(resp.data["data"]), 2)
 
+    def test_update_rank(self):
+        self.client.get(self.url, data={"rule": ContestRuleType.ACM})
+        test2 = User.objects.get(username="test2")
+        UserProfile.objects.filter(user=test2).update(accepted_number=11)
+        update_user_rank(test2.id)
+        self.client.login(username="test2", password="test123")
+        resp = self.client.get(self.url, data={"rule": ContestRuleType.ACM, "my_rank": 1})
+        self.assertEqual(resp.data["data"]["results"][0]["user"]["username"], "test2")
+        self.assertEqual(resp.data["data"]["my_rank"], 1)
+
+        # 被禁用的用户不再出现在排行榜中
+        User.objects.filter(id=test2.id).update(is_disabled=True)
+        update_user_rank(test2.id)
+        resp = self.client.get(self.url, data={"rule": ContestRuleType.ACM, "limit": 1})
+        self.assertEqual(resp.data["data"]["total"], 1)
+        self.assertEqual(resp.data["data"]["results"][0]["user"]["username"], "test1")
+
+    def test_update_during_rebuild(self):
+        test2 = User.objects.get(username="test2")
+        profile_rows = rank._profile_rows
+
+        def rows_then_update(**filters):
+            rows = profile_rows(**filters)
+            if "user_id" in filters:
+                return rows
+            rows = list(rows)
+            # 重建读取数据库之后, 判题结果更新了用户的通过数
+            UserProfile.objects.filter(user=test2).update(accepted_number=11)
+            update_user_rank(test2.id)
+            return mock.Mock(iterator=lambda: iter(rows))
+
+        with mock.patch("account.rank._profile_rows", side_effect=rows_then_update):
+            resp = self.client.get(self.url, data={"rule": ContestRuleType.ACM})
+        self.assertEqual(resp.data["data"]["results"][0]["user"]["username"], "test2")
+        self.assertFalse(cache.exists(CacheKey.user_rank_lock))
+
+    @mock.patch("account.rank.rebuild_user_rank.send")
+    def test_rebuild_in_background(self, send):
+        self.client.get(self.url, data={"rule": ContestRuleType.ACM})
+        cache.delete(CacheKey.user_rank_fresh)
+        # 旧的排行榜过期之后只有一个请求发起重建, 重建完成之前继续使用旧的排行榜
+        for _ in range(3):
+            resp = self.client.get(self.url, data={"rule": ContestRuleType.ACM})
+            self.assertEqual(resp.data["data"]["results"][0]["user"]["username"], "test1")
+        send.assert_called_once_with()
+        rank.rebuild_rank()
+        self.assertTrue(cache.exists(CacheKey.user_rank_fresh))
+        self.assertFalse(cache.exists(CacheKey.user_rank_lock))
+
 
 class ProfileProblemDisplayIDRefreshAPITest(APITestCase):
     def setUp(self):
@@ -623,11 +716,27 @@ class GenerateUserAPITest(APITestCase):
         resp = self.client.post(self.url, data=data2)
         self.assertEqual(resp.data["data"], "Start number must be lower than end number")
 
-    @mock.patch("account.views.admin.xlsxwriter.Workbook")
-    def test_generate_user_success(self, mock_workbook):
+    @mock.patch("account.tasks.delete_files")
+    @mock.patch("account.views.admin.generate_users.send")
+    def test_generate_user_success(self, send, delete_files):
         resp = self.client.post(self.url, data=self.data)
         self.assertSuccess(resp)
-        mock_workbook.assert_called()
+        job_id = resp.data["data"]["job_id"]
+        send.assert_called_once()
+        self.assertFailed(self.client.get(self.url, data={"job_id": job_id, "download": 1}),
+                          "Generate job is not finished")
+
+        generate_users.fn(*send.call_args[0])
+        resp = self.client.get(self.url, data={"job_id": job_id})
+        self.assertEqual(resp.data["data"], {"status": "finished", "finished": 6, "total": 6})
+        self.assertEqual(User.objects.filter(username__startswith="pre", username__endswith="suf").count(), 6)
+
+        resp = self.client.get(self.url, data={"job_id": job_id, "download": 1})
+        self.assertTrue(b"".join(resp.streaming_content).startswith(b"PK"))
+        self.assertFalse(os.path.exists(generate_job_path(job_id)))
+
+        resp = self.client.post(self.url, data=self.data)
+        self.assertFailed(resp, "Username pre100suf already exists")
 
 
 class OpenAPIAppkeyAPITest(APITestCase):
@@ -644,3 +753,25 @@ class OpenAPIAppkeyAPITest(APITestCase):
         resp = self.client.post(self.url, data={})
         self.assertSuccess(resp)
         self.assertEqual(resp.data["data"]["appkey"], User.objects.get(username=self.user.username).open_api_appkey)
+
+    def test_appkey_auth(self):
+        self.user.open_api = True
+        self.user.save()
+        old_appkey = self.client.post(self.url, data={}).data["data"]["appkey"]
+        client = APIClient()
+        resp = client.get(self.url, HTTP_APPKEY=old_appkey)
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"][0]["count"], 1)
+
+        # 重置之后旧的 key 马上失效
+        appkey = self.client.post(self.url, data={}).data["data"]["appkey"]
+        self.assertEqual(client.get(self.url, HTTP_APPKEY=old_appkey).data["data"], "Please login first")
+        self.assertSuccess(client.get(self.url, HTTP_APPKEY=appkey))
+
+        # 禁用用户之后马上失效
+        self.client.put(self.reverse("user_admin_api"),
+                        data={"id": self.user.id, "username": self.user.username, "real_name": "test",
+                              "email": "test@test.com", "admin_type": AdminType.SUPER_ADMIN,
+                              "problem_permission": ProblemPermission.ALL, "open_api": True,
+                              "two_factor_auth": False, "is_disabled": True})
+        self.assertFailed(client.get(self.url, HTTP_APPKEY=appkey))
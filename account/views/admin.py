@@ -1,20 +1,22 @@
 import os
-import re
-import xlsxwriter
 
 from django.db import transaction, IntegrityError
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import FileResponse
 from django.contrib.auth.hashers import make_password
 
-from submission.models import Submission
+from submission.models import SubmissionChain
 from utils.api import APIView, validate_serializer
+from utils.cache import cache
 from utils.shortcuts import rand_str
 
+from ..appkey import invalidate_appkeys
 from ..decorators import super_admin_required
 from ..models import AdminType, ProblemPermission, User, UserProfile
+from ..rank import update_user_rank
 from ..serializers import EditUserSerializer, UserAdminSerializer, GenerateUserSerializer
 from ..serializers import ImportUserSeralizer
+from ..tasks import GENERATE_JOB_TTL, generate_job_key, generate_job_path, generate_users
 
 
 class UserAdminAPI(APIView):
@@ -60,6 +62,7 @@ class UserAdminAPI(APIView):
             return self.error("Email already exists")
 
         pre_username = user.username
+        pre_appkey = user.open_api_appkey
         user.username = data["username"].lower()
         user.email = data["email"].lower()
         user.admin_type = data["admin_type"]
@@ -93,8 +96,11 @@ class UserAdminAPI(APIView):
         user.two_factor_auth = data["two_factor_auth"]
 
         user.save()
+        # 禁用、关闭 open api 或者修改权限之后马上生效
+        invalidate_appkeys(pre_appkey)
+        update_user_rank(user.id)
         if pre_username != user.username:
-            Submission.objects.filter(username=pre_username).update(username=user.username)
+            SubmissionChain().filter(username=pre_username).update(username=user.username)
 
         UserProfile.objects.filter(user=user).update(real_name=data["real_name"])
         return self.success(UserAdminSerializer(user).data)
@@ -129,7 +135,12 @@ class UserAdminAPI(APIView):
         ids = id.split(",")
         if str(request.user.id) in ids:
             return self.error("Current user can not be deleted")
-        User.objects.filter(id__in=ids).delete()
+        users = User.objects.filter(id__in=ids)
+        appkeys = list(users.exclude(open_api_appkey=None).values_list("open_api_appkey", flat=True))
+        users.delete()
+        invalidate_appkeys(*appkeys)
+        for user_id in ids:
+            update_user_rank(user_id)
         return self.success()
 
 
@@ -137,20 +148,26 @@ class GenerateUserAPI(APIView):
     @super_admin_required
     def get(self, request):
         """
-        download users excel
+        查询生成任务的进度, download=1 时下载用户名和密码, 文件只能下载一次
         """
-        file_id = request.GET.get("file_id")
-        if not file_id:
-            return self.error("Invalid Parameter, file_id is required")
-        if not re.match(r"^[a-zA-Z0-9]+$", file_id):
-            return self.error("Illegal file_id")
-        file_path = f"/tmp/{file_id}.xlsx"
-        if not os.path.isfile(file_path):
+        job_id = request.GET.get("job_id")
+        if not job_id:
+            return self.error("Invalid Parameter, job_id is required")
+        job = cache.get(generate_job_key(job_id))
+        if not job or job["user_id"] != request.user.id:
+            return self.error("Generate job does not exist")
+        if not request.GET.get("download"):
+            return self.success({k: v for k, v in job.items() if k != "user_id"})
+        if job["status"] != "finished":
+            return self.error("Generate job is not finished")
+        path = generate_job_path(job_id)
+        try:
+            f = open(path, "rb")
+        except FileNotFoundError:
             return self.error("File does not exist")
-        with open(file_path, "rb") as f:
-            raw_data = f.read()
-        os.remove(file_path)
-        response = HttpResponse(raw_data)
+        response = FileResponse(f)
+        # 已经打开的文件在删除之后仍然可以读取
+        os.remove(path)
         response["Content-Disposition"] = "attachment; filename=users.xlsx"
         response["Content-Type"] = "application/xlsx"
         return response
@@ -159,7 +176,7 @@ class GenerateUserAPI(APIView):
     @super_admin_required
     def post(self, request):
         """
-        Generate User
+        Generate User, 在后台任务中创建用户, 通过 get 查询进度和下载
         """
         data = request.data
         number_max_length = max(len(str(data["number_from"])), len(str(data["number_to"])))
@@ -168,35 +185,13 @@ class GenerateUserAPI(APIView):
         if data["number_from"] > data["number_to"]:
             return self.error("Start number must be lower than end number")
 
-        file_id = rand_str(8)
-        filename = f"/tmp/{file_id}.xlsx"
-        workbook = xlsxwriter.Workbook(filename)
-        worksheet = workbook.add_worksheet()
-        worksheet.set_column("A:B", 20)
-        worksheet.write("A1", "Username")
-        worksheet.write("B1", "Password")
-        i = 1
-
-        user_list = []
-        for number in range(data["number_from"], data["number_to"] + 1):
-            raw_password = rand_str(data["password_length"])
-            user = User(username=f"{data['prefix']}{number}{data['suffix']}", password=make_password(raw_password))
-            user.raw_password = raw_password
-            user_list.append(user)
-
-        try:
-            with transaction.atomic():
-
-                ret = User.objects.bulk_create(user_list)
-                UserProfile.objects.bulk_create([UserProfile(user=user) for user in ret])
-                for item in user_list:
-                    worksheet.write_string(i, 0, item.username)
-                    worksheet.write_string(i, 1, item.raw_password)
-                    i += 1
-                workbook.close()
-                return self.success({"file_id": file_id})
-        except IntegrityError as e:
-            # Extract detail from exception message
-            #    duplicate key value violates unique constraint "user_username_key"
-            #    DETAIL:  Key (username)=(root11) already exists.
-            return self.error(str(e).split("\n")[1])
+        usernames = [f"{data['prefix']}{number}{data['suffix']}"
+                     for number in range(data["number_from"], data["number_to"] + 1)]
+        existing = User.objects.filter(username__in=usernames).values_list("username", flat=True).first()
+        if existing:
+            return self.error(f"Username {existing} already exists")
+        job_id = rand_str()
+        cache.set(generate_job_key(job_id), {"user_id": request.user.id, "status": "pending",
+                                             "finished": 0, "total": len(usernames)}, GENERATE_JOB_TTL)
+        generate_users.send(job_id, usernames, data["password_length"])
+        return self.success({"job_id": job_id})
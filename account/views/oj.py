@@ -11,14 +11,18 @@ from django.utils.timezone import now
 from django.views.decorators.csrf import ensure_csrf_cookie, csrf_exempt
 from otpauth import OtpAuth
 
-from problem.models import Problem
 from utils.constants import ContestRuleType
 from options.options import SysOptions
 from utils.api import APIView, validate_serializer, CSRFExemptAPIView
+from utils.cache import cache
 from utils.captcha import Captcha
 from utils.shortcuts import rand_str, img2base64, datetime2str
+from utils.throttling import rate_limit
+from ..appkey import get_appkey_usage, invalidate_appkeys
 from ..decorators import login_required
-from ..models import User, UserProfile, AdminType
+from ..rank import RankList, get_user_rank
+from ..middleware import user_sessions_key
+from ..models import User, UserProfile
 from ..serializers import (ApplyResetPasswordSerializer, ResetPasswordSerializer,
                            UserChangePasswordSerializer, UserLoginSerializer,
                            UserRegisterSerializer, UsernameOrEmailCheckSerializer,
@@ -153,6 +157,7 @@ class CheckTFARequiredAPI(APIView):
 
 
 class UserLoginAPI(APIView):
+    @rate_limit("login")
     @validate_serializer(UserLoginSerializer)
     def post(self, request):
         """
@@ -207,6 +212,7 @@ class UsernameOrEmailCheck(APIView):
 
 
 class UserRegisterAPI(APIView):
+    @rate_limit("register")
     @validate_serializer(UserRegisterSerializer)
     def post(self, request):
         """
@@ -336,27 +342,26 @@ class SessionManagementAPI(APIView):
         engine = import_module(settings.SESSION_ENGINE)
         session_store = engine.SessionStore
         current_session = request.session.session_key
-        session_keys = request.user.session_keys
+        key = user_sessions_key(request.user.id)
         result = []
-        modified = False
-        for key in session_keys[:]:
-            session = session_store(key)
+        expired = []
+        for session_key in sorted(item.decode("utf-8") for item in cache.smembers(key)):
+            session = session_store(session_key)
             # session does not exist or is expiry
             if not session._session:
-                session_keys.remove(key)
-                modified = True
+                expired.append(session_key)
                 continue
 
             s = {}
-            if current_session == key:
+            if current_session == session_key:
                 s["current_session"] = True
             s["ip"] = session["ip"]
             s["user_agent"] = session["user_agent"]
             s["last_activity"] = datetime2str(session["last_activity"])
-            s["session_key"] = key
+            s["session_key"] = session_key
             result.append(s)
-        if modified:
-            request.user.save()
+        if expired:
+            cache.srem(key, *expired)
         return self.success(result)
 
     @login_required
@@ -364,10 +369,8 @@ class SessionManagementAPI(APIView):
         session_key = request.GET.get("session_key")
         if not session_key:
             return self.error("Parameter Error")
-        request.session.delete(session_key)
-        if session_key in request.user.session_keys:
-            request.user.session_keys.remove(session_key)
-            request.user.save()
+        if cache.srem(user_sessions_key(request.user.id), session_key):
+            request.session.delete(session_key)
             return self.success("Succeeded")
         else:
             return self.error("Invalid session_key")
@@ -378,43 +381,40 @@ class UserRankAPI(APIView):
         rule_type = request.GET.get("rule")
         if rule_type not in ContestRuleType.choices():
             rule_type = ContestRuleType.ACM
-        profiles = UserProfile.objects.filter(user__admin_type=AdminType.REGULAR_USER, user__is_disabled=False) \
-            .select_related("user")
-        if rule_type == ContestRuleType.ACM:
-            profiles = profiles.filter(submission_number__gt=0).order_by("-accepted_number", "submission_number")
-        else:
-            profiles = profiles.filter(total_score__gt=0).order_by("-total_score")
-        return self.success(self.paginate_data(request, profiles, RankInfoSerializer))
+        data = self.paginate_data(request, RankList(rule_type), RankInfoSerializer)
+        if request.GET.get("my_rank") and request.user.is_authenticated:
+            data["my_rank"] = get_user_rank(rule_type, request.user.id)
+        return self.success(data)
 
 
 class ProfileProblemDisplayIDRefreshAPI(APIView):
     @login_required
     def get(self, request):
-        profile = request.user.userprofile
-        acm_problems = profile.acm_problems_status.get("problems", {})
-        oi_problems = profile.oi_problems_status.get("problems", {})
-        ids = list(acm_problems.keys()) + list(oi_problems.keys())
-        if not ids:
-            return self.success()
-        display_ids = Problem.objects.filter(id__in=ids, visible=True).values_list("_id", flat=True)
-        id_map = dict(zip(ids, display_ids))
-        for k, v in acm_problems.items():
-            v["_id"] = id_map[k]
-        for k, v in oi_problems.items():
-            v["_id"] = id_map[k]
-        profile.save(update_fields=["acm_problems_status", "oi_problems_status"])
+        # 题目的 display id 由 UserProblemStatus 关联查询得到, 不需要再刷新, 保留接口兼容前端
         return self.success()
 
 
 class OpenAPIAppkeyAPI(APIView):
+    @login_required
+    def get(self, request):
+        """
+        当前 appkey 最近几天的调用次数
+        """
+        user = request.user
+        if not user.open_api or not user.open_api_appkey:
+            return self.error("OpenAPI function is truned off for you")
+        return self.success(get_appkey_usage(user.open_api_appkey))
+
     @login_required
     def post(self, request):
         user = request.user
         if not user.open_api:
             return self.error("OpenAPI function is truned off for you")
+        old_appkey = user.open_api_appkey
         api_appkey = rand_str()
         user.open_api_appkey = api_appkey
         user.save()
+        invalidate_appkeys(old_appkey)
         return self.success({"appkey": api_appkey})
 
 
@@ -46,3 +46,13 @@ class AnnouncementAPITest(APITestCase):
     def test_get_announcement_list(self):
         resp = self.client.get(self.url)
         self.assertSuccess(resp)
+
+    def test_announcement_list_cache(self):
+        self.assertEqual(self.client.get(self.url).data["data"]["total"], 1)
+        Announcement.objects.create(title="title", content="content", visible=True, created_by=self.user)
+        self.assertEqual(self.client.get(self.url).data["data"]["total"], 1)
+
+        resp = self.client.post(self.reverse("announcement_admin_api"),
+                                data={"title": "title", "content": "content", "visible": True})
+        self.assertSuccess(resp)
+        self.assertEqual(self.client.get(self.url).data["data"]["total"], 3)
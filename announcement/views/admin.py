@@ -1,5 +1,5 @@
 from account.decorators import super_admin_required
-from utils.api import APIView, validate_serializer
+from utils.api import APIView, invalidate_response_cache, validate_serializer
 
 from announcement.models import Announcement
 from announcement.serializers import (AnnouncementSerializer, CreateAnnouncementSerializer,
@@ -18,6 +18,7 @@ class AnnouncementAdminAPI(APIView):
                                                    content=data["content"],
                                                    created_by=request.user,
                                                    visible=data["visible"])
+        invalidate_response_cache("announcement")
         return self.success(AnnouncementSerializer(announcement).data)
 
     @validate_serializer(EditAnnouncementSerializer)
@@ -35,7 +36,7 @@ class AnnouncementAdminAPI(APIView):
         for k, v in data.items():
             setattr(announcement, k, v)
         announcement.save()
-
+        invalidate_response_cache("announcement")
         return self.success(AnnouncementSerializer(announcement).data)
 
     @super_admin_required
@@ -59,4 +60,5 @@ class AnnouncementAdminAPI(APIView):
     def delete(self, request):
         if request.GET.get("id"):
             Announcement.objects.filter(id=request.GET["id"]).delete()
+            invalidate_response_cache("announcement")
         return self.success()
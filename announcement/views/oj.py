@@ -1,10 +1,11 @@
-from utils.api import APIView
+from utils.api import APIView, cache_response
 
 from announcement.models import Announcement
 from announcement.serializers import AnnouncementSerializer
 
 
 class AnnouncementAPI(APIView):
+    @cache_response(ttl=300, tags=["announcement"])
     def get(self, request):
         announcements = Announcement.objects.filter(visible=True)
         return self.success(self.paginate_data(request, announcements, AnnouncementSerializer))
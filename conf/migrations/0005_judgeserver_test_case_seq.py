@@ -0,0 +1,18 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('conf', '0004_auto_20180501_0436'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='judgeserver',
+            name='test_case_seq',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -14,6 +14,8 @@ class JudgeServer(models.Model):
     task_number = models.IntegerField(default=0)
     service_url = models.TextField(null=True)
     is_disabled = models.BooleanField(default=False)
+    # 已经同步到的 TestCaseChangeLog 序号, 为 null 表示仍然使用 rsync 全量同步
+    test_case_seq = models.BigIntegerField(null=True)
 
     @property
     def status(self):
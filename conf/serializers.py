@@ -46,6 +46,11 @@ class JudgeServerHeartbeatSerializer(serializers.Serializer):
     service_url = serializers.CharField(max_length=256)
 
 
+class TestCaseSyncSerializer(serializers.Serializer):
+    hostname = serializers.CharField(max_length=128)
+    seq = serializers.IntegerField(min_value=0)
+
+
 class EditJudgeServerSerializer(serializers.Serializer):
     id = serializers.IntegerField()
     is_disabled = serializers.BooleanField()
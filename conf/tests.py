@@ -1,11 +1,19 @@
 import hashlib
+import os
+import shutil
 from unittest import mock
 
 from django.conf import settings
+from django.test import override_settings
 from django.utils import timezone
 
+from judge.dispatcher import ChooseJudgeServer
 from options.options import SysOptions
+from problem.models import TestCaseChangeLog
 from utils.api.tests import APITestCase
+from utils.profiler import fingerprint, get_profiler_stats, reset_profiler
+from utils.sanitizer import sanitize, sanitize_many
+from utils.shortcuts import rand_str
 from .models import JudgeServer
 
 
@@ -73,12 +81,31 @@ class WebsiteConfigAPITest(APITestCase):
         self.assertSuccess(resp)
         self.assertEqual(SysOptions.website_footer, '<img src="#" />')
 
+    def test_sanitize_memo(self):
+        content = "<p onclick=alert(1)>a < b</p>"
+        cleaned = sanitize(content)
+        self.assertEqual(cleaned, "<p>a &lt; b</p>")
+        self.assertEqual(sanitize_many([content, "1 < 2\n"]), [cleaned, "1 &lt; 2\n"])
+        # 清理不是幂等的, 结果不能作为自己的缓存, 否则是否命中缓存会得到不同的内容
+        self.assertEqual(sanitize("&amp;amp;"), "&amp;")
+        self.assertEqual(sanitize("&amp;"), "&")
+
     def test_get_website_config(self):
         # do not need to login
         url = self.reverse("website_info_api")
         resp = self.client.get(url)
         self.assertSuccess(resp)
 
+    def test_website_config_etag(self):
+        url = self.reverse("website_info_api")
+        resp = self.client.get(url)
+        self.assertNotIn(b"\n", resp.content)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=resp["ETag"]).status_code, 304)
+
+        SysOptions.website_name = "new name"
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(resp.data["data"]["website_name"], "new name")
+
 
 class JudgeServerHeartbeatTest(APITestCase):
     def setUp(self):
@@ -105,6 +132,54 @@ class JudgeServerHeartbeatTest(APITestCase):
         self.assertEqual(JudgeServer.objects.get(hostname=self.data["hostname"]).judger_version, data["judger_version"])
 
 
+class TestCaseReplicationAPITest(APITestCase):
+    def setUp(self):
+        self.url = self.reverse("test_case_changes_api")
+        SysOptions.judge_server_token = "test"
+        self.headers = {"HTTP_X_JUDGE_SERVER_TOKEN": hashlib.sha256(b"test").hexdigest()}
+        self.server = JudgeServer.objects.create(hostname="testhostname", judger_version="1.0.4", cpu_core=4,
+                                                 cpu_usage=0, memory_usage=0, last_heartbeat=timezone.now(),
+                                                 test_case_seq=0)
+        self.test_case_id = rand_str()
+        # 迁移会为 TEST_CASE_DIR 中已有的目录生成变更记录
+        TestCaseChangeLog.objects.all().delete()
+        self.change = TestCaseChangeLog.objects.create(test_case_id=self.test_case_id, files={"1.in": "sha"})
+
+    def test_invalid_token(self):
+        resp = self.client.get(self.url)
+        self.assertFailed(resp, "Invalid token")
+
+    def test_get_changes(self):
+        resp = self.client.get(self.url, **self.headers)
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"], [{"seq": self.change.id, "test_case_id": self.test_case_id,
+                                              "files": {"1.in": "sha"}, "deleted": False}])
+        resp = self.client.get(self.url, data={"since": self.change.id}, **self.headers)
+        self.assertEqual(resp.data["data"], [])
+        resp = self.client.get(self.url, data={"limit": -1}, **self.headers)
+        self.assertEqual(len(resp.data["data"]), 1)
+
+    def test_route_to_synced_server(self):
+        with ChooseJudgeServer(self.test_case_id) as server:
+            self.assertIsNone(server)
+        resp = self.client.post(self.url, data={"hostname": "testhostname", "seq": self.change.id}, **self.headers)
+        self.assertSuccess(resp)
+        with ChooseJudgeServer(self.test_case_id) as server:
+            self.assertEqual(server.id, self.server.id)
+
+    def test_get_test_case_file(self):
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, self.test_case_id)
+        os.mkdir(test_case_dir)
+        self.addCleanup(shutil.rmtree, test_case_dir)
+        with open(os.path.join(test_case_dir, "1.in"), "w") as f:
+            f.write("1 2")
+        url = self.reverse("test_case_file_api")
+        resp = self.client.get(url, data={"test_case_id": self.test_case_id, "name": "1.in"}, **self.headers)
+        self.assertEqual(b"".join(resp.streaming_content), b"1 2")
+        resp = self.client.get(url, data={"test_case_id": self.test_case_id, "name": "../info"}, **self.headers)
+        self.assertFailed(resp, "Invalid parameter")
+
+
 class JudgeServerAPITest(APITestCase):
     def setUp(self):
         self.server = JudgeServer.objects.create(**{"hostname": "testhostname", "judger_version": "1.0.4",
@@ -134,6 +209,17 @@ class LanguageListAPITest(APITestCase):
         resp = self.client.get(self.reverse("language_list_api"))
         self.assertSuccess(resp)
 
+    def test_languages_etag(self):
+        url = self.reverse("language_list_api")
+        etag = self.client.get(url)["ETag"]
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        SysOptions.languages = SysOptions.languages[:1]
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertSuccess(resp)
+        self.assertEqual(len(resp.data["data"]["languages"]), 1)
+        self.assertNotEqual(resp["ETag"], etag)
+
 
 class TestCasePruneAPITest(APITestCase):
     def setUp(self):
@@ -144,16 +230,16 @@ class TestCasePruneAPITest(APITestCase):
         resp = self.client.get(self.url)
         self.assertSuccess(resp)
 
-    @mock.patch("conf.views.TestCasePruneAPI.delete_one")
-    @mock.patch("conf.views.os.listdir")
-    @mock.patch("conf.views.Problem")
-    def test_delete_test_case(self, mocked_problem, mocked_listdir, mocked_delete_one):
-        valid_id = "1172980672983b2b49820be3a741b109"
-        mocked_problem.return_value = [valid_id, ]
-        mocked_listdir.return_value = [valid_id, ".test", "aaa"]
+    @mock.patch("conf.views.sweep_test_cases")
+    def test_delete_test_case(self, mocked_sweep):
         resp = self.client.delete(self.url)
         self.assertSuccess(resp)
-        mocked_delete_one.assert_called_once_with(valid_id)
+        mocked_sweep.send.assert_called_once_with(None)
+
+        valid_id = "1172980672983b2b49820be3a741b109"
+        resp = self.client.delete(self.url + f"?id={valid_id}")
+        self.assertSuccess(resp)
+        mocked_sweep.send.assert_called_with([valid_id])
 
 
 class ReleaseNoteAPITest(APITestCase):
@@ -183,3 +269,27 @@ class DashboardInfoAPITest(APITestCase):
         resp = self.client.get(self.url)
         self.assertSuccess(resp)
         self.assertEqual(resp.data["data"]["user_count"], 1)
+
+
+@override_settings(PROFILER_SAMPLE_RATE=1)
+class ProfilerAPITest(APITestCase):
+    def setUp(self):
+        reset_profiler()
+        self.url = self.reverse("profiler_api")
+        self.create_super_admin()
+
+    def test_fingerprint(self):
+        self.assertEqual(fingerprint("SELECT * FROM t1 WHERE id IN (%s, %s) AND name = 'a' LIMIT 20"),
+                         "SELECT * FROM t1 WHERE id IN (...) AND name = ? LIMIT ?")
+
+    def test_get_profile(self):
+        for _ in range(2):
+            self.client.get(self.reverse("website_info_api"))
+        resp = self.client.get(self.url)
+        self.assertSuccess(resp)
+        endpoints = {item["endpoint"]: item for item in resp.data["data"]["endpoints"]}
+        self.assertEqual(endpoints["GET website_info_api"]["count"], 2)
+
+        self.assertSuccess(self.client.delete(self.url))
+        self.assertNotIn("GET website_info_api", [item["endpoint"] for item in get_profiler_stats()])
+        self.assertFailed(self.client.get(self.url, data={"order_by": "name"}), "Invalid order_by")
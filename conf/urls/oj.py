@@ -1,9 +1,11 @@
 from django.conf.urls import url
 
-from ..views import JudgeServerHeartbeatAPI, LanguagesAPI, WebsiteConfigAPI
+from ..views import JudgeServerHeartbeatAPI, LanguagesAPI, WebsiteConfigAPI, TestCaseChangesAPI, TestCaseFileAPI
 
 urlpatterns = [
     url(r"^website/?$", WebsiteConfigAPI.as_view(), name="website_info_api"),
     url(r"^judge_server_heartbeat/?$", JudgeServerHeartbeatAPI.as_view(), name="judge_server_heartbeat_api"),
+    url(r"^judge_server/test_case_changes/?$", TestCaseChangesAPI.as_view(), name="test_case_changes_api"),
+    url(r"^judge_server/test_case_file/?$", TestCaseFileAPI.as_view(), name="test_case_file_api"),
     url(r"^languages/?$", LanguagesAPI.as_view(), name="language_list_api")
 ]
@@ -2,7 +2,6 @@ import hashlib
 import json
 import os
 import re
-import shutil
 import smtplib
 import time
 from datetime import datetime
@@ -10,6 +9,7 @@ from datetime import datetime
 import pytz
 import requests
 from django.conf import settings
+from django.http import FileResponse, HttpResponseNotModified
 from django.utils import timezone
 from requests.exceptions import RequestException
 
@@ -18,16 +18,20 @@ from account.models import User
 from contest.models import Contest
 from judge.dispatcher import process_pending_task
 from options.options import SysOptions
-from problem.models import Problem
+from problem.models import TestCaseChangeLog
+from problem.storage import reclaimable
+from problem.tasks import sweep_test_cases
 from submission.models import Submission
-from utils.api import APIView, CSRFExemptAPIView, validate_serializer
+from utils.api import APIView, CSRFExemptAPIView, get_response_cache_stats, validate_serializer
+from utils.profiler import PROFILER_FIELDS, get_profiler_stats, reset_profiler
 from utils.shortcuts import send_email, get_env
-from utils.xss_filter import XSSHtml
+from utils.sanitizer import sanitize
 from .models import JudgeServer
 from .serializers import (CreateEditWebsiteConfigSerializer,
                           CreateSMTPConfigSerializer, EditSMTPConfigSerializer,
                           JudgeServerHeartbeatSerializer,
-                          JudgeServerSerializer, TestSMTPConfigSerializer, EditJudgeServerSerializer)
+                          JudgeServerSerializer, TestSMTPConfigSerializer, EditJudgeServerSerializer,
+                          TestCaseSyncSerializer)
 
 
 class SMTPAPI(APIView):
@@ -99,8 +103,7 @@ class WebsiteConfigAPI(APIView):
     def post(self, request):
         for k, v in request.data.items():
             if k == "website_footer":
-                with XSSHtml() as parser:
-                    v = parser.clean(v)
+                v = sanitize(v)
             setattr(SysOptions, k, v)
         return self.success()
 
@@ -129,12 +132,16 @@ class JudgeServerAPI(APIView):
         return self.success()
 
 
+def judge_server_token_valid(request):
+    client_token = request.META.get("HTTP_X_JUDGE_SERVER_TOKEN")
+    return hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest() == client_token
+
+
 class JudgeServerHeartbeatAPI(CSRFExemptAPIView):
     @validate_serializer(JudgeServerHeartbeatSerializer)
     def post(self, request):
         data = request.data
-        client_token = request.META.get("HTTP_X_JUDGE_SERVER_TOKEN")
-        if hashlib.sha256(SysOptions.judge_server_token.encode("utf-8")).hexdigest() != client_token:
+        if not judge_server_token_valid(request):
             return self.error("Invalid token")
 
         try:
@@ -163,50 +170,77 @@ class JudgeServerHeartbeatAPI(CSRFExemptAPIView):
         return self.success()
 
 
+class TestCaseChangesAPI(CSRFExemptAPIView):
+    def get(self, request):
+        """
+        判题机拉取序号大于 since 的测试用例变更
+        """
+        if not judge_server_token_valid(request):
+            return self.error("Invalid token")
+        try:
+            since = int(request.GET.get("since", 0))
+            limit = min(max(int(request.GET.get("limit", 500)), 1), 1000)
+        except ValueError:
+            return self.error("Invalid parameter")
+        changes = TestCaseChangeLog.objects.filter(id__gt=since).values("id", "test_case_id", "files", "deleted")[:limit]
+        return self.success([{"seq": item.pop("id"), **item} for item in changes])
+
+    @validate_serializer(TestCaseSyncSerializer)
+    def post(self, request):
+        """
+        判题机上报已经同步到的序号
+        """
+        if not judge_server_token_valid(request):
+            return self.error("Invalid token")
+        data = request.data
+        JudgeServer.objects.filter(hostname=data["hostname"]).update(test_case_seq=data["seq"])
+        # 等待中的提交可能在等这台判题机同步完成
+        process_pending_task()
+        return self.success()
+
+
+class TestCaseFileAPI(CSRFExemptAPIView):
+    def get(self, request):
+        if not judge_server_token_valid(request):
+            return self.error("Invalid token")
+        test_case_id = request.GET.get("test_case_id", "")
+        name = request.GET.get("name", "")
+        if not re.match(r"^[a-zA-Z0-9]{32}$", test_case_id) or not re.match(r"^\w[\w.\-]*$", name):
+            return self.error("Invalid parameter")
+        path = os.path.join(settings.TEST_CASE_DIR, test_case_id, name)
+        if not os.path.isfile(path):
+            return self.error("Test case file does not exist")
+        return FileResponse(open(path, "rb"), content_type="application/octet-stream")
+
+
 class LanguagesAPI(APIView):
     def get(self, request):
-        return self.success({"languages": SysOptions.languages, "spj_languages": SysOptions.spj_languages})
+        registry = SysOptions.language_registry
+        # 语言配置不变的时候客户端可以直接使用缓存
+        if request.META.get("HTTP_IF_NONE_MATCH") == registry.etag:
+            return HttpResponseNotModified()
+        resp = self.success({"languages": registry.languages, "spj_languages": registry.spj_languages})
+        resp["ETag"] = registry.etag
+        return resp
 
 
 class TestCasePruneAPI(APIView):
     @super_admin_required
     def get(self, request):
         """
-        return orphan test_case list
+        return reclaimable test_case list
         """
-        ret_data = []
-        dir_to_be_removed = self.get_orphan_ids()
-
-        # return an iterator
-        for d in os.scandir(settings.TEST_CASE_DIR):
-            if d.name in dir_to_be_removed:
-                ret_data.append({"id": d.name, "create_time": d.stat().st_mtime})
+        ret_data = [{"id": item.test_case_id, "create_time": item.last_used.timestamp(), "size": item.size}
+                    for item in reclaimable()]
         return self.success(ret_data)
 
     @super_admin_required
     def delete(self, request):
         test_case_id = request.GET.get("id")
-        if test_case_id:
-            self.delete_one(test_case_id)
-            return self.success()
-        for id in self.get_orphan_ids():
-            self.delete_one(id)
+        # 在后台分批删除, 仍然被引用或者还在宽限期内的测试用例不会被删除
+        sweep_test_cases.send([test_case_id] if test_case_id else None)
         return self.success()
 
-    @staticmethod
-    def get_orphan_ids():
-        db_ids = Problem.objects.all().values_list("test_case_id", flat=True)
-        disk_ids = os.listdir(settings.TEST_CASE_DIR)
-        test_case_re = re.compile(r"^[a-zA-Z0-9]{32}$")
-        disk_ids = filter(lambda f: test_case_re.match(f), disk_ids)
-        return list(set(disk_ids) - set(db_ids))
-
-    @staticmethod
-    def delete_one(id):
-        test_case_dir = os.path.join(settings.TEST_CASE_DIR, id)
-        if os.path.isdir(test_case_dir):
-            shutil.rmtree(test_case_dir, ignore_errors=True)
-
 
 class ReleaseNotesAPI(APIView):
     def get(self, request):
@@ -234,8 +268,24 @@ class DashboardInfoAPI(APIView):
             "recent_contest_count": recent_contest_count,
             "today_submission_count": today_submission_count,
             "judge_server_count": judge_server_count,
+            "response_cache": get_response_cache_stats(),
             "env": {
                 "FORCE_HTTPS": get_env("FORCE_HTTPS", default=False),
                 "STATIC_CDN_HOST": get_env("STATIC_CDN_HOST", default="")
             }
         })
+
+
+class ProfilerAPI(APIView):
+    @super_admin_required
+    def get(self, request):
+        order_by = request.GET.get("order_by", "queries")
+        if order_by not in PROFILER_FIELDS:
+            return self.error("Invalid order_by")
+        return self.success({"sample_rate": settings.PROFILER_SAMPLE_RATE,
+                             "endpoints": get_profiler_stats(order_by)})
+
+    @super_admin_required
+    def delete(self, request):
+        reset_profiler()
+        return self.success()
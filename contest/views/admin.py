@@ -1,4 +1,3 @@
-import copy
 import os
 import zipfile
 from ipaddress import ip_network
@@ -8,8 +7,8 @@ from django.http import FileResponse
 
 from account.decorators import check_contest_permission, ensure_created_by
 from account.models import User
-from submission.models import Submission, JudgeStatus
-from utils.api import APIView, validate_serializer
+from submission.models import SubmissionChain, JudgeStatus
+from utils.api import APIView, invalidate_response_cache, validate_serializer
 from utils.cache import cache
 from utils.constants import CacheKey
 from utils.shortcuts import rand_str
@@ -38,6 +37,7 @@ class ContestAPI(APIView):
             except ValueError:
                 return self.error(f"{ip_range} is not a valid cidr network")
         contest = Contest.objects.create(**data)
+        invalidate_response_cache("contest")
         return self.success(ContestAdminSerializer(contest).data)
 
     @validate_serializer(EditConetestSeriaizer)
@@ -66,6 +66,7 @@ class ContestAPI(APIView):
         for k, v in data.items():
             setattr(contest, k, v)
         contest.save()
+        invalidate_response_cache("contest")
         return self.success(ContestAdminSerializer(contest).data)
 
     def get(self, request):
@@ -199,27 +200,23 @@ class DownloadContestSubmissions(APIView):
     def _dump_submissions(self, contest, exclude_admin=True):
         problem_ids = contest.problem_set.all().values_list("id", "_id")
         id2display_id = {k[0]: k[1] for k in problem_ids}
-        ac_map = {k[0]: False for k in problem_ids}
-        submissions = Submission.objects.filter(contest=contest, result=JudgeStatus.ACCEPTED).order_by("-create_time")
-        user_ids = submissions.values_list("user_id", flat=True)
-        users = User.objects.filter(id__in=user_ids)
+        # 按时间倒序遍历一次, 每个用户每道题只保留最后一次 AC 的代码
+        submissions = SubmissionChain().filter(contest=contest, result=JudgeStatus.ACCEPTED) \
+            .only("user_id", "problem_id", "code")
+        latest = {}
+        for submission in submissions:
+            latest.setdefault((submission.user_id, submission.problem_id), submission.code)
+        users = {user.id: user for user in User.objects.filter(id__in={k[0] for k in latest})}
         path = f"/tmp/{rand_str()}.zip"
         with zipfile.ZipFile(path, "w") as zip_file:
-            for user in users:
-                if user.is_admin_role() and exclude_admin:
+            for (user_id, problem_id), code in latest.items():
+                user = users.get(user_id)
+                if user is None or (user.is_admin_role() and exclude_admin):
                     continue
-                user_ac_map = copy.deepcopy(ac_map)
-                user_submissions = submissions.filter(user_id=user.id)
-                for submission in user_submissions:
-                    problem_id = submission.problem_id
-                    if user_ac_map[problem_id]:
-                        continue
-                    file_name = f"{user.username}_{id2display_id[submission.problem_id]}.txt"
-                    compression = zipfile.ZIP_DEFLATED
-                    zip_file.writestr(zinfo_or_arcname=f"{file_name}",
-                                      data=submission.code,
-                                      compress_type=compression)
-                    user_ac_map[problem_id] = True
+                file_name = f"{user.username}_{id2display_id[problem_id]}.txt"
+                zip_file.writestr(zinfo_or_arcname=file_name,
+                                  data=code,
+                                  compress_type=zipfile.ZIP_DEFLATED)
         return path
 
     def get(self, request):
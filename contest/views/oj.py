@@ -6,7 +6,7 @@ from django.utils.timezone import now
 from django.core.cache import cache
 
 from problem.models import Problem
-from utils.api import APIView, validate_serializer
+from utils.api import APIView, cache_response, validate_serializer
 from utils.constants import CacheKey, CONTEST_PASSWORD_SESSION_KEY
 from utils.shortcuts import datetime2str, check_is_id
 from account.models import AdminType
@@ -32,7 +32,13 @@ class ContestAnnouncementListAPI(APIView):
         return self.success(ContestAnnouncementSerializer(data, many=True).data)
 
 
+def _refresh_now(data):
+    data["now"] = datetime2str(now())
+
+
 class ContestAPI(APIView):
+    # 比赛状态最多延迟 10 秒, 当前时间每次都重新计算
+    @cache_response(ttl=10, tags=["contest"], refresh=_refresh_now)
     def get(self, request):
         id = request.GET.get("id")
         if not id or not check_is_id(id):
@@ -47,6 +53,7 @@ class ContestAPI(APIView):
 
 
 class ContestListAPI(APIView):
+    @cache_response(ttl=10, tags=["contest"])
     def get(self, request):
         contests = Contest.objects.select_related("created_by").filter(visible=True)
         keyword = request.GET.get("keyword")
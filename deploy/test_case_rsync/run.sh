@@ -4,7 +4,7 @@ slave_runner()
 {
     while true
     do
-        rsync -avzP --delete --progress --password-file=/etc/rsync_slave.passwd $RSYNC_USER@$RSYNC_MASTER_ADDR::testcase /test_case >> /log/rsync_slave.log
+        rsync -avzHP --delete --progress --password-file=/etc/rsync_slave.passwd $RSYNC_USER@$RSYNC_MASTER_ADDR::testcase /test_case >> /log/rsync_slave.log
         sleep 5
     done
 }
@@ -18,7 +18,10 @@ master_runner()
     done
 }
 
-if [ "$RSYNC_MODE" = "master" ]; then
+if [ "$RSYNC_MODE" = "replica" ]; then
+    # 按变更记录增量同步, 见 sync.py
+    exec python3 /tmp/sync.py
+elif [ "$RSYNC_MODE" = "master" ]; then
     if [ ! -f "/etc/rsyncd.passwd" ]; then
         echo "$RSYNC_USER:$RSYNC_PASSWORD" > /etc/rsyncd.passwd
     fi
@@ -0,0 +1,148 @@
+"""
+判题机一侧的测试用例增量同步: 按照 web 端的变更记录, 只下载新增或者修改的文件, 下载之后校验 sha256
+
+环境变量:
+    BACKEND_URL             web 端地址, 例如 http://oj-backend:8000
+    JUDGE_SERVER_TOKEN      和判题服务器相同的 token
+    JUDGE_SERVER_HOSTNAME   判题服务器心跳中上报的 hostname, 默认为本机 hostname
+    TEST_CASE_DIR           默认为 /test_case
+    SYNC_INTERVAL           没有新变更时的轮询间隔, 单位秒, 默认为 1
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import socket
+import time
+import urllib.parse
+import urllib.request
+
+BACKEND_URL = os.environ.get("BACKEND_URL", "").rstrip("/")
+TOKEN = hashlib.sha256(os.environ.get("JUDGE_SERVER_TOKEN", "").encode("utf-8")).hexdigest()
+HOSTNAME = os.environ.get("JUDGE_SERVER_HOSTNAME") or socket.gethostname()
+TEST_CASE_DIR = os.environ.get("TEST_CASE_DIR", "/test_case")
+SYNC_INTERVAL = float(os.environ.get("SYNC_INTERVAL", 1))
+# 没有新变更的时候也定期上报, 判题机重新注册之后 web 端才能拿到序号
+REPORT_INTERVAL = 30
+SEQ_FILE = os.path.join(TEST_CASE_DIR, ".sync_seq")
+CHUNK_SIZE = 1024 * 1024
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("test_case_sync")
+
+
+class SyncError(Exception):
+    pass
+
+
+def _open(path, params=None, data=None):
+    url = f"{BACKEND_URL}/api/{path}"
+    if params:
+        url = f"{url}?{urllib.parse.urlencode(params)}"
+    body = json.dumps(data).encode("utf-8") if data is not None else None
+    request = urllib.request.Request(url, data=body, headers={"X-Judge-Server-Token": TOKEN,
+                                                              "Content-Type": "application/json"})
+    return urllib.request.urlopen(request, timeout=30)
+
+
+def api(path, params=None, data=None):
+    with _open(path, params, data) as resp:
+        result = json.loads(resp.read().decode("utf-8"))
+    if result["error"]:
+        raise SyncError(result["data"])
+    return result["data"]
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class Replica:
+    def __init__(self):
+        self.seq = self._load_seq()
+        # sha256 => 本地已有的文件, 相同内容直接创建硬链接, 不再重复下载
+        self.known = {}
+        self.last_report = 0
+
+    @staticmethod
+    def _load_seq():
+        try:
+            with open(SEQ_FILE, "r") as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _save_seq(self):
+        tmp_path = SEQ_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(str(self.seq))
+        os.replace(tmp_path, SEQ_FILE)
+
+    def _fetch(self, test_case_id, name, sha256, path):
+        tmp_path = path + ".tmp"
+        source = self.known.get(sha256)
+        if source and os.path.exists(source):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            os.link(source, tmp_path)
+        else:
+            digest = hashlib.sha256()
+            with _open("judge_server/test_case_file", {"test_case_id": test_case_id, "name": name}) as resp, \
+                    open(tmp_path, "wb") as f:
+                for chunk in iter(lambda: resp.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    f.write(chunk)
+            if digest.hexdigest() != sha256:
+                os.remove(tmp_path)
+                raise SyncError(f"Hash mismatch: {test_case_id}/{name}")
+        os.replace(tmp_path, path)
+
+    def apply(self, change):
+        test_case_dir = os.path.join(TEST_CASE_DIR, change["test_case_id"])
+        if change["deleted"]:
+            shutil.rmtree(test_case_dir, ignore_errors=True)
+            return
+        os.makedirs(test_case_dir, exist_ok=True)
+        for name, sha256 in change["files"].items():
+            path = os.path.join(test_case_dir, name)
+            # 之前同步过一半, 或者已经通过 rsync 得到的文件
+            if not (os.path.isfile(path) and file_sha256(path) == sha256):
+                self._fetch(change["test_case_id"], name, sha256, path)
+            self.known[sha256] = path
+
+    def report(self):
+        api("judge_server/test_case_changes", data={"hostname": HOSTNAME, "seq": self.seq})
+        self.last_report = time.time()
+
+    def sync_once(self):
+        """
+        :return: 是否还有没有拉取的变更
+        """
+        changes = api("judge_server/test_case_changes", {"since": self.seq})
+        for change in changes:
+            self.apply(change)
+            self.seq = change["seq"]
+        if changes:
+            self._save_seq()
+            logger.info("synced to %d", self.seq)
+        if changes or time.time() - self.last_report > REPORT_INTERVAL:
+            self.report()
+        return bool(changes)
+
+    def run(self):
+        while True:
+            try:
+                if self.sync_once():
+                    continue
+            except Exception as e:
+                logger.exception(e)
+            time.sleep(SYNC_INTERVAL)
+
+
+if __name__ == "__main__":
+    Replica().run()
@@ -1,36 +1,89 @@
 #!/usr/bin/env python3
 import base64
 import copy
+import io
 import random
+import shutil
 import string
 import hashlib
 import json
 import os
 import xml.etree.ElementTree as ET
 
+CHUNK_SIZE = 1024 * 1024
+
+
+def _random_name():
+    return "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(12))
+
 
 class FPSParser(object):
     def __init__(self, fps_path=None, string_data=None):
         if fps_path:
-            self._etree = ET.parse(fps_path).getroot()
+            self._fps_path = fps_path
+            self._data = None
         elif string_data:
-            self._ertree = ET.fromstring(string_data).getroot()
+            self._fps_path = None
+            self._data = string_data.encode("utf-8") if isinstance(string_data, str) else string_data
         else:
             raise ValueError("You must tell me the file path or directly give me the data for the file")
-        version = self._etree.attrib.get("version", "No Version")
+        # 只读取根节点检查版本, 不解析整个文件
+        with self._open() as f:
+            _, root = next(ET.iterparse(f, events=("start", )))
+        version = root.attrib.get("version", "No Version")
         if version not in ["1.1", "1.2"]:
             raise ValueError("Unsupported version '" + version + "'")
 
-    @property
-    def etree(self):
-        return self._etree
+    def _open(self):
+        if self._fps_path:
+            return open(self._fps_path, "rb")
+        return io.BytesIO(self._data)
 
     def parse(self):
-        ret = []
-        for node in self._etree:
-            if node.tag == "item":
-                ret.append(self._parse_one_problem(node))
-        return ret
+        return list(self.iter_problems())
+
+    def iter_problems(self, spool_dir=None):
+        """
+        使用 iterparse 逐个返回题目, 每个 item 处理完之后就从树中删除, 内存占用只和最大的一道题有关
+        :param spool_dir: 如果指定, 测试数据和图片在对应的节点解析完成的时候就写入这个目录,
+            题目中用 input_file, output_file 和图片的 file 表示, 不再保留在内存中
+        """
+        with self._open() as f:
+            context = ET.iterparse(f, events=("start", "end"))
+            _, root = next(context)
+            depth = 1
+            for event, elem in context:
+                if event == "start":
+                    depth += 1
+                    continue
+                depth -= 1
+                if spool_dir and depth == 2 and elem.tag in ["test_input", "test_output"]:
+                    self._spool_text(elem, spool_dir)
+                elif spool_dir and depth == 3 and elem.tag == "base64":
+                    self._spool_base64(elem, spool_dir)
+                elif depth == 1 and elem.tag == "item":
+                    yield self._parse_one_problem(elem)
+                    root.clear()
+
+    @staticmethod
+    def _spool_text(elem, spool_dir):
+        path = os.path.join(spool_dir, _random_name())
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(elem.text or "")
+        elem.text = None
+        elem.set("file", path)
+
+    @staticmethod
+    def _spool_base64(elem, spool_dir):
+        data = "".join((elem.text or "").split())
+        path = os.path.join(spool_dir, _random_name())
+        # 4 的整数倍, 每一块都可以单独解码
+        step = CHUNK_SIZE * 4
+        with open(path, "wb") as f:
+            for start in range(0, len(data), step):
+                f.write(base64.b64decode(data[start:start + step]))
+        elem.text = None
+        elem.set("file", path)
 
     def _parse_one_problem(self, node):
         sample_start = True
@@ -81,7 +134,10 @@ class FPSParser(object):
                     if child.tag == "src":
                         problem["images"][-1]["src"] = child.text
                     elif child.tag == "base64":
-                        problem["images"][-1]["blob"] = base64.b64decode(child.text)
+                        if child.get("file"):
+                            problem["images"][-1]["file"] = child.get("file")
+                        else:
+                            problem["images"][-1]["blob"] = base64.b64decode(child.text)
             elif tag == "sample_input":
                 if not sample_start:
                     raise ValueError("Invalid xml, error 'sample_input' tag order")
@@ -96,11 +152,15 @@ class FPSParser(object):
                 if not test_case_start:
                     raise ValueError("Invalid xml, error 'test_input' tag order")
                 problem["test_cases"].append({"input": item.text, "output": None})
+                if item.get("file"):
+                    problem["test_cases"][-1]["input_file"] = item.get("file")
                 test_case_start = False
             elif tag == "test_output":
                 if test_case_start:
                     raise ValueError("Invalid xml, error 'test_output' tag order")
                 problem["test_cases"][-1]["output"] = item.text
+                if item.get("file"):
+                    problem["test_cases"][-1]["output_file"] = item.get("file")
                 test_case_start = True
 
         return problem
@@ -110,15 +170,33 @@ class FPSHelper(object):
     def save_image(self, problem, base_dir, base_url):
         _problem = copy.deepcopy(problem)
         for img in _problem["images"]:
-            name = "".join(random.choice(string.ascii_lowercase + string.digits) for _ in range(12))
             ext = os.path.splitext(img["src"])[1]
-            file_name = name + ext
-            with open(os.path.join(base_dir, file_name), "wb") as f:
-                f.write(img["blob"])
+            file_name = _random_name() + ext
+            if img.get("file"):
+                shutil.move(img["file"], os.path.join(base_dir, file_name))
+            else:
+                with open(os.path.join(base_dir, file_name), "wb") as f:
+                    f.write(img["blob"])
             for item in ["description", "input", "output"]:
                 _problem[item] = _problem[item].replace(img["src"], os.path.join(base_url, file_name))
         return _problem
 
+    @staticmethod
+    def _stripped_md5(path):
+        """
+        分块计算去掉末尾空白之后的 md5
+        """
+        md5 = hashlib.md5()
+        # 还不能确定是否位于文件末尾的空白字符, 暂不计入 md5
+        pending_space = b""
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                data = pending_space + chunk
+                stripped = data.rstrip()
+                md5.update(stripped)
+                pending_space = data[len(stripped):]
+        return md5.hexdigest()
+
     # {
     #     "spj": false,
     #     "test_cases": {
@@ -135,26 +213,41 @@ class FPSHelper(object):
         spj = problem.get("spj", {})
         test_cases = {}
         for index, item in enumerate(problem["test_cases"]):
-            input_content = item.get("input")
-            output_content = item.get("output")
-            if input_content:
-                with open(os.path.join(base_dir, str(index + 1) + ".in"), "w", encoding="utf-8") as f:
-                    f.write(input_content)
-            if output_content:
-                with open(os.path.join(base_dir, str(index + 1) + ".out"), "w", encoding="utf-8") as f:
-                    f.write(output_content)
+            if item.get("input_file"):
+                input_path = os.path.join(base_dir, str(index + 1) + ".in")
+                shutil.move(item["input_file"], input_path)
+                input_size = os.path.getsize(input_path)
+            else:
+                input_content = item.get("input")
+                if input_content:
+                    with open(os.path.join(base_dir, str(index + 1) + ".in"), "w", encoding="utf-8") as f:
+                        f.write(input_content)
+                input_size = len(input_content)
+            if item.get("output_file"):
+                output_path = os.path.join(base_dir, str(index + 1) + ".out")
+                shutil.move(item["output_file"], output_path)
+                output_size = os.path.getsize(output_path)
+                output_md5 = self._stripped_md5(output_path)
+            else:
+                output_content = item.get("output")
+                if output_content:
+                    with open(os.path.join(base_dir, str(index + 1) + ".out"), "w", encoding="utf-8") as f:
+                        f.write(output_content)
+                if not spj:
+                    output_size = len(output_content)
+                    output_md5 = hashlib.md5(output_content.rstrip().encode("utf-8")).hexdigest()
             if spj:
                 one_info = {
-                    "input_size": len(input_content),
+                    "input_size": input_size,
                     "input_name": f"{index + 1}.in"
                 }
             else:
                 one_info = {
-                    "input_size": len(input_content),
+                    "input_size": input_size,
                     "input_name": f"{index + 1}.in",
-                    "output_size": len(output_content),
+                    "output_size": output_size,
                     "output_name": f"{index + 1}.out",
-                    "stripped_output_md5": hashlib.md5(output_content.rstrip().encode("utf-8")).hexdigest()
+                    "stripped_output_md5": output_md5
                 }
             test_cases[index] = one_info
         info = {
@@ -8,10 +8,11 @@ from django.db import transaction, IntegrityError
 from django.db.models import F
 
 from account.models import User
+from account.rank import update_user_rank
 from conf.models import JudgeServer
 from contest.models import ContestRuleType, ACMContestRank, OIContestRank, ContestStatus
 from options.options import SysOptions
-from problem.models import Problem, ProblemRuleType
+from problem.models import Problem, ProblemRuleType, TestCaseChangeLog, UserProblemStatus
 from problem.utils import parse_problem_template
 from submission.models import JudgeStatus, Submission
 from utils.cache import cache
@@ -32,13 +33,23 @@ def process_pending_task():
 
 
 class ChooseJudgeServer:
-    def __init__(self):
+    def __init__(self, test_case_id=None):
         self.server = None
+        self.test_case_id = test_case_id
+
+    def _required_test_case_seq(self):
+        if not self.test_case_id:
+            return 0
+        seq = TestCaseChangeLog.objects.filter(test_case_id=self.test_case_id) \
+            .order_by("-id").values_list("id", flat=True).first()
+        return seq or 0
 
     def __enter__(self) -> [JudgeServer, None]:
+        seq = self._required_test_case_seq()
         with transaction.atomic():
             servers = JudgeServer.objects.select_for_update().filter(is_disabled=False).order_by("task_number")
-            servers = [s for s in servers if s.status == "normal"]
+            # 还没有同步到这个测试用例的判题机不参与分配, test_case_seq 为 null 的判题机使用 rsync 同步, 无法判断
+            servers = [s for s in servers if s.status == "normal" and (s.test_case_seq is None or s.test_case_seq >= seq)]
             for server in servers:
                 if server.task_number <= server.cpu_core * 2:
                     server.task_number = F("task_number") + 1
@@ -69,8 +80,7 @@ class DispatcherBase(object):
 class SPJCompiler(DispatcherBase):
     def __init__(self, spj_code, spj_version, spj_language):
         super().__init__()
-        spj_compile_config = list(filter(lambda config: spj_language == config["name"], SysOptions.spj_languages))[0]["spj"][
-            "compile"]
+        spj_compile_config = SysOptions.language_registry.spj_configs[spj_language]["compile"]
         self.data = {
             "src": spj_code,
             "spj_version": spj_version,
@@ -124,13 +134,11 @@ class JudgeDispatcher(DispatcherBase):
 
     def judge(self):
         language = self.submission.language
-        sub_config = list(filter(lambda item: language == item["name"], SysOptions.languages))[0]
+        registry = SysOptions.language_registry
+        sub_config = registry.configs[language]
         spj_config = {}
         if self.problem.spj_code:
-            for lang in SysOptions.spj_languages:
-                if lang["name"] == self.problem.spj_language:
-                    spj_config = lang["spj"]
-                    break
+            spj_config = registry.spj_configs.get(self.problem.spj_language, {})
 
         if language in self.problem.template:
             template = parse_problem_template(self.problem.template[language])
@@ -152,7 +160,7 @@ class JudgeDispatcher(DispatcherBase):
             "io_mode": self.problem.io_mode
         }
 
-        with ChooseJudgeServer() as server:
+        with ChooseJudgeServer(self.problem.test_case_id) as server:
             if not server:
                 data = {"submission_id": self.submission.id, "problem_id": self.problem.id}
                 cache.lpush(CacheKey.waiting_queue, json.dumps(data))
@@ -201,9 +209,31 @@ class JudgeDispatcher(DispatcherBase):
         # 至此判题结束，尝试处理任务队列中剩余的任务
         process_pending_task()
 
+    def _update_user_problem_status(self, user_profile):
+        """
+        更新 UserProblemStatus 以及 profile 中的 accepted_number 和 total_score, 调用方需要持有 user 的行锁
+        已经 AC 的题目不再更新
+        """
+        score = self.submission.statistic_info.get("score", 0)
+        problem_status, created = UserProblemStatus.objects.select_for_update().get_or_create(
+            user_id=self.submission.user_id, problem_id=self.problem.id,
+            defaults={"contest_id": self.contest_id, "status": self.submission.result, "score": score})
+        last_time_score = 0
+        if not created:
+            if problem_status.status == JudgeStatus.ACCEPTED:
+                return
+            last_time_score = problem_status.score
+            problem_status.status = self.submission.result
+            problem_status.score = score
+            problem_status.save(update_fields=["status", "score"])
+        if self.problem.rule_type == ProblemRuleType.OI:
+            # minus last time score, add this time score
+            user_profile.add_score(this_time_score=score, last_time_score=last_time_score)
+        if self.submission.result == JudgeStatus.ACCEPTED:
+            user_profile.accepted_number += 1
+
     def update_problem_status_rejudge(self):
         result = str(self.submission.result)
-        problem_id = str(self.problem.id)
         with transaction.atomic():
             # update problem status
             problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
@@ -215,32 +245,12 @@ class JudgeDispatcher(DispatcherBase):
             problem.save(update_fields=["accepted_number", "statistic_info"])
 
             profile = User.objects.select_for_update().get(id=self.submission.user_id).userprofile
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = profile.acm_problems_status.get("problems", {})
-                if acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.acm_problems_status["problems"] = acm_problems_status
-                profile.save(update_fields=["accepted_number", "acm_problems_status"])
-
-            else:
-                oi_problems_status = profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this tim score
-                    profile.add_score(this_time_score=score,
-                                      last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        profile.accepted_number += 1
-                profile.oi_problems_status["problems"] = oi_problems_status
-                profile.save(update_fields=["accepted_number", "oi_problems_status"])
+            self._update_user_problem_status(profile)
+            profile.save(update_fields=["accepted_number"])
+        update_user_rank(self.submission.user_id)
 
     def update_problem_status(self):
         result = str(self.submission.result)
-        problem_id = str(self.problem.id)
         with transaction.atomic():
             # update problem status
             problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
@@ -255,69 +265,25 @@ class JudgeDispatcher(DispatcherBase):
             user = User.objects.select_for_update().get(id=self.submission.user_id)
             user_profile = user.userprofile
             user_profile.submission_number += 1
-            if problem.rule_type == ProblemRuleType.ACM:
-                acm_problems_status = user_profile.acm_problems_status.get("problems", {})
-                if problem_id not in acm_problems_status:
-                    acm_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif acm_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    acm_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.acm_problems_status["problems"] = acm_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "acm_problems_status"])
-
-            else:
-                oi_problems_status = user_profile.oi_problems_status.get("problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in oi_problems_status:
-                    user_profile.add_score(score)
-                    oi_problems_status[problem_id] = {"status": self.submission.result,
-                                                      "_id": self.problem._id,
-                                                      "score": score}
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                elif oi_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    # minus last time score, add this time score
-                    user_profile.add_score(this_time_score=score,
-                                           last_time_score=oi_problems_status[problem_id]["score"])
-                    oi_problems_status[problem_id]["score"] = score
-                    oi_problems_status[problem_id]["status"] = self.submission.result
-                    if self.submission.result == JudgeStatus.ACCEPTED:
-                        user_profile.accepted_number += 1
-                user_profile.oi_problems_status["problems"] = oi_problems_status
-                user_profile.save(update_fields=["submission_number", "accepted_number", "oi_problems_status"])
+            self._update_user_problem_status(user_profile)
+            user_profile.save(update_fields=["submission_number", "accepted_number"])
+        update_user_rank(self.submission.user_id)
 
     def update_contest_problem_status(self):
         with transaction.atomic():
-            user = User.objects.select_for_update().get(id=self.submission.user_id)
-            user_profile = user.userprofile
-            problem_id = str(self.problem.id)
-            if self.contest.rule_type == ContestRuleType.ACM:
-                contest_problems_status = user_profile.acm_problems_status.get("contest_problems", {})
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result, "_id": self.problem._id}
-                elif contest_problems_status[problem_id]["status"] != JudgeStatus.ACCEPTED:
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                else:
+            # 串行化同一用户的状态更新
+            User.objects.select_for_update().get(id=self.submission.user_id)
+            score = self.submission.statistic_info.get("score", 0)
+            problem_status, created = UserProblemStatus.objects.select_for_update().get_or_create(
+                user_id=self.submission.user_id, problem_id=self.problem.id,
+                defaults={"contest_id": self.contest_id, "status": self.submission.result, "score": score})
+            if not created:
+                if self.contest.rule_type == ContestRuleType.ACM and problem_status.status == JudgeStatus.ACCEPTED:
                     # 如果已AC， 直接跳过 不计入任何计数器
                     return
-                user_profile.acm_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["acm_problems_status"])
-
-            elif self.contest.rule_type == ContestRuleType.OI:
-                contest_problems_status = user_profile.oi_problems_status.get("contest_problems", {})
-                score = self.submission.statistic_info["score"]
-                if problem_id not in contest_problems_status:
-                    contest_problems_status[problem_id] = {"status": self.submission.result,
-                                                           "_id": self.problem._id,
-                                                           "score": score}
-                else:
-                    contest_problems_status[problem_id]["score"] = score
-                    contest_problems_status[problem_id]["status"] = self.submission.result
-                user_profile.oi_problems_status["contest_problems"] = contest_problems_status
-                user_profile.save(update_fields=["oi_problems_status"])
+                problem_status.status = self.submission.result
+                problem_status.score = score
+                problem_status.save(update_fields=["status", "score"])
 
             problem = Problem.objects.select_for_update().get(contest_id=self.contest_id, id=self.problem.id)
             result = str(self.submission.result)
@@ -57,6 +57,7 @@ LOCAL_APPS = [
 INSTALLED_APPS = VENDOR_APPS + LOCAL_APPS
 
 MIDDLEWARE = (
+    'account.middleware.ProfilerMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -67,7 +68,6 @@ MIDDLEWARE = (
     'django.middleware.security.SecurityMiddleware',
     'account.middleware.AdminRoleRequiredMiddleware',
     'account.middleware.SessionRecordMiddleware',
-    # 'account.middleware.LogSqlMiddleware',
 )
 ROOT_URLCONF = 'oj.urls'
 
@@ -127,6 +127,12 @@ STATIC_URL = '/public/'
 AUTH_USER_MODEL = 'account.User'
 
 TEST_CASE_DIR = os.path.join(DATA_DIR, "test_case")
+# 按内容保存的测试用例文件, 必须和 TEST_CASE_DIR 在同一个文件系统中
+TEST_CASE_BLOB_DIR = os.path.join(DATA_DIR, "test_case_blob")
+# 测试用例下载的压缩包缓存, 不在 TEST_CASE_DIR 中, 不会同步到判题机
+TEST_CASE_ARCHIVE_DIR = os.path.join(DATA_DIR, "test_case_archive")
+# 没有被引用的测试用例超过这个时间才会被回收, 单位秒. 需要长于判题时间, 以及上传测试用例到保存题目之间的时间
+TEST_CASE_GC_GRACE = 3600 * 24
 LOG_PATH = os.path.join(DATA_DIR, "log")
 
 AVATAR_URI_PREFIX = "/public/avatar"
@@ -246,4 +252,7 @@ RAVEN_CONFIG = {
 
 IP_HEADER = "HTTP_X_REAL_IP"
 
+# ProfilerMiddleware 的采样比例, 0 表示关闭
+PROFILER_SAMPLE_RATE = float(get_env("PROFILER_SAMPLE_RATE", "0.01"))
+
 DEFAULT_AUTO_FIELD='django.db.models.AutoField'
\ No newline at end of file
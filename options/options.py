@@ -1,10 +1,16 @@
+import copy
 import functools
+import hashlib
+import json
 import os
 import threading
 import time
+from types import MappingProxyType
 
-from django.db import transaction, IntegrityError
+from django.db import connection, transaction, IntegrityError
 
+from utils.cache import cache
+from utils.constants import CacheKey
 from utils.shortcuts import rand_str
 from judge.languages import languages
 from .models import SysOptions as SysOptionsModel
@@ -87,6 +93,77 @@ class my_property:
 DEFAULT_SHORT_TTL = 2
 
 
+class _OptionCache:
+    """
+    进程内所有配置项的缓存, 一次查询全部加载.
+    配置修改之后更新 redis 中的版本号, 每次读取时比较版本号, 版本号变化之后才重新查询数据库
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        # (配置项, 由配置项计算出的对象), 两者总是一起替换
+        self.snapshot = ({}, {})
+        # 在事务中修改过配置的线程, 事务结束之前读到的值可能被回滚, 不能放入缓存
+        self.local = threading.local()
+
+    def get(self, loader):
+        return self.get_snapshot(loader)[0]
+
+    def derive(self, name, builder, loader):
+        """
+        由配置项计算出的对象, 每个版本只计算一次, 返回的对象被所有线程共享, 不能修改
+        """
+        values, derived = self.get_snapshot(loader)
+        if name not in derived:
+            derived[name] = builder(values)
+        return derived[name]
+
+    def get_snapshot(self, loader):
+        if getattr(self.local, "dirty", False):
+            if connection.in_atomic_block:
+                return loader(), {}
+            self.local.dirty = False
+            self.version = None
+        version = cache.get(CacheKey.options_version)
+        if version is None:
+            version = rand_str()
+            # 其他进程可能同时写入, 以写入成功的为准
+            if not cache.add(CacheKey.options_version, version, timeout=None):
+                version = cache.get(CacheKey.options_version)
+        if version != self.version:
+            with self.lock:
+                if version != self.version:
+                    self.snapshot = (loader(), {})
+                    self.version = version
+        return self.snapshot
+
+    def invalidate(self):
+        if connection.in_atomic_block:
+            self.local.dirty = True
+        self.version = None
+        cache.set(CacheKey.options_version, rand_str(), timeout=None)
+
+
+_option_cache = _OptionCache()
+
+
+class LanguageRegistry:
+    """
+    判题、提交校验和语言列表共用的语言配置索引
+    """
+    def __init__(self, languages):
+        self.languages = languages
+        self.spj_languages = [item for item in languages if "spj" in item]
+        self.names = tuple(item["name"] for item in languages)
+        self.spj_names = tuple(item["name"] for item in self.spj_languages)
+        self.name_set = frozenset(self.names)
+        self.spj_name_set = frozenset(self.spj_names)
+        self.configs = MappingProxyType({item["name"]: item for item in languages})
+        self.spj_configs = MappingProxyType({item["name"]: item["spj"] for item in self.spj_languages})
+        content = json.dumps(languages, sort_keys=True).encode("utf-8")
+        self.etag = f'"{hashlib.md5(content).hexdigest()}"'
+
+
 def default_token():
     token = os.environ.get("JUDGE_SERVER_TOKEN")
     return token if token else rand_str()
@@ -115,7 +192,11 @@ class OptionDefaultValue:
     smtp_config = {}
     judge_server_token = default_token
     throttling = {"ip": {"capacity": 100, "fill_rate": 0.1, "default_capacity": 50},
-                  "user": {"capacity": 20, "fill_rate": 0.03, "default_capacity": 10}}
+                  "user": {"capacity": 20, "fill_rate": 0.03, "default_capacity": 10},
+                  "api_key": {"capacity": 60, "fill_rate": 0.5, "default_capacity": 60},
+                  "login": {"limit": 60, "window": 300},
+                  "register": {"limit": 20, "window": 3600},
+                  "captcha": {"limit": 120, "window": 300}}
     languages = languages
 
 
@@ -137,14 +218,23 @@ class _SysOptionsMeta(type):
                     pass
 
     @classmethod
-    def _get_option(mcs, option_key):
-        try:
-            option = SysOptionsModel.objects.get(key=option_key)
-            value = option.value
-            return value
-        except SysOptionsModel.DoesNotExist:
+    def _load_options(mcs):
+        values = dict(SysOptionsModel.objects.values_list("key", "value"))
+        if any(key not in values for key in mcs._get_keys()):
             mcs._init_option()
-            return mcs._get_option(option_key)
+            values = dict(SysOptionsModel.objects.values_list("key", "value"))
+        return values
+
+    @classmethod
+    def _invalidate(mcs):
+        _option_cache.invalidate()
+        # 在外层事务中修改的时候, 提交之前其他进程可能已经按照新的版本号读到了旧的值, 提交之后再更新一次
+        transaction.on_commit(_option_cache.invalidate)
+
+    @classmethod
+    def _get_option(mcs, option_key):
+        # 缓存被所有线程共享, 返回副本, 调用方修改返回的 dict 或者 list 不会影响缓存
+        return copy.deepcopy(_option_cache.get(mcs._load_options)[option_key])
 
     @classmethod
     def _set_option(mcs, option_key: str, option_value):
@@ -156,6 +246,7 @@ class _SysOptionsMeta(type):
         except SysOptionsModel.DoesNotExist:
             mcs._init_option()
             mcs._set_option(option_key, option_value)
+        mcs._invalidate()
 
     @classmethod
     def _increment(mcs, option_key):
@@ -168,6 +259,7 @@ class _SysOptionsMeta(type):
         except SysOptionsModel.DoesNotExist:
             mcs._init_option()
             return mcs._increment(option_key)
+        mcs._invalidate()
 
     @classmethod
     def set_options(mcs, options):
@@ -176,12 +268,10 @@ class _SysOptionsMeta(type):
 
     @classmethod
     def get_options(mcs, keys):
-        result = {}
-        for key in keys:
-            result[key] = mcs._get_option(key)
-        return result
+        values = _option_cache.get(mcs._load_options)
+        return {key: copy.deepcopy(values[key]) for key in keys}
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_base_url(cls):
         return cls._get_option(OptionKeys.website_base_url)
 
@@ -189,7 +279,7 @@ class _SysOptionsMeta(type):
     def website_base_url(cls, value):
         cls._set_option(OptionKeys.website_base_url, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name(cls):
         return cls._get_option(OptionKeys.website_name)
 
@@ -197,7 +287,7 @@ class _SysOptionsMeta(type):
     def website_name(cls, value):
         cls._set_option(OptionKeys.website_name, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_name_shortcut(cls):
         return cls._get_option(OptionKeys.website_name_shortcut)
 
@@ -205,7 +295,7 @@ class _SysOptionsMeta(type):
     def website_name_shortcut(cls, value):
         cls._set_option(OptionKeys.website_name_shortcut, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def website_footer(cls):
         return cls._get_option(OptionKeys.website_footer)
 
@@ -221,7 +311,7 @@ class _SysOptionsMeta(type):
     def allow_register(cls, value):
         cls._set_option(OptionKeys.allow_register, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def submission_list_show_all(cls):
         return cls._get_option(OptionKeys.submission_list_show_all)
 
@@ -253,7 +343,7 @@ class _SysOptionsMeta(type):
     def throttling(cls, value):
         cls._set_option(OptionKeys.throttling, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def languages(cls):
         return cls._get_option(OptionKeys.languages)
 
@@ -261,17 +351,23 @@ class _SysOptionsMeta(type):
     def languages(cls, value):
         cls._set_option(OptionKeys.languages, value)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
+    def language_registry(cls):
+        return _option_cache.derive("language_registry",
+                                    lambda values: LanguageRegistry(values[OptionKeys.languages]),
+                                    cls._load_options)
+
+    @my_property
     def spj_languages(cls):
-        return [item for item in cls.languages if "spj" in item]
+        return copy.deepcopy(cls.language_registry.spj_languages)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def language_names(cls):
-        return [item["name"] for item in cls.languages]
+        return list(cls.language_registry.names)
 
-    @my_property(ttl=DEFAULT_SHORT_TTL)
+    @my_property
     def spj_language_names(cls):
-        return [item["name"] for item in cls.languages if "spj" in item]
+        return list(cls.language_registry.spj_names)
 
     def reset_languages(cls):
         cls.languages = languages
@@ -1 +1,69 @@
-# Create your tests here.
+from unittest import mock
+
+from django.db import transaction
+
+from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import rand_str
+from .models import SysOptions as SysOptionsModel
+from .options import LanguageRegistry, OptionKeys, SysOptions, _option_cache
+
+
+class OptionCacheTest(APITestCase):
+    def setUp(self):
+        # 测试都在事务中运行, 之前的测试修改过配置会让这个线程一直直接读取数据库
+        _option_cache.local.dirty = False
+        self.website_name = SysOptions.website_name
+
+    def bump_version(self):
+        cache.set(CacheKey.options_version, rand_str(), timeout=None)
+
+    def test_read_after_version_changed(self):
+        # 其他进程修改了数据库, 版本号变化之前读到的是缓存
+        SysOptionsModel.objects.filter(key=OptionKeys.website_name).update(value="other process")
+        self.assertEqual(SysOptions.website_name, self.website_name)
+        self.bump_version()
+        self.assertEqual(SysOptions.website_name, "other process")
+
+        SysOptions.website_name = "new name"
+        self.assertEqual(SysOptions.website_name, "new name")
+
+    def test_rollback_not_cached(self):
+        try:
+            with transaction.atomic():
+                SysOptions.website_name = "rolled back"
+                self.assertEqual(SysOptions.website_name, "rolled back")
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual(SysOptions.website_name, self.website_name)
+        self.assertEqual(_option_cache.snapshot[0][OptionKeys.website_name], self.website_name)
+
+        _option_cache.local.dirty = False
+        self.bump_version()
+        self.assertEqual(SysOptions.website_name, self.website_name)
+
+    def test_returned_value_is_copy(self):
+        SysOptions.smtp_config = {"server": "smtp.test.com", "port": 25}
+        _option_cache.local.dirty = False
+        SysOptions.smtp_config["port"] = 465
+        throttling = SysOptions.get_options([OptionKeys.throttling])[OptionKeys.throttling]
+        throttling["user"]["capacity"] = 0
+        SysOptions.throttling["ip"]["capacity"] = 0
+
+        self.assertEqual(SysOptions.smtp_config["port"], 25)
+        self.assertNotEqual(SysOptions.throttling["user"]["capacity"], 0)
+        self.assertNotEqual(SysOptions.throttling["ip"]["capacity"], 0)
+
+    def test_registry_built_once_per_version(self):
+        with mock.patch("options.options.LanguageRegistry", wraps=LanguageRegistry) as registry:
+            self.bump_version()
+            first = SysOptions.language_registry
+            self.assertIs(SysOptions.language_registry, first)
+            self.assertEqual(SysOptions.language_names, list(first.names))
+            self.assertEqual(registry.call_count, 1)
+
+            self.bump_version()
+            self.assertIsNot(SysOptions.language_registry, first)
+            self.assertEqual(registry.call_count, 2)
@@ -0,0 +1,102 @@
+import json
+
+from redis.exceptions import WatchError
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+from .models import Problem
+
+# 索引定期整体重建一次, 修正增量更新中可能出现的偏差
+BROWSE_INDEX_TTL = 3600 * 24
+
+
+def _problem_state(problem):
+    if problem.contest_id is not None or not problem.visible:
+        return None
+    return {"_id": problem._id, "tags": list(problem.tags.values_list("id", flat=True))}
+
+
+def rebuild_index():
+    """
+    可见的公开题目: 每个 tag 下的题目数量, 所有题目的 _id, 以及每道题当前的 _id 和 tags, 用于增量更新
+    """
+    states = {}
+    rows = Problem.objects.filter(contest_id__isnull=True, visible=True).values_list("id", "_id", "tags__id")
+    for problem_id, display_id, tag_id in rows:
+        state = states.setdefault(problem_id, {"_id": display_id, "tags": []})
+        if tag_id is not None:
+            state["tags"].append(tag_id)
+    tag_counts = {}
+    for state in states.values():
+        for tag_id in state["tags"]:
+            tag_counts[tag_id] = tag_counts.get(tag_id, 0) + 1
+
+    pipe = cache.pipeline(transaction=True)
+    pipe.delete(CacheKey.problem_tag_count, CacheKey.problem_display_ids, CacheKey.problem_browse_state)
+    if tag_counts:
+        pipe.hset(CacheKey.problem_tag_count, mapping=tag_counts)
+    if states:
+        pipe.sadd(CacheKey.problem_display_ids, *[state["_id"] for state in states.values()])
+        pipe.hset(CacheKey.problem_browse_state,
+                  mapping={problem_id: json.dumps(state) for problem_id, state in states.items()})
+    pipe.set(CacheKey.problem_browse_ready, 1, ex=BROWSE_INDEX_TTL)
+    pipe.execute()
+
+
+def _ensure_index():
+    if not cache.exists(CacheKey.problem_browse_ready):
+        rebuild_index()
+
+
+def update_problem(problem_id, problem=None):
+    """
+    题目被修改或者删除(problem 为 None)之后, 根据前后状态的差异更新索引
+    """
+    if not cache.exists(CacheKey.problem_browse_ready):
+        # 索引还没有建立, 下次读取的时候会整体重建
+        return
+    new = _problem_state(problem) if problem is not None else None
+    # 先读取旧的状态再修改计数, 同时更新同一道题的时候需要 WATCH, 否则会重复计数
+    with cache.pipeline() as pipe:
+        while True:
+            try:
+                pipe.watch(CacheKey.problem_browse_state)
+                old = pipe.hget(CacheKey.problem_browse_state, problem_id)
+                old = json.loads(old) if old else None
+                if old == new:
+                    return
+                pipe.multi()
+                if old:
+                    pipe.srem(CacheKey.problem_display_ids, old["_id"])
+                    for tag_id in old["tags"]:
+                        pipe.hincrby(CacheKey.problem_tag_count, tag_id, -1)
+                    pipe.hdel(CacheKey.problem_browse_state, problem_id)
+                if new:
+                    pipe.sadd(CacheKey.problem_display_ids, new["_id"])
+                    for tag_id in new["tags"]:
+                        pipe.hincrby(CacheKey.problem_tag_count, tag_id, 1)
+                    pipe.hset(CacheKey.problem_browse_state, problem_id, json.dumps(new))
+                pipe.execute()
+                return
+            except WatchError:
+                continue
+
+
+def invalidate_index():
+    cache.delete(CacheKey.problem_browse_ready)
+
+
+def get_tag_counts():
+    """
+    :return: {tag_id: 可见的公开题目数量}, 不包含数量为 0 的 tag
+    """
+    _ensure_index()
+    counts = cache.hgetall(CacheKey.problem_tag_count)
+    return {int(tag_id): int(count) for tag_id, count in counts.items() if int(count) > 0}
+
+
+def pick_random_problem():
+    _ensure_index()
+    display_id = cache.srandmember(CacheKey.problem_display_ids)
+    return display_id.decode("utf-8") if display_id is not None else None
@@ -0,0 +1,35 @@
+import hashlib
+import json
+
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import rand_str
+
+# 只缓存公开题目序列化后的数据, 与用户相关的 my_status 在取出之后再添加
+# 判题只更新提交数和通过数, 不会让缓存失效, 这些数字最多延迟 PROBLEM_CACHE_TTL 秒
+PROBLEM_CACHE_TTL = 300
+
+
+def _make_key(*args):
+    version = cache.get(CacheKey.problem_cache_version, "")
+    digest = hashlib.md5(json.dumps(args).encode("utf-8")).hexdigest()
+    return f"{CacheKey.problem_cache}:{version}:{digest}"
+
+
+def cached_problem_data(func, *args):
+    """
+    :param func: 缓存未命中时调用, 返回 None 的结果不会被缓存
+    :param args: 组成缓存 key 的参数, 需要可以 json 序列化
+    """
+    key = _make_key(*args)
+    data = cache.get(key)
+    if data is None:
+        data = func()
+        if data is not None:
+            cache.set(key, data, timeout=PROBLEM_CACHE_TTL)
+    return data
+
+
+def invalidate_problem_cache():
+    # 更换版本号之后旧的 key 不会再被访问, 等待过期即可
+    cache.set(CacheKey.problem_cache_version, rand_str())
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from problem.models import Problem
+from problem.search import index_problem
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search index of all public problems"
+
+    def handle(self, *args, **options):
+        count = 0
+        for problem in Problem.objects.filter(contest_id__isnull=True).prefetch_related("tags"):
+            index_problem(problem)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f"{count} problems indexed"))
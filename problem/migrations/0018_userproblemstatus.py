@@ -0,0 +1,33 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('contest', '0011_auto_20250812_2044'),
+        ('problem', '0017_problem_problem_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserProblemStatus',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.IntegerField()),
+                ('score', models.IntegerField(default=0)),
+                ('contest', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contest.contest')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='problem.problem')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'user_problem_status',
+                'unique_together': {('user', 'problem')},
+                'index_together': {('user', 'contest')},
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+from django.db import migrations
+
+
+def migrate_problems_status(apps, schema_editor):
+    UserProfile = apps.get_model("account", "UserProfile")
+    Problem = apps.get_model("problem", "Problem")
+    UserProblemStatus = apps.get_model("problem", "UserProblemStatus")
+
+    problem_ids = set(Problem.objects.filter(contest__isnull=True).values_list("id", flat=True))
+    batch = []
+    profiles = UserProfile.objects.only("user_id", "acm_problems_status", "oi_problems_status")
+    for profile in profiles.iterator(chunk_size=500):
+        for problems_status in (profile.acm_problems_status, profile.oi_problems_status):
+            for problem_id, item in (problems_status or {}).get("problems", {}).items():
+                problem_id = int(problem_id)
+                # 题目可能已经被删除
+                if problem_id not in problem_ids:
+                    continue
+                batch.append(UserProblemStatus(user_id=profile.user_id, problem_id=problem_id,
+                                               status=item["status"], score=item.get("score", 0)))
+        if len(batch) >= 1000:
+            UserProblemStatus.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    UserProblemStatus.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('account', '0013_auto_20250812_2044'),
+        ('problem', '0018_userproblemstatus'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrate_problems_status, reverse_code=migrations.RunPython.noop)
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0020_migrate_contest_problem_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProblemSearchToken',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.TextField()),
+                ('weight', models.IntegerField()),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='problem.problem')),
+            ],
+            options={
+                'db_table': 'problem_search_token',
+                'index_together': {('token', 'problem')},
+            },
+        ),
+    ]
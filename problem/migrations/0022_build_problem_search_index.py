@@ -0,0 +1,58 @@
+import re
+from collections import defaultdict
+
+from django.db import migrations
+from django.utils.html import strip_tags
+
+# 分词规则复制自编写迁移时的 problem.search, 之后修改 problem.search 不会改变这个迁移的结果
+_WORD_RE = re.compile(r"[0-9a-z]+")
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+MAX_TOKEN_LENGTH = 32
+
+
+def tokenize(text, prefix=False):
+    text = (text or "").lower()
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        word = word[:MAX_TOKEN_LENGTH]
+        tokens.append(word)
+        if prefix:
+            tokens.extend(word[:i] for i in range(1, len(word)))
+    for run in _CJK_RE.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def build_tokens(_id, title, tags, source, description):
+    weights = defaultdict(int)
+    for text, weight, prefix in ((_id, 20, True),
+                                 (title, 10, True),
+                                 (" ".join(tags), 6, True),
+                                 (source, 3, False),
+                                 (strip_tags(description or ""), 1, False)):
+        for token in set(tokenize(text, prefix=prefix)):
+            weights[token] += weight
+    return weights
+
+
+def build_search_index(apps, schema_editor):
+    Problem = apps.get_model("problem", "Problem")
+    ProblemSearchToken = apps.get_model("problem", "ProblemSearchToken")
+
+    for problem in Problem.objects.filter(contest__isnull=True).prefetch_related("tags"):
+        tags = [tag.name for tag in problem.tags.all()]
+        weights = build_tokens(problem._id, problem.title, tags, problem.source, problem.description)
+        ProblemSearchToken.objects.bulk_create([ProblemSearchToken(problem_id=problem.id, token=token, weight=weight)
+                                                for token, weight in weights.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0021_problemsearchtoken'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_search_index, reverse_code=migrations.RunPython.noop)
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0022_build_problem_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestCaseChangeLog',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('test_case_id', models.TextField(db_index=True)),
+                ('files', models.JSONField(default=dict)),
+                ('deleted', models.BooleanField(default=False)),
+                ('create_time', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'db_table': 'test_case_change_log',
+                'ordering': ('id',),
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 3.2.25 on 2026-10-19 17:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0023_testcasechangelog'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TestCaseReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('test_case_id', models.TextField(unique=True)),
+                ('size', models.BigIntegerField(default=0)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('last_used', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'test_case_reference',
+                'index_together': {('ref_count', 'last_used')},
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+import os
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.db import migrations
+from django.utils import timezone
+
+
+def build_test_case_reference(apps, schema_editor):
+    Problem = apps.get_model("problem", "Problem")
+    TestCaseReference = apps.get_model("problem", "TestCaseReference")
+
+    if not os.path.isdir(settings.TEST_CASE_DIR):
+        return
+    counts = Counter(Problem.objects.values_list("test_case_id", flat=True))
+    test_case_re = re.compile(r"^[a-zA-Z0-9]{32}$")
+    now = timezone.now()
+    batch = []
+    for item in os.scandir(settings.TEST_CASE_DIR):
+        if not item.is_dir() or not test_case_re.match(item.name):
+            continue
+        size = sum(f.stat().st_size for f in os.scandir(item.path) if f.is_file())
+        batch.append(TestCaseReference(test_case_id=item.name, size=size, ref_count=counts[item.name], last_used=now))
+        if len(batch) >= 1000:
+            TestCaseReference.objects.bulk_create(batch)
+            batch = []
+    TestCaseReference.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0024_testcasereference'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_test_case_reference, reverse_code=migrations.RunPython.noop)
+    ]
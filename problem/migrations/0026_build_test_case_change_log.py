@@ -0,0 +1,48 @@
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.db import migrations
+
+
+def file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def build_test_case_change_log(apps, schema_editor):
+    """
+    升级之前已经存在的测试用例目录没有变更记录, 新的判题机从 0 开始增量同步的时候不会下载它们
+    """
+    TestCaseChangeLog = apps.get_model("problem", "TestCaseChangeLog")
+
+    if not os.path.isdir(settings.TEST_CASE_DIR):
+        return
+    logged = set(TestCaseChangeLog.objects.values_list("test_case_id", flat=True).distinct())
+    test_case_re = re.compile(r"^[a-zA-Z0-9]{32}$")
+    batch = []
+    for item in sorted(os.scandir(settings.TEST_CASE_DIR), key=lambda x: x.name):
+        if not item.is_dir() or not test_case_re.match(item.name) or item.name in logged:
+            continue
+        files = {f.name: file_sha256(f.path) for f in sorted(os.scandir(item.path), key=lambda x: x.name)
+                 if f.is_file()}
+        batch.append(TestCaseChangeLog(test_case_id=item.name, files=files))
+        if len(batch) >= 1000:
+            TestCaseChangeLog.objects.bulk_create(batch)
+            batch = []
+    TestCaseChangeLog.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0025_build_test_case_reference'),
+    ]
+
+    operations = [
+        migrations.RunPython(build_test_case_change_log, reverse_code=migrations.RunPython.noop)
+    ]
@@ -99,3 +99,64 @@ class Problem(models.Model):
     def add_ac_number(self):
         self.accepted_number = models.F("accepted_number") + 1
         self.save(update_fields=["accepted_number"])
+
+
+class UserProblemStatus(models.Model):
+    """
+    用户在每道题上的做题状态, status 为 JudgeStatus, score 只在 OI 题目中使用
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+    # 冗余保存题目所属的比赛, 方便按比赛查询
+    contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)
+    status = models.IntegerField()
+    score = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "user_problem_status"
+        unique_together = (("user", "problem"),)
+        index_together = (("user", "contest"),)
+
+
+class ProblemSearchToken(models.Model):
+    """
+    公开题目的倒排索引, 由 problem.search 在题目保存之后更新
+    """
+    problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
+    token = models.TextField()
+    weight = models.IntegerField()
+
+    class Meta:
+        db_table = "problem_search_token"
+        index_together = (("token", "problem"),)
+
+
+class TestCaseChangeLog(models.Model):
+    """
+    测试用例目录的变更记录, id 就是变更序号, 判题机按序号增量同步
+    """
+    test_case_id = models.TextField(db_index=True)
+    # {文件名: sha256}
+    files = JSONField(default=dict)
+    deleted = models.BooleanField(default=False)
+    create_time = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = "test_case_change_log"
+        ordering = ("id",)
+
+
+class TestCaseReference(models.Model):
+    """
+    测试用例目录的引用计数, 在题目保存和删除的时候更新, 回收的时候不需要扫描整个 TEST_CASE_DIR
+    """
+    test_case_id = models.TextField(unique=True)
+    # 目录中文件的总大小
+    size = models.BigIntegerField(default=0)
+    ref_count = models.IntegerField(default=0)
+    # 最后一次被引用的时间, 刚上传还没有保存题目, 或者刚被替换的测试用例在宽限期内不会被回收
+    last_used = models.DateTimeField()
+
+    class Meta:
+        db_table = "test_case_reference"
+        index_together = (("ref_count", "last_used"),)
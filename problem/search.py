@@ -0,0 +1,87 @@
+import re
+from collections import defaultdict
+
+from django.db.models import Count, OuterRef, Q, Subquery, Sum
+from django.utils.html import strip_tags
+
+from .models import ProblemSearchToken
+
+_WORD_RE = re.compile(r"[0-9a-z]+")
+# 中日韩统一表意文字、日文假名和韩文音节, 没有分词器, 按单字和相邻两字建索引
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+")
+MAX_TOKEN_LENGTH = 32
+
+DISPLAY_ID_WEIGHT = 20
+TITLE_WEIGHT = 10
+TAG_WEIGHT = 6
+SOURCE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+
+
+def tokenize(text, prefix=False):
+    """
+    :param prefix: 是否同时索引单词的前缀, 用于标题等短文本, 可以实现输入时的前缀匹配
+    """
+    text = (text or "").lower()
+    tokens = []
+    for word in _WORD_RE.findall(text):
+        word = word[:MAX_TOKEN_LENGTH]
+        tokens.append(word)
+        if prefix:
+            tokens.extend(word[:i] for i in range(1, len(word)))
+    for run in _CJK_RE.findall(text):
+        tokens.extend(run)
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def tokenize_query(keyword):
+    keyword = keyword.lower()
+    tokens = set(word[:MAX_TOKEN_LENGTH] for word in _WORD_RE.findall(keyword))
+    for run in _CJK_RE.findall(keyword):
+        if len(run) == 1:
+            tokens.add(run)
+        else:
+            tokens.update(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def build_tokens(_id, title, tags, source, description):
+    """
+    :return: {token: weight}
+    """
+    weights = defaultdict(int)
+    for text, weight, prefix in ((_id, DISPLAY_ID_WEIGHT, True),
+                                 (title, TITLE_WEIGHT, True),
+                                 (" ".join(tags), TAG_WEIGHT, True),
+                                 (source, SOURCE_WEIGHT, False),
+                                 (strip_tags(description or ""), DESCRIPTION_WEIGHT, False)):
+        for token in set(tokenize(text, prefix=prefix)):
+            weights[token] += weight
+    return weights
+
+
+def index_problem(problem):
+    ProblemSearchToken.objects.filter(problem_id=problem.id).delete()
+    # 只有公开题目需要被搜索
+    if problem.contest_id is not None:
+        return
+    tags = problem.tags.values_list("name", flat=True)
+    weights = build_tokens(problem._id, problem.title, tags, problem.source, problem.description)
+    ProblemSearchToken.objects.bulk_create([ProblemSearchToken(problem_id=problem.id, token=token, weight=weight)
+                                            for token, weight in weights.items()], batch_size=1000)
+
+
+def search_problems(problems, keyword):
+    """
+    在 problems 中搜索 keyword, 每个词都需要命中, 按权重之和排序
+    """
+    tokens = tokenize_query(keyword)
+    if not tokens:
+        return problems.filter(Q(title__icontains=keyword) | Q(_id__icontains=keyword))
+    matched = ProblemSearchToken.objects.filter(token__in=tokens).values("problem_id") \
+        .annotate(hits=Count("token")).filter(hits=len(tokens)).values("problem_id")
+    rank = ProblemSearchToken.objects.filter(problem_id=OuterRef("id"), token__in=tokens).values("problem_id") \
+        .annotate(rank=Sum("weight")).values("rank")
+    return problems.filter(id__in=Subquery(matched)).annotate(search_rank=Subquery(rank)) \
+        .order_by("-search_rank", "create_time")
@@ -0,0 +1,66 @@
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .browse import invalidate_index, update_problem
+from .cache import invalidate_problem_cache
+from .models import Problem, ProblemTag
+from .search import index_problem
+from .storage import refresh_references
+
+# 判题时只会更新这些字段
+COUNTER_FIELDS = {"submission_number", "accepted_number", "statistic_info"}
+
+
+@receiver(pre_save, sender=Problem)
+def problem_saving(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= COUNTER_FIELDS:
+        return
+    # 记录修改之前的测试用例, 保存之后更新它的引用计数
+    if instance.pk:
+        instance._old_test_case_id = Problem.objects.filter(pk=instance.pk) \
+            .values_list("test_case_id", flat=True).first()
+
+
+@receiver(post_save, sender=Problem)
+def problem_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) <= COUNTER_FIELDS:
+        return
+    invalidate_problem_cache()
+    index_problem(instance)
+    update_problem(instance.id, instance)
+    refresh_references(instance.test_case_id, getattr(instance, "_old_test_case_id", None))
+
+
+@receiver(post_delete, sender=Problem)
+def problem_deleted(sender, instance, **kwargs):
+    invalidate_problem_cache()
+    update_problem(instance.id)
+    refresh_references(instance.test_case_id)
+
+
+@receiver(post_delete, sender=ProblemTag)
+def tag_deleted(sender, instance, **kwargs):
+    invalidate_problem_cache()
+    invalidate_index()
+
+
+@receiver(post_save, sender=ProblemTag)
+def tag_saved(sender, instance, created, **kwargs):
+    invalidate_problem_cache()
+    if not created:
+        for problem in instance.problem_set.all():
+            index_problem(problem)
+
+
+@receiver(m2m_changed, sender=Problem.tags.through)
+def problem_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action in ("post_add", "post_remove", "post_clear"):
+        invalidate_problem_cache()
+        # 从 tag 一侧修改的时候 instance 是 ProblemTag
+        if not reverse:
+            index_problem(instance)
+            update_problem(instance.id, instance)
+        elif pk_set:
+            for problem in Problem.objects.filter(id__in=pk_set):
+                index_problem(problem)
+                update_problem(problem.id, problem)
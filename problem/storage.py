@@ -0,0 +1,201 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Problem, TestCaseChangeLog, TestCaseReference
+
+# 测试用例文件按照 sha256 保存在 TEST_CASE_BLOB_DIR/ab/abcd... , 每个 test_case_id 目录中的文件都是指向 blob 的硬链接,
+# blob 的 st_nlink 就是引用计数, 降到 1 说明只剩下 blob 本身, 可以回收
+# TEST_CASE_BLOB_DIR 和 TEST_CASE_DIR 需要在同一个文件系统中, 否则无法创建硬链接, 这时候退化为普通文件
+MANIFEST_DIR_NAME = "manifest"
+CHUNK_SIZE = 1024 * 1024
+# 下载用的压缩包超过这个时间没有被使用就删除
+ARCHIVE_TTL = 3600 * 24 * 7
+
+
+def _file_sha256(path):
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _blob_path(digest):
+    return os.path.join(settings.TEST_CASE_BLOB_DIR, digest[:2], digest)
+
+
+def _manifest_path(digest):
+    return os.path.join(settings.TEST_CASE_BLOB_DIR, MANIFEST_DIR_NAME, digest)
+
+
+def _link_blob(path):
+    digest = _file_sha256(path)
+    blob = _blob_path(digest)
+    os.makedirs(os.path.dirname(blob), exist_ok=True)
+    try:
+        # 第一次出现的内容, 当前文件直接成为 blob
+        os.link(path, blob)
+        return digest
+    except FileExistsError:
+        pass
+    tmp_path = path + ".blob"
+    try:
+        os.link(blob, tmp_path)
+        os.replace(tmp_path, path)
+    except OSError:
+        # blob 恰好被回收, 或者不在同一个文件系统中, 保留原文件
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return digest
+
+
+def store_test_case(test_case_id):
+    """
+    把刚写入的 test_case_id 目录中的文件替换为 blob 的硬链接.
+    如果已经存在内容完全相同的目录, 删除新目录并返回已有的 test_case_id, 重复导入同一份数据不会多占空间, 也不需要再同步到判题机
+    :return: 最终使用的 test_case_id
+    """
+    test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+    files = {}
+    for name in sorted(os.listdir(test_case_dir)):
+        path = os.path.join(test_case_dir, name)
+        if os.path.isfile(path):
+            files[name] = _link_blob(path)
+
+    digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode("utf-8")).hexdigest()
+    manifest = _manifest_path(digest)
+    os.makedirs(os.path.dirname(manifest), exist_ok=True)
+    try:
+        with open(manifest, "r") as f:
+            existing_id = f.read().strip()
+    except FileNotFoundError:
+        existing_id = None
+    if existing_id and existing_id != test_case_id and os.path.isdir(os.path.join(settings.TEST_CASE_DIR, existing_id)):
+        shutil.rmtree(test_case_dir, ignore_errors=True)
+        # 马上会被新题目引用, 重新计算宽限期
+        TestCaseReference.objects.filter(test_case_id=existing_id).update(last_used=timezone.now())
+        return existing_id
+
+    tmp_manifest = f"{manifest}.{test_case_id}"
+    with open(tmp_manifest, "w") as f:
+        f.write(test_case_id)
+    os.replace(tmp_manifest, manifest)
+    TestCaseChangeLog.objects.create(test_case_id=test_case_id, files=files)
+    TestCaseReference.objects.update_or_create(test_case_id=test_case_id,
+                                               defaults={"size": get_dir_size(test_case_dir),
+                                                         "last_used": timezone.now()})
+    return test_case_id
+
+
+def get_dir_size(path):
+    return sum(item.stat().st_size for item in os.scandir(path) if item.is_file())
+
+
+def refresh_references(*test_case_ids):
+    """
+    重新计算引用计数, 在题目保存和删除之后调用
+    """
+    for test_case_id in set(filter(None, test_case_ids)):
+        ref_count = Problem.objects.filter(test_case_id=test_case_id).count()
+        updated = TestCaseReference.objects.filter(test_case_id=test_case_id) \
+            .update(ref_count=ref_count, last_used=timezone.now())
+        if updated:
+            continue
+        # 建立索引之前就存在的目录
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+        if os.path.isdir(test_case_dir):
+            TestCaseReference.objects.get_or_create(test_case_id=test_case_id,
+                                                    defaults={"size": get_dir_size(test_case_dir),
+                                                              "ref_count": ref_count,
+                                                              "last_used": timezone.now()})
+
+
+def reclaimable(grace=None):
+    """
+    :return: 没有被引用并且超过宽限期的测试用例
+    """
+    grace = settings.TEST_CASE_GC_GRACE if grace is None else grace
+    return TestCaseReference.objects.filter(ref_count=0, last_used__lt=timezone.now() - timedelta(seconds=grace))
+
+
+def remove_test_case(test_case_id):
+    test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+    if os.path.isdir(test_case_dir):
+        shutil.rmtree(test_case_dir, ignore_errors=True)
+        TestCaseChangeLog.objects.create(test_case_id=test_case_id, deleted=True)
+    TestCaseReference.objects.filter(test_case_id=test_case_id).delete()
+
+
+def get_test_case_archive(test_case_id, name_list):
+    """
+    测试用例下载用的压缩包, 保存在 TEST_CASE_ARCHIVE_DIR 中, 不会被同步到判题机.
+    文件都是 blob 的硬链接, inode、大小和修改时间不变就说明内容没有变化, 所以用它们作为缓存的 key, 不需要重新计算文件的 hash
+    :return: 压缩包路径
+    """
+    test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+    key = []
+    for name in name_list:
+        stat = os.stat(os.path.join(test_case_dir, name))
+        key.append([name, stat.st_ino, stat.st_size, stat.st_mtime_ns])
+    digest = hashlib.sha256(json.dumps([test_case_id, key]).encode("utf-8")).hexdigest()
+    path = os.path.join(settings.TEST_CASE_ARCHIVE_DIR, f"{digest}.zip")
+    if os.path.exists(path):
+        os.utime(path)
+        return path
+
+    os.makedirs(settings.TEST_CASE_ARCHIVE_DIR, exist_ok=True)
+    # 同一个进程的多个线程可能同时生成同一个压缩包, 每次使用不同的临时文件
+    fd, tmp_path = tempfile.mkstemp(dir=settings.TEST_CASE_ARCHIVE_DIR, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f, zipfile.ZipFile(f, "w") as file:
+            for name in name_list:
+                file.write(os.path.join(test_case_dir, name), name)
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return path
+
+
+def collect_garbage():
+    """
+    删除已经没有 test_case_id 目录引用的 blob 和 manifest, 以及长时间没有被下载的压缩包
+    :return: 删除的 blob 数量
+    """
+    if os.path.isdir(settings.TEST_CASE_ARCHIVE_DIR):
+        for item in os.scandir(settings.TEST_CASE_ARCHIVE_DIR):
+            if time.time() - item.stat().st_mtime > ARCHIVE_TTL:
+                os.remove(item.path)
+
+    blob_dir = settings.TEST_CASE_BLOB_DIR
+    if not os.path.isdir(blob_dir):
+        return 0
+    count = 0
+    for sub_dir in os.scandir(blob_dir):
+        if not sub_dir.is_dir():
+            continue
+        if sub_dir.name == MANIFEST_DIR_NAME:
+            for item in os.scandir(sub_dir.path):
+                try:
+                    with open(item.path, "r") as f:
+                        test_case_id = f.read().strip()
+                except OSError:
+                    continue
+                if not os.path.isdir(os.path.join(settings.TEST_CASE_DIR, test_case_id)):
+                    os.remove(item.path)
+            continue
+        for item in os.scandir(sub_dir.path):
+            if item.stat().st_nlink <= 1:
+                os.remove(item.path)
+                count += 1
+    return count
@@ -0,0 +1,302 @@
+import json
+import logging
+import os
+import time
+import zipfile
+
+import dramatiq
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+
+from account.models import User
+from options.options import SysOptions
+from submission.models import JudgeStatus, SubmissionChain
+from utils.cache import cache
+from utils.constants import CacheKey, Difficulty
+from utils.sanitizer import sanitize_many
+from utils.shortcuts import DRAMATIQ_WORKER_ARGS, rand_str
+from utils.tasks import delete_files
+
+from .browse import update_problem
+from .models import Problem, ProblemRuleType, ProblemTag
+from .search import index_problem
+from .serializers import ExportProblemSerializer, ImportProblemSerializer
+from .storage import collect_garbage, reclaimable, remove_test_case
+from .utils import build_problem_template
+
+logger = logging.getLogger(__name__)
+
+# 导出任务的状态和文件保留的时间
+EXPORT_JOB_TTL = 3600
+# 导入任务的状态和上传的文件保留的时间, 在这段时间内可以继续没有完成的导入
+IMPORT_JOB_TTL = 3600 * 24
+# 每一批题目在一个事务中提交
+IMPORT_BATCH_SIZE = 20
+# 每次最多回收的测试用例数量和每个目录之间的间隔, 避免长时间占用磁盘 IO, 剩下的由下一次任务继续
+SWEEP_BATCH_SIZE = 100
+SWEEP_INTERVAL = 0.1
+
+
+def _latest_answers(queryset):
+    """
+    :return: 每个 (problem_id, language) 最近一次提交的 (problem_id, language, code, create_time)
+    """
+    queryset = queryset.order_by("problem_id", "language", "-create_time")
+    fields = ("problem_id", "language", "code", "create_time")
+    if connection.features.can_distinct_on_fields:
+        return queryset.distinct("problem_id", "language").values_list(*fields)
+    # 不支持 DISTINCT ON 的数据库, 先不读取代码找出最近的提交
+    ids = {}
+    for submission_id, problem_id, language in queryset.values_list("id", "problem_id", "language"):
+        ids.setdefault((problem_id, language), submission_id)
+    return queryset.model.objects.filter(id__in=list(ids.values())).values_list(*fields)
+
+
+def choose_answers(user_id, problems):
+    """
+    每道题每种语言最近一次 AC 的代码, 所有题目一起查询
+    :return: {problem_id: [{"language": ..., "code": ...}]}
+    """
+    latest = {problem.id: {} for problem in problems}
+    create_times = {}
+    chain = SubmissionChain().filter(problem_id__in=list(latest.keys()), user_id=user_id, result=JudgeStatus.ACCEPTED)
+    # 两张表分别取出每个 (problem_id, language) 最近的一次, 再取其中较新的
+    for queryset in (chain.hot, chain.archive):
+        for problem_id, language, code, create_time in _latest_answers(queryset):
+            key = (problem_id, language)
+            if key not in create_times or create_time > create_times[key]:
+                create_times[key] = create_time
+                latest[problem_id][language] = code
+    return {problem.id: [{"language": language, "code": latest[problem.id][language]}
+                         for language in problem.languages if language in latest[problem.id]]
+            for problem in problems}
+
+
+def write_problem(zip_file, problem, answers, index):
+    info = ExportProblemSerializer(problem).data
+    info["answers"] = answers
+    compression = zipfile.ZIP_DEFLATED
+    zip_file.writestr(zinfo_or_arcname=f"{index}/problem.json",
+                      data=json.dumps(info, indent=4),
+                      compress_type=compression)
+    problem_test_case_dir = os.path.join(settings.TEST_CASE_DIR, problem.test_case_id)
+    with open(os.path.join(problem_test_case_dir, "info")) as f:
+        info = json.load(f)
+    # ZipFile.write 分块读取文件, 大的测试用例不会整个读入内存
+    for k, v in info["test_cases"].items():
+        zip_file.write(filename=os.path.join(problem_test_case_dir, v["input_name"]),
+                       arcname=f"{index}/testcase/{v['input_name']}",
+                       compress_type=compression)
+        if not info["spj"]:
+            zip_file.write(filename=os.path.join(problem_test_case_dir, v["output_name"]),
+                           arcname=f"{index}/testcase/{v['output_name']}",
+                           compress_type=compression)
+
+
+def build_export_zip(path, user_id, problem_ids, progress=None):
+    problems = list(Problem.objects.filter(id__in=problem_ids).prefetch_related("tags"))
+    answers = choose_answers(user_id, problems)
+    with zipfile.ZipFile(path, "w") as zip_file:
+        for index, problem in enumerate(problems):
+            write_problem(zip_file, problem, answers[problem.id], index + 1)
+            if progress:
+                progress(index + 1, len(problems))
+
+
+def export_job_key(job_id):
+    return f"{CacheKey.problem_export}:{job_id}"
+
+
+def export_job_path(job_id):
+    return f"/tmp/problem_export_{job_id}.zip"
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def export_problems(job_id, user_id, problem_ids):
+    key = export_job_key(job_id)
+    job = cache.get(key)
+    if not job:
+        return
+
+    def progress(finished, total):
+        job.update({"status": "running", "finished": finished, "total": total})
+        cache.set(key, job, EXPORT_JOB_TTL)
+
+    try:
+        build_export_zip(export_job_path(job_id), user_id, problem_ids, progress)
+    except Exception as e:
+        logger.exception(e)
+        job.update({"status": "failed", "err": str(e)})
+    else:
+        job["status"] = "finished"
+    cache.set(key, job, EXPORT_JOB_TTL)
+    delete_files.send_with_options(args=(export_job_path(job_id),), delay=EXPORT_JOB_TTL * 1000)
+
+
+def import_job_key(job_id):
+    return f"{CacheKey.problem_import}:{job_id}"
+
+
+def import_job_path(job_id):
+    return f"/tmp/problem_import_{job_id}.zip"
+
+
+def parse_import_problem(zip_file, index):
+    """
+    :return: 校验之后的 problem.json, 格式错误的时候抛出 ValueError
+    """
+    with zip_file.open(f"{index}/problem.json") as f:
+        serializer = ImportProblemSerializer(data=json.load(f))
+    if not serializer.is_valid():
+        raise ValueError(f"Invalid problem format, error is {serializer.errors}")
+    problem_info = serializer.data
+    for item in problem_info["template"].keys():
+        if item not in SysOptions.language_registry.name_set:
+            raise ValueError(f"Unsupported language {item}")
+    problem_info["display_id"] = problem_info["display_id"][:24]
+    for k, v in problem_info["template"].items():
+        problem_info["template"][k] = build_problem_template(v["prepend"], v["template"], v["append"])
+    return problem_info
+
+
+def ensure_tags(names):
+    """
+    :return: {name: ProblemTag}, 不存在的 tag 一次性创建
+    """
+    tags = {tag.name: tag for tag in ProblemTag.objects.filter(name__in=names)}
+    missing = set(names) - set(tags.keys())
+    if missing:
+        ProblemTag.objects.bulk_create([ProblemTag(name=name) for name in missing])
+        tags.update({tag.name: tag for tag in ProblemTag.objects.filter(name__in=missing)})
+    return tags
+
+
+def create_import_problem(problem_info, test_case_id, creator):
+    spj = problem_info["spj"] is not None
+    test_case_score = problem_info["test_case_score"]
+    return Problem.objects.create(_id=problem_info["display_id"],
+                                  title=problem_info["title"],
+                                  description=problem_info["description"]["value"],
+                                  input_description=problem_info["input_description"]["value"],
+                                  output_description=problem_info["output_description"]["value"],
+                                  hint=problem_info["hint"]["value"],
+                                  test_case_score=test_case_score if test_case_score else [],
+                                  time_limit=problem_info["time_limit"],
+                                  memory_limit=problem_info["memory_limit"],
+                                  samples=problem_info["samples"],
+                                  template=problem_info["template"],
+                                  rule_type=problem_info["rule_type"],
+                                  source=problem_info["source"],
+                                  spj=spj,
+                                  spj_code=problem_info["spj"]["code"] if spj else None,
+                                  spj_language=problem_info["spj"]["language"] if spj else None,
+                                  spj_version=rand_str(8) if spj else "",
+                                  languages=SysOptions.language_names,
+                                  created_by=creator,
+                                  visible=False,
+                                  difficulty=Difficulty.MID,
+                                  total_score=sum(item["score"] for item in test_case_score)
+                                  if problem_info["rule_type"] == ProblemRuleType.OI else 0,
+                                  test_case_id=test_case_id)
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS(time_limit=3600_000 * 6))
+def import_problems(job_id):
+    """
+    job["problems"] 记录每道题的结果, 已经导入的题目在继续导入的时候会跳过
+    """
+    # 防止循环引入
+    from .views.admin import TestCaseZipProcessor
+
+    key = import_job_key(job_id)
+    job = cache.get(key)
+    if not job:
+        return
+    path = import_job_path(job_id)
+    processor = TestCaseZipProcessor()
+    job["status"] = "running"
+    cache.set(key, job, IMPORT_JOB_TTL)
+
+    try:
+        creator = User.objects.get(id=job["user_id"])
+        pending = []
+        # 整个压缩包只读取一次目录和所有的 problem.json
+        with zipfile.ZipFile(path, "r") as zip_file:
+            zip_infos = {info.filename: info for info in zip_file.infolist()}
+            job["total"] = sum(1 for name in zip_infos if name.endswith("/problem.json"))
+            for index in range(1, job["total"] + 1):
+                if "problem_id" in job["problems"].get(str(index), {}):
+                    continue
+                try:
+                    pending.append((index, parse_import_problem(zip_file, index)))
+                except (KeyError, ValueError) as e:
+                    job["problems"][str(index)] = {"error": str(e)}
+
+        for start in range(0, len(pending), IMPORT_BATCH_SIZE):
+            batch = pending[start:start + IMPORT_BATCH_SIZE]
+            test_cases = {}
+            # process_zip 内部已经并发写入一道题的所有测试用例文件
+            for index, problem_info in batch:
+                try:
+                    _, test_cases[index] = processor.process_zip(path, problem_info["spj"] is not None,
+                                                                 f"{index}/testcase/", zip_infos)
+                except Exception as e:
+                    job["problems"][str(index)] = {"error": getattr(e, "msg", str(e))}
+
+            batch = [(index, problem_info) for index, problem_info in batch if index in test_cases]
+            # 事务开始之前一起清理富文本, 保存的时候直接使用清理的结果
+            sanitize_many(problem_info[key]["value"] for _, problem_info in batch
+                          for key in ("description", "input_description", "output_description", "hint"))
+            results = {}
+            with transaction.atomic():
+                tags = ensure_tags({name for _, problem_info in batch for name in problem_info["tags"]})
+                through = []
+                for index, problem_info in batch:
+                    # 一道题失败只回滚这一道题
+                    try:
+                        with transaction.atomic():
+                            problem = create_import_problem(problem_info, test_cases[index], creator)
+                    except DatabaseError as e:
+                        results[str(index)] = {"error": str(e)}
+                        continue
+                    through.extend(Problem.tags.through(problem_id=problem.id, problemtag_id=tags[name].id)
+                                   for name in set(problem_info["tags"]))
+                    results[str(index)] = {"problem_id": problem.id}
+                Problem.tags.through.objects.bulk_create(through)
+            # 事务提交之后才记录结果, 回滚的题目在继续导入的时候不会被跳过
+            job["problems"].update(results)
+            cache.set(key, job, IMPORT_JOB_TTL)
+            # bulk_create 不会触发 m2m_changed, 创建题目时的索引中还没有标签
+            problem_ids = [item["problem_id"] for item in results.values() if "problem_id" in item]
+            for problem in Problem.objects.filter(id__in=problem_ids):
+                index_problem(problem)
+                update_problem(problem.id, problem)
+    except Exception as e:
+        # 可以通过 ImportProblemAPI.put 继续导入
+        job.update({"status": "failed", "err": str(e)})
+        cache.set(key, job, IMPORT_JOB_TTL)
+        return
+
+    job["status"] = "finished"
+    cache.set(key, job, IMPORT_JOB_TTL)
+    delete_files.send_with_options(args=(path,), delay=IMPORT_JOB_TTL * 1000)
+
+
+@dramatiq.actor(**DRAMATIQ_WORKER_ARGS())
+def sweep_test_cases(test_case_ids=None):
+    """
+    回收没有被引用并且超过宽限期的测试用例
+    """
+    queryset = reclaimable()
+    if test_case_ids is not None:
+        queryset = queryset.filter(test_case_id__in=test_case_ids)
+    items = list(queryset.values_list("test_case_id", flat=True)[:SWEEP_BATCH_SIZE])
+    for test_case_id in items:
+        # 查询之后可能又被引用了
+        if not reclaimable().filter(test_case_id=test_case_id).exists():
+            continue
+        remove_test_case(test_case_id)
+        time.sleep(SWEEP_INTERVAL)
+    collect_garbage()
+    if len(items) == SWEEP_BATCH_SIZE:
+        sweep_test_cases.send_with_options(args=(test_case_ids,), delay=10_000)
@@ -1,20 +1,34 @@
 import copy
 import hashlib
+import json
 import os
 import shutil
 from datetime import timedelta
+from io import BytesIO
+from unittest import mock
 from zipfile import ZipFile
 
 from django.conf import settings
+from django.db import IntegrityError
 
+from account.models import User
 from utils.api.tests import APITestCase
+from utils.cache import cache
+from utils.constants import CacheKey
+from utils.shortcuts import rand_str
 
-from .models import ProblemTag, ProblemIOMode
-from .models import Problem, ProblemRuleType
+from .models import ProblemTag, ProblemIOMode, ProblemSearchToken
+from .models import Problem, ProblemRuleType, TestCaseReference, UserProblemStatus
 from contest.models import Contest
 from contest.tests import DEFAULT_CONTEST_DATA
+from fps.parser import FPSHelper, FPSParser
+from submission.models import JudgeStatus, Submission
 
 from .views.admin import TestCaseAPI
+from .browse import get_tag_counts, invalidate_index, update_problem
+from .storage import collect_garbage, get_test_case_archive, reclaimable, store_test_case
+from .tasks import (build_export_zip, create_import_problem, export_job_path, export_problems, import_job_path,
+                    import_problems, sweep_test_cases)
 from .utils import parse_problem_template
 
 DEFAULT_PROBLEM_DATA = {"_id": "A-110", "title": "test", "description": "<p>test</p>", "input_description": "test",
@@ -74,6 +88,49 @@ class ProblemTagListAPITest(APITestCase):
         self.assertSuccess(resp)
 
 
+class ProblemBrowseIndexTest(ProblemCreateTestBase):
+    def setUp(self):
+        invalidate_index()
+        self.problem = self.add_problem(DEFAULT_PROBLEM_DATA, self.create_admin(login=False))
+
+    def test_tags_and_pick_one(self):
+        resp = self.client.get(self.reverse("problem_tag_list_api"))
+        self.assertEqual([item["name"] for item in resp.data["data"]], ["test"])
+        resp = self.client.get(self.reverse("pick_one_api"))
+        self.assertEqual(resp.data["data"], self.problem._id)
+
+        # 索引已经建立, 之后是增量更新
+        self.problem.visible = False
+        self.problem.save()
+        resp = self.client.get(self.reverse("problem_tag_list_api"))
+        self.assertEqual(resp.data["data"], [])
+        self.assertFailed(self.client.get(self.reverse("pick_one_api")), "No problem to pick")
+
+        self.problem.visible = True
+        self.problem.save()
+        self.problem.tags.add(ProblemTag.objects.create(name="graph"))
+        resp = self.client.get(self.reverse("problem_tag_list_api"))
+        self.assertEqual(sorted(item["name"] for item in resp.data["data"]), ["graph", "test"])
+
+    def test_concurrent_update(self):
+        tag = ProblemTag.objects.get(name="test")
+        self.assertEqual(get_tag_counts(), {tag.id: 1})
+        Problem.objects.filter(id=self.problem.id).update(visible=False)
+        problem = Problem.objects.get(id=self.problem.id)
+        loads, raced = json.loads, []
+
+        def loads_and_race(value):
+            if not raced:
+                # 读取旧的状态之后, 另一个进程完成了同样的修改
+                raced.append(True)
+                update_problem(problem.id, problem)
+            return loads(value)
+
+        with mock.patch("problem.browse.json.loads", side_effect=loads_and_race):
+            update_problem(problem.id, problem)
+        self.assertEqual(int(cache.hget(CacheKey.problem_tag_count, tag.id)), 0)
+
+
 class TestCaseUploadAPITest(APITestCase):
     def setUp(self):
         self.api = TestCaseAPI()
@@ -88,6 +145,26 @@ class TestCaseUploadAPITest(APITestCase):
         self.assertEqual(self.api.filter_name_list(["1.in", "1.out", "2.in"], spj=True), ["1.in", "2.in"])
         self.assertEqual(self.api.filter_name_list(["2.in", "3.in"], spj=True), [])
 
+    def test_save_test_case_in_chunks(self):
+        contents = [b"1\r\n2\r\n \r\n\r\n", b"a\rb\r\r\nc \t\n", b"\r\n\r\n", b"x" * 7 + b"\r", b"", b"  end  "]
+        zip_path = os.path.join("/tmp", rand_str() + ".zip")
+        self.addCleanup(os.remove, zip_path)
+        with ZipFile(zip_path, "w") as f:
+            for index, content in enumerate(contents):
+                f.writestr(f"{index}.out", content)
+        # 块大小不同的时候结果都应该和一次性读入的结果一致
+        for chunk_size in (1, 2, 3, 1024):
+            self.api.chunk_size = chunk_size
+            for index, content in enumerate(contents):
+                path = os.path.join("/tmp", rand_str())
+                self.addCleanup(os.remove, path)
+                size, md5 = self.api._save_test_case(zip_path, f"{index}.out", path, is_output=True)
+                expected = content.replace(b"\r\n", b"\n")
+                with open(path, "rb") as f:
+                    self.assertEqual(f.read(), expected)
+                self.assertEqual(size, len(expected))
+                self.assertEqual(md5, hashlib.md5(expected.rstrip()).hexdigest())
+
     def make_test_case_zip(self):
         base_dir = os.path.join("/tmp", "test_case")
         shutil.rmtree(base_dir, ignore_errors=True)
@@ -130,6 +207,94 @@ class TestCaseUploadAPITest(APITestCase):
                 with open(os.path.join(test_case_dir, name), "r", encoding="utf-8") as f:
                     self.assertEqual(f.read(), name + "\n" + name + "\n" + "end")
 
+    def test_upload_same_test_case_twice(self):
+        test_case_dir, blob_dir = os.path.join("/tmp", rand_str()), os.path.join("/tmp", rand_str())
+        os.mkdir(test_case_dir)
+        self.addCleanup(shutil.rmtree, test_case_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, blob_dir, ignore_errors=True)
+        override = self.settings(TEST_CASE_DIR=test_case_dir, TEST_CASE_BLOB_DIR=blob_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+        ids = []
+        for _ in range(2):
+            with open(self.make_test_case_zip(), "rb") as f:
+                resp = self.client.post(self.url, data={"spj": "false", "file": f}, format="multipart")
+            self.assertSuccess(resp)
+            ids.append(resp.data["data"]["id"])
+        # 内容完全相同的测试用例复用同一个目录
+        self.assertEqual(ids[0], ids[1])
+        self.assertEqual(os.stat(os.path.join(test_case_dir, ids[0], "1.in")).st_nlink, 2)
+
+
+class TestCaseStorageTest(APITestCase):
+    def setUp(self):
+        self.test_case_dir = os.path.join("/tmp", rand_str())
+        self.blob_dir = os.path.join("/tmp", rand_str())
+        os.mkdir(self.test_case_dir)
+        self.addCleanup(shutil.rmtree, self.test_case_dir, ignore_errors=True)
+        self.addCleanup(shutil.rmtree, self.blob_dir, ignore_errors=True)
+        override = self.settings(TEST_CASE_DIR=self.test_case_dir, TEST_CASE_BLOB_DIR=self.blob_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def write_test_case(self, files):
+        test_case_id = rand_str()
+        os.mkdir(os.path.join(self.test_case_dir, test_case_id))
+        for name, content in files.items():
+            with open(os.path.join(self.test_case_dir, test_case_id, name), "w") as f:
+                f.write(content)
+        return store_test_case(test_case_id)
+
+    def test_shared_blob(self):
+        first = self.write_test_case({"1.in": "1 2", "1.out": "3"})
+        second = self.write_test_case({"1.in": "1 2", "1.out": "4"})
+        self.assertNotEqual(first, second)
+        for test_case_id in (first, second):
+            self.assertEqual(os.stat(os.path.join(self.test_case_dir, test_case_id, "1.in")).st_nlink, 3)
+
+        shutil.rmtree(os.path.join(self.test_case_dir, second))
+        self.assertEqual(collect_garbage(), 1)
+        self.assertEqual(os.stat(os.path.join(self.test_case_dir, first, "1.in")).st_nlink, 2)
+        # 已经删除的目录不会被复用
+        self.assertNotEqual(self.write_test_case({"1.in": "1 2", "1.out": "4"}), second)
+
+    def test_archive(self):
+        test_case_id = self.write_test_case({"1.in": "1 2", "1.out": "3"})
+        archive_dir = os.path.join("/tmp", rand_str())
+        self.addCleanup(shutil.rmtree, archive_dir, ignore_errors=True)
+        with self.settings(TEST_CASE_ARCHIVE_DIR=archive_dir):
+            path = get_test_case_archive(test_case_id, ["1.in", "1.out"])
+            with ZipFile(path) as f:
+                self.assertEqual(f.read("1.out"), b"3")
+            self.assertEqual(get_test_case_archive(test_case_id, ["1.in", "1.out"]), path)
+        # 压缩包不在测试用例目录中
+        self.assertEqual(sorted(os.listdir(os.path.join(self.test_case_dir, test_case_id))), ["1.in", "1.out"])
+
+    @mock.patch("problem.tasks.SWEEP_INTERVAL", 0)
+    def test_reference_count(self):
+        first = self.write_test_case({"1.in": "1 2", "1.out": "3"})
+        second = self.write_test_case({"1.in": "1 2", "1.out": "4"})
+        data = copy.deepcopy(DEFAULT_PROBLEM_DATA)
+        data["test_case_id"] = first
+        problem = ProblemCreateTestBase.add_problem(data, self.create_admin())
+        self.assertEqual(TestCaseReference.objects.get(test_case_id=first).ref_count, 1)
+
+        problem.test_case_id = second
+        problem.save()
+        self.assertEqual(TestCaseReference.objects.get(test_case_id=first).ref_count, 0)
+        self.assertEqual(TestCaseReference.objects.get(test_case_id=second).ref_count, 1)
+        # 还在宽限期内
+        sweep_test_cases.fn([first, second])
+        self.assertTrue(os.path.isdir(os.path.join(self.test_case_dir, first)))
+
+        with self.settings(TEST_CASE_GC_GRACE=-1):
+            self.assertEqual([item.test_case_id for item in reclaimable().filter(test_case_id__in=[first, second])],
+                             [first])
+            sweep_test_cases.fn([first, second])
+        self.assertFalse(os.path.isdir(os.path.join(self.test_case_dir, first)))
+        self.assertTrue(os.path.isdir(os.path.join(self.test_case_dir, second)))
+        self.assertFalse(TestCaseReference.objects.filter(test_case_id=first).exists())
+
 
 class ProblemAdminAPITest(APITestCase):
     def setUp(self):
@@ -182,16 +347,50 @@ class ProblemAPITest(ProblemCreateTestBase):
         self.url = self.reverse("problem_api")
         admin = self.create_admin(login=False)
         self.problem = self.add_problem(DEFAULT_PROBLEM_DATA, admin)
-        self.create_user("test", "test123")
+        self.user = self.create_user("test", "test123")
 
     def test_get_problem_list(self):
         resp = self.client.get(f"{self.url}?limit=10")
         self.assertSuccess(resp)
 
+    def test_problem_list_with_my_status(self):
+        UserProblemStatus.objects.create(user=self.user, problem=self.problem, status=0)
+        resp = self.client.get(f"{self.url}?limit=10")
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["results"][0]["my_status"], 0)
+
     def get_one_problem(self):
         resp = self.client.get(self.url + "?id=" + self.problem._id)
         self.assertSuccess(resp)
 
+    def test_search_problem(self):
+        data = copy.deepcopy(DEFAULT_PROBLEM_DATA)
+        data.update({"_id": "B-200", "title": "最短路径 Shortest Path", "description": "<p>dijkstra 算法 ダイクストラ 최단 경로</p>"})
+        other = self.add_problem(data, User.objects.get(username="admin"))
+        for keyword, expected in (("short", [other._id]), ("最短", [other._id]), ("路", [other._id]),
+                                  ("DIJKSTRA", [other._id]), ("a-110", [self.problem._id]),
+                                  ("test", [self.problem._id, other._id]), ("shortest test", [other._id]),
+                                  ("ダイクストラ", [other._id]), ("최단경로", []), ("경로", [other._id]),
+                                  ("missing", [])):
+            resp = self.client.get(self.url, data={"limit": 10, "keyword": keyword})
+            self.assertSuccess(resp)
+            self.assertEqual([item["_id"] for item in resp.data["data"]["results"]], expected, keyword)
+
+    def test_problem_cache_invalidated_on_edit(self):
+        resp = self.client.get(self.url, data={"problem_id": self.problem._id})
+        self.assertEqual(resp.data["data"]["title"], self.problem.title)
+        # 计数字段的更新不会让缓存失效
+        Problem.objects.get(id=self.problem.id).add_submission_number()
+        resp = self.client.get(self.url, data={"problem_id": self.problem._id})
+        self.assertEqual(resp.data["data"]["submission_number"], 0)
+
+        self.problem.title = "new title"
+        self.problem.save()
+        resp = self.client.get(self.url, data={"problem_id": self.problem._id})
+        self.assertEqual(resp.data["data"]["title"], "new title")
+        resp = self.client.get(self.url, data={"limit": 10})
+        self.assertEqual(resp.data["data"]["results"][0]["title"], "new title")
+
 
 class ContestProblemAdminTest(APITestCase):
     def setUp(self):
@@ -240,6 +439,13 @@ class ContestProblemTest(ProblemCreateTestBase):
         self.assertSuccess(resp)
         self.assertEqual(len(resp.data["data"]), 1)
 
+    def test_contest_problem_list_with_my_status(self):
+        admin = User.objects.get(username="admin")
+        UserProblemStatus.objects.create(user=admin, problem=self.problem, contest_id=self.contest["id"], status=-1)
+        resp = self.client.get(self.url + "?contest_id=" + str(self.contest["id"]))
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"][0]["my_status"], -1)
+
     def test_admin_get_one_contest_problem(self):
         contest_id = self.contest["id"]
         problem_id = self.problem._id
@@ -283,6 +489,135 @@ class AddProblemFromPublicProblemAPITest(ProblemCreateTestBase):
         self.assertTrue(Problem.objects.filter(contest_id=self.contest["id"]).exists())
 
 
+class ExportProblemAPITest(ProblemCreateTestBase):
+    def setUp(self):
+        self.admin = self.create_admin()
+        data = copy.deepcopy(DEFAULT_PROBLEM_DATA)
+        data["test_case_id"] = rand_str()
+        self.problem = self.add_problem(data, self.admin)
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, data["test_case_id"])
+        os.mkdir(test_case_dir)
+        self.addCleanup(shutil.rmtree, test_case_dir)
+        for name, content in (("1.in", "1 2"), ("1.out", "3"),
+                              ("info", json.dumps({"spj": False, "test_cases": {"1": {"input_name": "1.in",
+                                                                                      "output_name": "1.out"}}}))):
+            with open(os.path.join(test_case_dir, name), "w") as f:
+                f.write(content)
+        for language, code in (("C", "old"), ("C", "new"), ("Java", "java")):
+            Submission.objects.create(problem=self.problem, user_id=self.admin.id, username=self.admin.username,
+                                      language=language, code=code, result=JudgeStatus.ACCEPTED)
+        self.url = self.reverse("export_problem_api")
+
+    @mock.patch("problem.views.admin.export_problems.send")
+    def test_export_job(self, send):
+        resp = self.client.post(self.url, data={"problem_id": [self.problem.id]})
+        self.assertSuccess(resp)
+        job_id = resp.data["data"]["job_id"]
+        send.assert_called_once_with(job_id, self.admin.id, [self.problem.id])
+        self.assertFailed(self.client.get(self.url, data={"job_id": job_id, "download": 1}), "Export job is not finished")
+
+        with mock.patch("problem.tasks.delete_files"):
+            export_problems.fn(job_id, self.admin.id, [self.problem.id])
+        self.addCleanup(os.remove, export_job_path(job_id))
+        resp = self.client.get(self.url, data={"job_id": job_id})
+        self.assertEqual(resp.data["data"], {"status": "finished", "finished": 1, "total": 1})
+
+        resp = self.client.get(self.url, data={"job_id": job_id, "download": 1})
+        with ZipFile(BytesIO(b"".join(resp.streaming_content))) as f:
+            self.assertEqual(sorted(f.namelist()), ["1/problem.json", "1/testcase/1.in", "1/testcase/1.out"])
+            info = json.loads(f.read("1/problem.json"))
+        self.assertEqual(info["answers"], [{"language": "C", "code": "new"}, {"language": "Java", "code": "java"}])
+
+    @mock.patch("problem.views.admin.delete_files")
+    def test_export_sync(self, delete_files):
+        resp = self.client.get(self.url, data={"problem_id": self.problem.id})
+        self.addCleanup(os.remove, delete_files.send_with_options.call_args[1]["args"][0])
+        with ZipFile(BytesIO(b"".join(resp.streaming_content))) as f:
+            self.assertIn("1/testcase/1.out", f.namelist())
+
+    @mock.patch("problem.tasks.delete_files")
+    @mock.patch("problem.views.admin.import_problems.send")
+    def test_import_job(self, send, delete_files):
+        path = os.path.join("/tmp", rand_str())
+        self.addCleanup(os.remove, path)
+        build_export_zip(path, self.admin.id, [self.problem.id])
+        with ZipFile(path, "a") as f:
+            f.writestr("2/problem.json", "{}")
+        url = self.reverse("import_problem_api")
+        with open(path, "rb") as f:
+            resp = self.client.post(url, data={"file": f}, format="multipart")
+        self.assertSuccess(resp)
+        job_id = resp.data["data"]["job_id"]
+        self.addCleanup(os.remove, import_job_path(job_id))
+        send.assert_called_once_with(job_id)
+
+        import_problems.fn(job_id)
+        data = self.client.get(url, data={"job_id": job_id}).data["data"]
+        self.assertEqual((data["status"], data["total"], data["import_count"]), ("finished", 2, 1))
+        self.assertIn("error", data["problems"]["2"])
+        problem = Problem.objects.get(id=data["problems"]["1"]["problem_id"])
+        self.assertEqual(list(problem.tags.values_list("name", flat=True)), ["test"])
+        self.assertFailed(self.client.put(url + f"?job_id={job_id}"), "Import job is finished")
+
+    @mock.patch("problem.tasks.delete_files")
+    @mock.patch("problem.views.admin.import_problems.send")
+    def test_import_job_partial_failure(self, send, delete_files):
+        path = os.path.join("/tmp", rand_str())
+        self.addCleanup(os.remove, path)
+        build_export_zip(path, self.admin.id, [self.problem.id])
+        # 同一道题导入两次
+        with ZipFile(path, "a") as f:
+            for name in f.namelist():
+                f.writestr("2" + name[1:], f.read(name))
+        url = self.reverse("import_problem_api")
+        with open(path, "rb") as f:
+            job_id = self.client.post(url, data={"file": f}, format="multipart").data["data"]["job_id"]
+        self.addCleanup(os.remove, import_job_path(job_id))
+        self.assertFailed(self.client.put(url + f"?job_id={job_id}"), "Import job is pending")
+
+        create, calls = create_import_problem, []
+
+        def create_once(*args):
+            calls.append(args)
+            if len(calls) == 1:
+                raise IntegrityError("duplicate")
+            return create(*args)
+
+        with mock.patch("problem.tasks.create_import_problem", side_effect=create_once):
+            import_problems.fn(job_id)
+        data = self.client.get(url, data={"job_id": job_id}).data["data"]
+        self.assertEqual(data["problems"]["1"], {"error": "duplicate"})
+        problem_id = data["problems"]["2"]["problem_id"]
+        # 标签通过 bulk_create 添加, 导入之后重新建立索引, 和原来的题目相同
+        tokens = ProblemSearchToken.objects.values_list("token", "weight").order_by("token")
+        self.assertEqual(list(tokens.filter(problem_id=problem_id)), list(tokens.filter(problem_id=self.problem.id)))
+        self.assertEqual(self.client.put(url + f"?job_id={job_id}").data["data"], "Import job is finished")
+
+
+class FPSParserTest(APITestCase):
+    def save_test_case(self, problem):
+        test_case_dir = os.path.join("/tmp", rand_str())
+        os.mkdir(test_case_dir)
+        self.addCleanup(shutil.rmtree, test_case_dir)
+        return FPSHelper().save_test_case(problem, test_case_dir)
+
+    def test_spool(self):
+        path = os.path.join(settings.BASE_DIR, "fps", "fps.xml")
+        problems = FPSParser(path).parse()
+        spool_dir = os.path.join("/tmp", rand_str())
+        os.mkdir(spool_dir)
+        self.addCleanup(shutil.rmtree, spool_dir)
+        spooled = list(FPSParser(path).iter_problems(spool_dir=spool_dir))
+        self.assertEqual(len(spooled), len(problems))
+        for problem, item in zip(problems, spooled):
+            self.assertEqual(item["title"], problem["title"])
+            self.assertIsNone(item["test_cases"][0]["input"])
+            self.assertEqual(self.save_test_case(item), self.save_test_case(problem))
+            for image, spooled_image in zip(problem["images"], item["images"]):
+                with open(spooled_image["file"], "rb") as f:
+                    self.assertEqual(f.read(), image["blob"])
+
+
 class ParseProblemTemplateTest(APITestCase):
     def test_parse(self):
         template_str = """
@@ -1,9 +1,10 @@
 import hashlib
 import json
 import os
-# import shutil
+import shutil
 import tempfile
 import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from wsgiref.util import FileWrapper
 
 from django.conf import settings
@@ -16,31 +17,84 @@ from contest.models import Contest, ContestStatus
 from fps.parser import FPSHelper, FPSParser
 from judge.dispatcher import SPJCompiler
 from options.options import SysOptions
-from submission.models import Submission, JudgeStatus
+from submission.models import SubmissionChain
 from utils.api import APIView, CSRFExemptAPIView, validate_serializer, APIError
+from utils.cache import cache
 from utils.constants import Difficulty
 from utils.shortcuts import rand_str, natural_sort_key
+from utils.sanitizer import sanitize_many
 from utils.tasks import delete_files
 from ..models import Problem, ProblemRuleType, ProblemTag
 from ..serializers import (CreateContestProblemSerializer, CompileSPJSerializer,
                            CreateProblemSerializer, EditProblemSerializer, EditContestProblemSerializer,
                            ProblemAdminSerializer, TestCaseUploadForm, ContestProblemMakePublicSerializer,
-                           AddContestProblemSerializer, ExportProblemSerializer,
-                           ExportProblemRequestSerialzier, UploadProblemForm, ImportProblemSerializer,
+                           AddContestProblemSerializer,
+                           ExportProblemRequestSerialzier, UploadProblemForm,
                            FPSProblemSerializer)
-from ..utils import TEMPLATE_BASE, build_problem_template
+from ..storage import get_test_case_archive, store_test_case
+from ..tasks import (build_export_zip, export_job_key, export_job_path, export_problems, EXPORT_JOB_TTL,
+                     import_job_key, import_job_path, import_problems, IMPORT_JOB_TTL)
+from ..utils import TEMPLATE_BASE
 
 
 class TestCaseZipProcessor(object):
-    def process_zip(self, uploaded_zip_file, spj, dir=""):
-        try:
-            zip_file = zipfile.ZipFile(uploaded_zip_file, "r")
-        except zipfile.BadZipFile:
-            raise APIError("Bad zip file")
-        name_list = zip_file.namelist()
-        test_case_list = self.filter_name_list(name_list, spj=spj, dir=dir)
+    # 解压之后的文件数量和总大小限制, 防止 zip 炸弹
+    max_test_case_files = 2000
+    max_test_case_size = 1024 * 1024 * 1024
+    chunk_size = 1024 * 1024
+
+    def _save_test_case(self, zip_path, arcname, path, is_output):
+        """
+        分块解压并转换换行符, 同时计算大小和去掉末尾空白之后的 md5, 与整体读入之后
+        content.replace(b"\r\n", b"\n") 和 md5(content.rstrip()) 的结果一致
+        每个线程单独打开 zip 文件
+        """
+        size = 0
+        md5 = hashlib.md5() if is_output else None
+        # 块末尾的 \r 可能和下一块开头的 \n 组成换行, 留到下一块处理
+        pending_cr = False
+        # 还不能确定是否位于文件末尾的空白字符, 暂不计入 md5
+        pending_space = b""
+        with zipfile.ZipFile(zip_path, "r") as zip_file, zip_file.open(arcname) as src, open(path, "wb") as f:
+            while True:
+                chunk = src.read(self.chunk_size)
+                if not chunk:
+                    break
+                if pending_cr:
+                    chunk = b"\r" + chunk
+                pending_cr = chunk.endswith(b"\r")
+                if pending_cr:
+                    chunk = chunk[:-1]
+                chunk = chunk.replace(b"\r\n", b"\n")
+                f.write(chunk)
+                size += len(chunk)
+                if md5:
+                    data = pending_space + chunk
+                    stripped = data.rstrip()
+                    md5.update(stripped)
+                    pending_space = data[len(stripped):]
+            if pending_cr:
+                f.write(b"\r")
+                size += 1
+        return size, md5.hexdigest() if md5 else None
+
+    def process_zip(self, uploaded_zip_file, spj, dir="", zip_infos=None):
+        """
+        :param zip_infos: {文件名: ZipInfo}, 一个压缩包中有多道题的时候由调用方读取一次, 不用每道题都重新读取目录
+        """
+        if zip_infos is None:
+            try:
+                with zipfile.ZipFile(uploaded_zip_file, "r") as zip_file:
+                    zip_infos = {info.filename: info for info in zip_file.infolist()}
+            except zipfile.BadZipFile:
+                raise APIError("Bad zip file")
+        test_case_list = self.filter_name_list(zip_infos, spj=spj, dir=dir)
         if not test_case_list:
             raise APIError("Empty file")
+        if len(test_case_list) > self.max_test_case_files:
+            raise APIError("Too many test case files")
+        if sum(zip_infos[f"{dir}{item}"].file_size for item in test_case_list) > self.max_test_case_size:
+            raise APIError("Test case files are too large")
 
         test_case_id = rand_str()
         test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
@@ -50,13 +104,17 @@ class TestCaseZipProcessor(object):
         size_cache = {}
         md5_cache = {}
 
-        for item in test_case_list:
-            with open(os.path.join(test_case_dir, item), "wb") as f:
-                content = zip_file.read(f"{dir}{item}").replace(b"\r\n", b"\n")
-                size_cache[item] = len(content)
-                if item.endswith(".out"):
-                    md5_cache[item] = hashlib.md5(content.rstrip()).hexdigest()
-                f.write(content)
+        try:
+            with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+                futures = {}
+                for item in test_case_list:
+                    futures[item] = executor.submit(self._save_test_case, uploaded_zip_file, f"{dir}{item}",
+                                                    os.path.join(test_case_dir, item), item.endswith(".out"))
+                for item, future in futures.items():
+                    size_cache[item], md5_cache[item] = future.result()
+        except Exception:
+            shutil.rmtree(test_case_dir, ignore_errors=True)
+            raise
         test_case_info = {"spj": spj, "test_cases": {}}
 
         info = []
@@ -84,15 +142,16 @@ class TestCaseZipProcessor(object):
         for item in os.listdir(test_case_dir):
             os.chmod(os.path.join(test_case_dir, item), 0o640)
 
-        return info, test_case_id
+        return info, store_test_case(test_case_id)
 
     def filter_name_list(self, name_list, spj, dir=""):
         ret = []
         prefix = 1
+        name_set = set(name_list)
         if spj:
             while True:
                 in_name = f"{prefix}.in"
-                if f"{dir}{in_name}" in name_list:
+                if f"{dir}{in_name}" in name_set:
                     ret.append(in_name)
                     prefix += 1
                     continue
@@ -102,7 +161,7 @@ class TestCaseZipProcessor(object):
             while True:
                 in_name = f"{prefix}.in"
                 out_name = f"{prefix}.out"
-                if f"{dir}{in_name}" in name_list and f"{dir}{out_name}" in name_list:
+                if f"{dir}{in_name}" in name_set and f"{dir}{out_name}" in name_set:
                     ret.append(in_name)
                     ret.append(out_name)
                     prefix += 1
@@ -113,6 +172,8 @@ class TestCaseZipProcessor(object):
 
 class TestCaseAPI(CSRFExemptAPIView, TestCaseZipProcessor):
     request_parsers = ()
+    # 与 nginx 的 client_max_body_size 一致
+    max_upload_size = 200 * 1024 * 1024
 
     def get(self, request):
         problem_id = request.GET.get("problem_id")
@@ -133,10 +194,7 @@ class TestCaseAPI(CSRFExemptAPIView, TestCaseZipProcessor):
             return self.error("Test case does not exists")
         name_list = self.filter_name_list(os.listdir(test_case_dir), problem.spj)
         name_list.append("info")
-        file_name = os.path.join(test_case_dir, problem.test_case_id + ".zip")
-        with zipfile.ZipFile(file_name, "w") as file:
-            for test_case in name_list:
-                file.write(f"{test_case_dir}/{test_case}", test_case)
+        file_name = get_test_case_archive(problem.test_case_id, name_list)
         response = StreamingHttpResponse(FileWrapper(open(file_name, "rb")),
                                          content_type="application/octet-stream")
 
@@ -151,12 +209,16 @@ class TestCaseAPI(CSRFExemptAPIView, TestCaseZipProcessor):
             file = form.cleaned_data["file"]
         else:
             return self.error("Upload failed")
+        if file.size > self.max_upload_size:
+            return self.error("Upload file is too large")
         zip_file = f"/tmp/{rand_str()}.zip"
         with open(zip_file, "wb") as f:
             for chunk in file:
                 f.write(chunk)
-        info, test_case_id = self.process_zip(zip_file, spj=spj)
-        os.remove(zip_file)
+        try:
+            info, test_case_id = self.process_zip(zip_file, spj=spj)
+        finally:
+            os.remove(zip_file)
         return self.success({"id": test_case_id, "info": info, "spj": spj})
 
 
@@ -428,7 +490,7 @@ class ContestProblemAPI(ProblemBase):
         except Problem.DoesNotExist:
             return self.error("Problem does not exists")
         ensure_created_by(problem.contest, request.user)
-        if Submission.objects.filter(problem=problem).exists():
+        if SubmissionChain().filter(problem=problem).exists():
             return self.error("Can't delete the problem as it has submissions")
         # d = os.path.join(settings.TEST_CASE_DIR, problem.test_case_id)
         # if os.path.isdir(d):
@@ -497,48 +559,52 @@ class AddContestProblemAPI(APIView):
 
 
 class ExportProblemAPI(APIView):
-    def choose_answers(self, user, problem):
-        ret = []
-        for item in problem.languages:
-            submission = Submission.objects.filter(problem=problem,
-                                                   user_id=user.id,
-                                                   language=item,
-                                                   result=JudgeStatus.ACCEPTED).order_by("-create_time").first()
-            if submission:
-                ret.append({"language": submission.language, "code": submission.code})
-        return ret
-
-    def process_one_problem(self, zip_file, user, problem, index):
-        info = ExportProblemSerializer(problem).data
-        info["answers"] = self.choose_answers(user, problem=problem)
-        compression = zipfile.ZIP_DEFLATED
-        zip_file.writestr(zinfo_or_arcname=f"{index}/problem.json",
-                          data=json.dumps(info, indent=4),
-                          compress_type=compression)
-        problem_test_case_dir = os.path.join(settings.TEST_CASE_DIR, problem.test_case_id)
-        with open(os.path.join(problem_test_case_dir, "info")) as f:
-            info = json.load(f)
-        for k, v in info["test_cases"].items():
-            zip_file.write(filename=os.path.join(problem_test_case_dir, v["input_name"]),
-                           arcname=f"{index}/testcase/{v['input_name']}",
-                           compress_type=compression)
-            if not info["spj"]:
-                zip_file.write(filename=os.path.join(problem_test_case_dir, v["output_name"]),
-                               arcname=f"{index}/testcase/{v['output_name']}",
-                               compress_type=compression)
-
-    @validate_serializer(ExportProblemRequestSerialzier)
-    def get(self, request):
-        problems = Problem.objects.filter(id__in=request.data["problem_id"])
+    @staticmethod
+    def _check_permission(problems, user):
         for problem in problems:
             if problem.contest:
-                ensure_created_by(problem.contest, request.user)
+                ensure_created_by(problem.contest, user)
             else:
-                ensure_created_by(problem, request.user)
+                ensure_created_by(problem, user)
+
+    @validate_serializer(ExportProblemRequestSerialzier)
+    def post(self, request):
+        """
+        创建后台导出任务, 通过 get 查询进度和下载
+        """
+        problem_ids = request.data["problem_id"]
+        self._check_permission(Problem.objects.filter(id__in=problem_ids).select_related("contest"), request.user)
+        job_id = rand_str()
+        cache.set(export_job_key(job_id), {"user_id": request.user.id, "status": "pending",
+                                           "finished": 0, "total": len(problem_ids)}, EXPORT_JOB_TTL)
+        export_problems.send(job_id, request.user.id, problem_ids)
+        return self.success({"job_id": job_id})
+
+    def get(self, request):
+        job_id = request.GET.get("job_id")
+        if not job_id:
+            return self._export(request)
+        job = cache.get(export_job_key(job_id))
+        if not job or job["user_id"] != request.user.id:
+            return self.error("Export job does not exist")
+        if not request.GET.get("download"):
+            return self.success({k: v for k, v in job.items() if k != "user_id"})
+        if job["status"] != "finished":
+            return self.error("Export job is not finished")
+        resp = FileResponse(open(export_job_path(job_id), "rb"))
+        resp["Content-Type"] = "application/zip"
+        resp["Content-Disposition"] = "attachment;filename=problem-export.zip"
+        return resp
+
+    @validate_serializer(ExportProblemRequestSerialzier)
+    def _export(self, request):
+        """
+        同步导出, 适合题目数量比较少的情况
+        """
+        problem_ids = request.data["problem_id"]
+        self._check_permission(Problem.objects.filter(id__in=problem_ids).select_related("contest"), request.user)
         path = f"/tmp/{rand_str()}.zip"
-        with zipfile.ZipFile(path, "w") as zip_file:
-            for index, problem in enumerate(problems):
-                self.process_one_problem(zip_file=zip_file, user=request.user, problem=problem, index=index + 1)
+        build_export_zip(path, request.user.id, problem_ids)
         delete_files.send_with_options(args=(path,), delay=300_000)
         resp = FileResponse(open(path, "rb"))
         resp["Content-Type"] = "application/zip"
@@ -546,83 +612,52 @@ class ExportProblemAPI(APIView):
         return resp
 
 
-class ImportProblemAPI(CSRFExemptAPIView, TestCaseZipProcessor):
+class ImportProblemAPI(CSRFExemptAPIView):
     request_parsers = ()
 
     def post(self, request):
+        """
+        创建后台导入任务, 通过 get 查询每道题的导入结果
+        """
         form = UploadProblemForm(request.POST, request.FILES)
-        if form.is_valid():
-            file = form.cleaned_data["file"]
-            tmp_file = f"/tmp/{rand_str()}.zip"
-            with open(tmp_file, "wb") as f:
-                for chunk in file:
-                    f.write(chunk)
-        else:
+        if not form.is_valid():
             return self.error("Upload failed")
+        job_id = rand_str()
+        with open(import_job_path(job_id), "wb") as f:
+            for chunk in form.cleaned_data["file"]:
+                f.write(chunk)
+        cache.set(import_job_key(job_id), {"user_id": request.user.id, "status": "pending",
+                                           "total": 0, "problems": {}}, IMPORT_JOB_TTL)
+        import_problems.send(job_id)
+        return self.success({"job_id": job_id})
+
+    def _get_job(self, request):
+        job_id = request.GET.get("job_id")
+        job = cache.get(import_job_key(job_id)) if job_id else None
+        if not job or job["user_id"] != request.user.id:
+            raise APIError("Import job does not exist")
+        return job_id, job
 
-        count = 0
-        with zipfile.ZipFile(tmp_file, "r") as zip_file:
-            name_list = zip_file.namelist()
-            for item in name_list:
-                if "/problem.json" in item:
-                    count += 1
-            with transaction.atomic():
-                for i in range(1, count + 1):
-                    with zip_file.open(f"{i}/problem.json") as f:
-                        problem_info = json.load(f)
-                        serializer = ImportProblemSerializer(data=problem_info)
-                        if not serializer.is_valid():
-                            return self.error(f"Invalid problem format, error is {serializer.errors}")
-                        else:
-                            problem_info = serializer.data
-                            for item in problem_info["template"].keys():
-                                if item not in SysOptions.language_names:
-                                    return self.error(f"Unsupported language {item}")
-
-                        problem_info["display_id"] = problem_info["display_id"][:24]
-                        for k, v in problem_info["template"].items():
-                            problem_info["template"][k] = build_problem_template(v["prepend"], v["template"],
-                                                                                 v["append"])
-
-                        spj = problem_info["spj"] is not None
-                        rule_type = problem_info["rule_type"]
-                        test_case_score = problem_info["test_case_score"]
-
-                        # process test case
-                        _, test_case_id = self.process_zip(tmp_file, spj=spj, dir=f"{i}/testcase/")
-
-                        problem_obj = Problem.objects.create(_id=problem_info["display_id"],
-                                                             title=problem_info["title"],
-                                                             description=problem_info["description"]["value"],
-                                                             input_description=problem_info["input_description"][
-                                                                 "value"],
-                                                             output_description=problem_info["output_description"][
-                                                                 "value"],
-                                                             hint=problem_info["hint"]["value"],
-                                                             test_case_score=test_case_score if test_case_score else [],
-                                                             time_limit=problem_info["time_limit"],
-                                                             memory_limit=problem_info["memory_limit"],
-                                                             samples=problem_info["samples"],
-                                                             template=problem_info["template"],
-                                                             rule_type=problem_info["rule_type"],
-                                                             source=problem_info["source"],
-                                                             spj=spj,
-                                                             spj_code=problem_info["spj"]["code"] if spj else None,
-                                                             spj_language=problem_info["spj"][
-                                                                 "language"] if spj else None,
-                                                             spj_version=rand_str(8) if spj else "",
-                                                             languages=SysOptions.language_names,
-                                                             created_by=request.user,
-                                                             visible=False,
-                                                             difficulty=Difficulty.MID,
-                                                             total_score=sum(item["score"] for item in test_case_score)
-                                                             if rule_type == ProblemRuleType.OI else 0,
-                                                             test_case_id=test_case_id
-                                                             )
-                        for tag_name in problem_info["tags"]:
-                            tag_obj, _ = ProblemTag.objects.get_or_create(name=tag_name)
-                            problem_obj.tags.add(tag_obj)
-        return self.success({"import_count": count})
+    def get(self, request):
+        _, job = self._get_job(request)
+        problems = job["problems"]
+        return self.success({"status": job["status"], "err": job.get("err"), "total": job["total"],
+                             "finished": len(problems),
+                             "import_count": sum(1 for item in problems.values() if "problem_id" in item),
+                             "problems": problems})
+
+    def put(self, request):
+        """
+        继续导入失败的任务, 已经导入的题目会被跳过
+        """
+        job_id, job = self._get_job(request)
+        # 等待中或者正在运行的任务再次发送会被两个 worker 同时导入
+        if job["status"] != "failed":
+            return self.error(f"Import job is {job['status']}")
+        if not os.path.exists(import_job_path(job_id)):
+            return self.error("Upload file does not exist")
+        import_problems.send(job_id)
+        return self.success()
 
 
 class FPSProblemImport(CSRFExemptAPIView):
@@ -669,37 +704,55 @@ class FPSProblemImport(CSRFExemptAPIView):
                                difficulty=Difficulty.MID,
                                test_case_id=problem_data["test_case_id"])
 
-    def post(self, request):
-        form = UploadProblemForm(request.POST, request.FILES)
-        if form.is_valid():
-            file = form.cleaned_data["file"]
-            with tempfile.NamedTemporaryFile("wb") as tf:
-                for chunk in file.chunks(4096):
-                    tf.file.write(chunk)
+    # 每一批题目在一个事务中提交
+    batch_size = 20
 
-                tf.file.flush()
-                os.fsync(tf.file)
+    def _create_batch(self, batch, creator):
+        # 事务开始之前一起清理富文本, 保存的时候直接使用清理的结果
+        sanitize_many(problem_data[key] for problem_data in batch
+                      for key in ("description", "input", "output", "hint"))
+        with transaction.atomic():
+            for problem_data in batch:
+                self._create_problem(problem_data, creator)
 
-                problems = FPSParser(tf.name).parse()
-        else:
+    def _import_problem(self, helper, _problem):
+        test_case_id = rand_str()
+        test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
+        os.mkdir(test_case_dir)
+        score = []
+        for item in helper.save_test_case(_problem, test_case_dir)["test_cases"].values():
+            score.append({"score": 0, "input_name": item["input_name"],
+                          "output_name": item.get("output_name")})
+        test_case_id = store_test_case(test_case_id)
+        problem_data = helper.save_image(_problem, settings.UPLOAD_DIR, settings.UPLOAD_PREFIX)
+        s = FPSProblemSerializer(data=problem_data)
+        if not s.is_valid():
+            raise APIError(f"Parse FPS file error: {s.errors}")
+        problem_data = s.data
+        problem_data["test_case_id"] = test_case_id
+        problem_data["test_case_score"] = score
+        return problem_data
+
+    def post(self, request):
+        form = UploadProblemForm(request.POST, request.FILES)
+        if not form.is_valid():
             return self.error("Parse upload file error")
 
         helper = FPSHelper()
-        with transaction.atomic():
-            for _problem in problems:
-                test_case_id = rand_str()
-                test_case_dir = os.path.join(settings.TEST_CASE_DIR, test_case_id)
-                os.mkdir(test_case_dir)
-                score = []
-                for item in helper.save_test_case(_problem, test_case_dir)["test_cases"].values():
-                    score.append({"score": 0, "input_name": item["input_name"],
-                                  "output_name": item.get("output_name")})
-                problem_data = helper.save_image(_problem, settings.UPLOAD_DIR, settings.UPLOAD_PREFIX)
-                s = FPSProblemSerializer(data=problem_data)
-                if not s.is_valid():
-                    return self.error(f"Parse FPS file error: {s.errors}")
-                problem_data = s.data
-                problem_data["test_case_id"] = test_case_id
-                problem_data["test_case_score"] = score
-                self._create_problem(problem_data, request.user)
-        return self.success({"import_count": len(problems)})
+        count = 0
+        batch = []
+        with tempfile.NamedTemporaryFile("wb") as tf, tempfile.TemporaryDirectory() as spool_dir:
+            for chunk in form.cleaned_data["file"].chunks(4096):
+                tf.file.write(chunk)
+            tf.file.flush()
+
+            # 逐个解析题目, 测试数据和图片直接写入 spool_dir, 不会把整个文件读入内存
+            for _problem in FPSParser(tf.name).iter_problems(spool_dir=spool_dir):
+                batch.append(self._import_problem(helper, _problem))
+                if len(batch) >= self.batch_size:
+                    self._create_batch(batch, request.user)
+                    count += len(batch)
+                    batch = []
+        self._create_batch(batch, request.user)
+        count += len(batch)
+        return self.success({"import_count": count})
@@ -1,68 +1,59 @@
-import random
-from django.db.models import Q, Count
 from utils.api import APIView
 from account.decorators import check_contest_permission
-from ..models import ProblemTag, Problem, ProblemRuleType
+from ..browse import get_tag_counts, pick_random_problem
+from ..cache import cached_problem_data
+from ..models import ProblemTag, Problem, UserProblemStatus
+from ..search import search_problems
 from ..serializers import ProblemSerializer, TagSerializer, ProblemSafeSerializer
-from contest.models import ContestRuleType
 
 
 class ProblemTagAPI(APIView):
     def get(self, request):
-        qs = ProblemTag.objects
+        tag_counts = get_tag_counts()
+        tags = ProblemTag.objects.filter(id__in=list(tag_counts.keys()))
         keyword = request.GET.get("keyword")
         if keyword:
-            qs = ProblemTag.objects.filter(name__icontains=keyword)
-        tags = qs.annotate(problem_count=Count("problem")).filter(problem_count__gt=0)
+            tags = tags.filter(name__icontains=keyword)
         return self.success(TagSerializer(tags, many=True).data)
 
 
 class PickOneAPI(APIView):
     def get(self, request):
-        problems = Problem.objects.filter(contest_id__isnull=True, visible=True)
-        count = problems.count()
-        if count == 0:
+        problem_id = pick_random_problem()
+        if problem_id is None:
             return self.error("No problem to pick")
-        return self.success(problems[random.randint(0, count - 1)]._id)
+        return self.success(problem_id)
 
 
 class ProblemAPI(APIView):
     @staticmethod
     def _add_problem_status(request, queryset_values):
         if request.user.is_authenticated:
-            profile = request.user.userprofile
-            acm_problems_status = profile.acm_problems_status.get("problems", {})
-            oi_problems_status = profile.oi_problems_status.get("problems", {})
             # paginate data
             results = queryset_values.get("results")
             if results is not None:
                 problems = results
             else:
                 problems = [queryset_values, ]
+            # 只查询当前页的题目
+            problems_status = dict(UserProblemStatus.objects.filter(user_id=request.user.id,
+                                                                    problem_id__in=[item["id"] for item in problems])
+                                   .values_list("problem_id", "status"))
             for problem in problems:
-                if problem["rule_type"] == ProblemRuleType.ACM:
-                    problem["my_status"] = acm_problems_status.get(str(problem["id"]), {}).get("status")
-                else:
-                    problem["my_status"] = oi_problems_status.get(str(problem["id"]), {}).get("status")
+                problem["my_status"] = problems_status.get(problem["id"])
 
-    def get(self, request):
-        # 问题详情页
-        problem_id = request.GET.get("problem_id")
-        if problem_id:
-            try:
-                problem = Problem.objects.select_related("created_by") \
-                    .get(_id=problem_id, contest_id__isnull=True, visible=True)
-                problem_data = ProblemSerializer(problem).data
-                self._add_problem_status(request, problem_data)
-                return self.success(problem_data)
-            except Problem.DoesNotExist:
-                return self.error("Problem does not exist")
-
-        limit = request.GET.get("limit")
-        if not limit:
-            return self.error("Limit is needed")
+    @staticmethod
+    def _get_problem_data(problem_id):
+        try:
+            problem = Problem.objects.select_related("created_by") \
+                .get(_id=problem_id, contest_id__isnull=True, visible=True)
+        except Problem.DoesNotExist:
+            return None
+        return ProblemSerializer(problem).data
 
-        problems = Problem.objects.select_related("created_by").filter(contest_id__isnull=True, visible=True)
+    def _get_problem_list_data(self, request):
+        problems = Problem.objects.select_related("created_by").prefetch_related("tags") \
+            .filter(contest_id__isnull=True, visible=True)
         # 按照标签筛选
         tag_text = request.GET.get("tag")
         if tag_text:
@@ -71,14 +62,31 @@ class ProblemAPI(APIView):
         # 搜索的情况
         keyword = request.GET.get("keyword", "").strip()
         if keyword:
-            problems = problems.filter(Q(title__icontains=keyword) | Q(_id__icontains=keyword))
+            problems = search_problems(problems, keyword)
 
         # 难度筛选
         difficulty = request.GET.get("difficulty")
         if difficulty:
             problems = problems.filter(difficulty=difficulty)
+        return self.paginate_data(request, problems, ProblemSerializer)
+
+    def get(self, request):
+        # 问题详情页
+        problem_id = request.GET.get("problem_id")
+        if problem_id:
+            problem_data = cached_problem_data(lambda: self._get_problem_data(problem_id), "detail", problem_id)
+            if problem_data is None:
+                return self.error("Problem does not exist")
+            self._add_problem_status(request, problem_data)
+            return self.success(problem_data)
+
+        limit = request.GET.get("limit")
+        if not limit:
+            return self.error("Limit is needed")
+
+        params = [request.GET.get(item, "").strip() for item in ("limit", "offset", "tag", "keyword", "difficulty")]
+        data = cached_problem_data(lambda: self._get_problem_list_data(request), "list", *params)
         # 根据profile 为做过的题目添加标记
-        data = self.paginate_data(request, problems, ProblemSerializer)
         self._add_problem_status(request, data)
         return self.success(data)
 
@@ -86,13 +94,10 @@ class ProblemAPI(APIView):
 class ContestProblemAPI(APIView):
     def _add_problem_status(self, request, queryset_values):
         if request.user.is_authenticated:
-            profile = request.user.userprofile
-            if self.contest.rule_type == ContestRuleType.ACM:
-                problems_status = profile.acm_problems_status.get("contest_problems", {})
-            else:
-                problems_status = profile.oi_problems_status.get("contest_problems", {})
+            problems_status = dict(UserProblemStatus.objects.filter(user_id=request.user.id, contest=self.contest)
+                                   .values_list("problem_id", "status"))
             for problem in queryset_values:
-                problem["my_status"] = problems_status.get(str(problem["id"]), {}).get("status")
+                problem["my_status"] = problems_status.get(problem["id"])
 
     @check_contest_permission(check_type="problems")
     def get(self, request):
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class SubmissionConfig(AppConfig):
+    name = "submission"
+
+    def ready(self):
+        from . import signals  # NOQA
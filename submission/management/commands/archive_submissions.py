@@ -0,0 +1,45 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from submission.models import ArchivedSubmission, JudgeStatus, Submission, invalidate_archive_count
+
+
+class Command(BaseCommand):
+    help = "Move submissions older than --days from the submission table to submission_archive"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=180)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        days, batch_size = options["days"], options["batch_size"]
+        if days <= 0 or batch_size <= 0:
+            self.stdout.write(self.style.ERROR("Invalid args"))
+            exit(1)
+
+        before = timezone.now() - timedelta(days=days)
+        # 等待判题的提交不归档, 为了保证归档表中的提交都早于热表, 只归档比其中最早的一个更早的提交
+        oldest_pending = Submission.objects.filter(create_time__lt=before,
+                                                   result__in=[JudgeStatus.PENDING, JudgeStatus.JUDGING]) \
+            .order_by("create_time").values_list("create_time", flat=True).first()
+        if oldest_pending:
+            before = oldest_pending
+            self.stdout.write(f"Submissions after {before} are still judging, they will not be archived")
+        fields = [f.attname for f in Submission._meta.concrete_fields]
+        total = 0
+        while True:
+            with transaction.atomic():
+                batch = list(Submission.objects.filter(create_time__lt=before).order_by("create_time")[:batch_size])
+                if not batch:
+                    break
+                ArchivedSubmission.objects.bulk_create(
+                    [ArchivedSubmission(**{name: getattr(item, name) for name in fields}) for item in batch],
+                    ignore_conflicts=True)
+                Submission.objects.filter(id__in=[item.id for item in batch]).delete()
+            total += len(batch)
+            invalidate_archive_count()
+            self.stdout.write(f"{total} submissions archived")
+        self.stdout.write(self.style.SUCCESS(f"Done, {total} submissions created before {before} archived"))
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-19 16:36
+
+from django.db import migrations, models
+import django.db.models.deletion
+import utils.shortcuts
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('problem', '0017_problem_problem_type'),
+        ('contest', '0011_auto_20250812_2044'),
+        ('submission', '0013_auto_20250812_2044'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='submission',
+            name='create_time',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.CreateModel(
+            name='ArchivedSubmission',
+            fields=[
+                ('id', models.TextField(db_index=True, default=utils.shortcuts.rand_str, primary_key=True, serialize=False)),
+                ('user_id', models.IntegerField(db_index=True)),
+                ('username', models.TextField()),
+                ('code', models.TextField()),
+                ('result', models.IntegerField(db_index=True, default=6)),
+                ('info', models.JSONField(default=dict)),
+                ('language', models.TextField()),
+                ('shared', models.BooleanField(default=False)),
+                ('statistic_info', models.JSONField(default=dict)),
+                ('ip', models.TextField(null=True)),
+                ('create_time', models.DateTimeField(db_index=True)),
+                ('contest', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='contest.contest')),
+                ('problem', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='problem.problem')),
+            ],
+            options={
+                'db_table': 'submission_archive',
+                'ordering': ('-create_time',),
+            },
+        ),
+    ]
@@ -1,6 +1,10 @@
-from django.db import models
+import hashlib
+import itertools
 
-from utils.constants import ContestStatus
+from django.db import models, transaction
+
+from utils.cache import cache
+from utils.constants import CacheKey, ContestStatus
 from utils.models import JSONField
 from problem.models import Problem
 from contest.models import Contest
@@ -22,11 +26,11 @@ class JudgeStatus:
     PARTIALLY_ACCEPTED = 8
 
 
-class Submission(models.Model):
+class AbstractSubmission(models.Model):
     id = models.TextField(default=rand_str, primary_key=True, db_index=True)
     contest = models.ForeignKey(Contest, null=True, on_delete=models.CASCADE)
     problem = models.ForeignKey(Problem, on_delete=models.CASCADE)
-    create_time = models.DateTimeField(auto_now_add=True)
+    create_time = models.DateTimeField(auto_now_add=True, db_index=True)
     user_id = models.IntegerField(db_index=True)
     username = models.TextField()
     code = models.TextField()
@@ -52,8 +56,124 @@ class Submission(models.Model):
         return False
 
     class Meta:
-        db_table = "submission"
+        abstract = True
         ordering = ("-create_time",)
 
     def __str__(self):
         return self.id
+
+
+class Submission(AbstractSubmission):
+    class Meta:
+        db_table = "submission"
+        ordering = ("-create_time",)
+
+
+class ArchivedSubmission(AbstractSubmission):
+    """
+    由 archive_submissions 命令从 submission 表中迁移过来的历史提交, 只读
+    """
+    # 保留原提交时间, 不能使用 auto_now_add
+    create_time = models.DateTimeField(db_index=True)
+
+    class Meta:
+        db_table = "submission_archive"
+        ordering = ("-create_time",)
+
+
+# 可以缓存归档表计数的过滤条件
+ARCHIVE_COUNT_CACHE_FILTERS = {"contest", "contest_id", "contest_id__isnull", "problem", "problem_id",
+                               "user_id", "result"}
+
+
+def invalidate_archive_count():
+    cache.set(CacheKey.submission_archive_version, rand_str())
+
+
+class SubmissionChain(object):
+    """
+    submission 和 submission_archive 两张表的组合查询, 实现了 QuerySet 中 views 用到的部分接口
+    归档表中的提交都早于热表中的提交, 按默认的 -create_time 排序时结果可以直接拼接,
+    分页时只有翻过热表的末尾才会查询归档表
+    """
+    def __init__(self, hot=None, archive=None, count_cacheable=True):
+        self.hot = Submission.objects.all() if hot is None else hot
+        self.archive = ArchivedSubmission.objects.all() if archive is None else archive
+        # 只有不过滤或者按照 id 过滤的计数可以缓存, 用户名搜索之类的条件每个都会产生一个新的 key
+        self.count_cacheable = count_cacheable
+
+    def _apply(self, method, *args, **kwargs):
+        return self._chain(method, self.count_cacheable, *args, **kwargs)
+
+    def _chain(self, method, count_cacheable, *args, **kwargs):
+        return SubmissionChain(getattr(self.hot, method)(*args, **kwargs),
+                               getattr(self.archive, method)(*args, **kwargs),
+                               count_cacheable)
+
+    def filter(self, *args, **kwargs):
+        cacheable = self.count_cacheable and not args and set(kwargs) <= ARCHIVE_COUNT_CACHE_FILTERS
+        return self._chain("filter", cacheable, *args, **kwargs)
+
+    def exclude(self, *args, **kwargs):
+        return self._chain("exclude", False, *args, **kwargs)
+
+    def select_related(self, *fields):
+        return self._apply("select_related", *fields)
+
+    def only(self, *fields):
+        return self._apply("only", *fields)
+
+    def get(self, **kwargs):
+        try:
+            return self.hot.get(**kwargs)
+        except Submission.DoesNotExist:
+            pass
+        try:
+            return self.archive.get(**kwargs)
+        except ArchivedSubmission.DoesNotExist:
+            raise Submission.DoesNotExist
+
+    def exists(self):
+        return self.hot.exists() or self.archive.exists()
+
+    def first(self):
+        results = self[:1]
+        return results[0] if results else None
+
+    def update(self, **kwargs):
+        archive_count = self.archive.update(**kwargs)
+        if archive_count:
+            transaction.on_commit(invalidate_archive_count)
+        return self.hot.update(**kwargs) + archive_count
+
+    def _archive_count(self):
+        if not self.count_cacheable:
+            return self.archive.count()
+        # 归档表只在归档、修改和删除题目或比赛时变化, 计数结果按归档版本缓存
+        version = cache.get(CacheKey.submission_archive_version, "")
+        query_hash = hashlib.md5(str(self.archive.query).encode("utf-8")).hexdigest()
+        cache_key = f"{CacheKey.submission_archive_count}:{version}:{query_hash}"
+        count = cache.get(cache_key)
+        if count is None:
+            count = self.archive.count()
+            cache.set(cache_key, count, timeout=3600 * 24)
+        return count
+
+    def count(self):
+        return self.hot.count() + self._archive_count()
+
+    def __iter__(self):
+        return itertools.chain(self.hot.iterator(), self.archive.iterator())
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start, stop = item.start or 0, item.stop
+        results = list(self.hot[start:stop])
+        if stop is not None and len(results) == stop - start:
+            return results
+        # 热表已经翻到末尾, 剩下的部分从归档表中取
+        hot_count = start + len(results) if results else self.hot.count()
+        archive_start = max(start - hot_count, 0)
+        archive_stop = None if stop is None else max(stop - hot_count, 0)
+        return results + list(self.archive[archive_start:archive_stop])
@@ -0,0 +1,16 @@
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from contest.models import Contest
+from problem.models import Problem
+
+from .models import invalidate_archive_count
+
+
+# 删除题目或者比赛时级联删除归档表中的提交, 归档表的计数缓存需要失效
+@receiver(post_delete, sender=Problem)
+@receiver(post_delete, sender=Contest)
+def archive_owner_deleted(sender, instance, **kwargs):
+    # 提交之前其他请求可能按照新的版本号缓存了旧的计数
+    transaction.on_commit(invalidate_archive_count)
@@ -1,9 +1,17 @@
 from copy import deepcopy
+from datetime import timedelta
+from io import StringIO
 from unittest import mock
 
+from django.core.management import call_command
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from options.options import SysOptions
 from problem.models import Problem, ProblemTag
 from utils.api.tests import APITestCase
-from .models import Submission
+from utils.cache import cache
+from .models import ArchivedSubmission, JudgeStatus, Submission, SubmissionChain
 
 DEFAULT_PROBLEM_DATA = {"_id": "A-110", "title": "test", "description": "<p>test</p>", "input_description": "test",
                         "output_description": "test", "time_limit": 1000, "memory_limit": 256, "difficulty": "Low",
@@ -57,6 +65,51 @@ class SubmissionListTest(SubmissionPrepare):
         self.assertSuccess(resp)
 
 
+class SubmissionArchiveTest(SubmissionPrepare):
+    def setUp(self):
+        self._create_problem_and_submission()
+        Submission.objects.filter(id=self.submission.id).update(create_time=timezone.now() - timedelta(days=365))
+        self.new_submission = Submission.objects.create(**self.submission_data)
+        self.create_user("123", "345")
+        self.url = self.reverse("submission_list_api")
+
+    def test_archive_submissions(self):
+        call_command("archive_submissions", days=30, stdout=StringIO())
+        self.assertFalse(Submission.objects.filter(id=self.submission.id).exists())
+        archived = ArchivedSubmission.objects.get(id=self.submission.id)
+        self.assertLess(archived.create_time, timezone.now() - timedelta(days=300))
+        self.assertEqual(SubmissionChain().get(id=self.submission.id).id, self.submission.id)
+
+    def test_list_includes_archived_submissions(self):
+        call_command("archive_submissions", days=30, stdout=StringIO())
+        resp = self.client.get(self.url, data={"limit": "10"})
+        self.assertSuccess(resp)
+        self.assertEqual(resp.data["data"]["total"], 2)
+        self.assertEqual([item["id"] for item in resp.data["data"]["results"]],
+                         [self.new_submission.id, self.submission.id])
+
+        resp = self.client.get(self.url, data={"limit": "1", "offset": "1"})
+        self.assertEqual([item["id"] for item in resp.data["data"]["results"]], [self.submission.id])
+
+    def test_pending_submission_not_overtaken(self):
+        pending = Submission.objects.create(**{**self.submission_data, "result": JudgeStatus.PENDING})
+        later = Submission.objects.create(**self.submission_data)
+        Submission.objects.filter(id=pending.id).update(create_time=timezone.now() - timedelta(days=200))
+        Submission.objects.filter(id=later.id).update(create_time=timezone.now() - timedelta(days=100))
+        call_command("archive_submissions", days=30, stdout=StringIO())
+        # 归档表中的提交都早于热表中的提交
+        self.assertEqual(list(ArchivedSubmission.objects.values_list("id", flat=True)), [self.submission.id])
+        self.assertEqual(Submission.objects.filter(id__in=[pending.id, later.id]).count(), 2)
+
+    def test_archive_count_invalidated(self):
+        call_command("archive_submissions", days=30, stdout=StringIO())
+        self.assertEqual(SubmissionChain().count(), 2)
+        self.assertFalse(SubmissionChain().filter(username__icontains="te").count_cacheable)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.problem.delete()
+        self.assertEqual(SubmissionChain().count(), 0)
+
+
 @mock.patch("submission.views.oj.judge_task.send")
 class SubmissionAPITest(SubmissionPrepare):
     def setUp(self):
@@ -76,3 +129,21 @@ class SubmissionAPITest(SubmissionPrepare):
         self.assertDictEqual(resp.data, {"error": "error",
                                          "data": "Python3 is now allowed in the problem"})
         judge_task.assert_not_called()
+
+    def test_appkey_submission(self, judge_task):
+        self.user.open_api = True
+        self.user.open_api_appkey = "appkey-submission"
+        self.user.save()
+        self.addCleanup(cache.delete, f"throttling:user:{self.user.id}")
+        resp = APIClient().post(self.url, self.submission_data, HTTP_APPKEY="appkey-submission",
+                                REMOTE_ADDR="10.0.0.2")
+        self.assertSuccess(resp)
+        self.assertEqual(Submission.objects.get(id=resp.data["data"]["submission_id"]).ip, "10.0.0.2")
+
+    def test_user_throttling(self, judge_task):
+        SysOptions.throttling = {"user": {"capacity": 1, "fill_rate": 0.001, "default_capacity": 1}}
+        self.addCleanup(cache.delete, f"throttling:user:{self.user.id}")
+        self.assertSuccess(self.client.post(self.url, self.submission_data))
+        resp = self.client.post(self.url, self.submission_data)
+        self.assertFailed(resp)
+        self.assertTrue(resp.data["data"].startswith("Please wait"))
@@ -9,30 +9,32 @@ from problem.models import Problem, ProblemRuleType
 from utils.api import APIView, validate_serializer
 from utils.cache import cache
 from utils.captcha import Captcha
-from utils.throttling import TokenBucket
-from ..models import Submission
+from utils.throttling import make_limiter
+from ..models import Submission, SubmissionChain
 from ..serializers import (CreateSubmissionSerializer, SubmissionModelSerializer,
                            ShareSubmissionSerializer)
 from ..serializers import SubmissionSafeModelSerializer, SubmissionListSerializer
 
 
 class SubmissionAPI(APIView):
-    def throttling(self, request):
-        # 使用 open_api 的请求暂不做限制
+    def throttling(self, request, captcha_passed=False):
+        # 使用 open_api 的请求按 appkey 对应的用户单独限制
         auth_method = getattr(request, "auth_method", "")
         if auth_method == "api_key":
+            can_consume, wait = make_limiter("api_key", request.user.id, cache).consume()
+            if not can_consume:
+                return "Please wait %d seconds" % (int(wait))
             return
-        user_bucket = TokenBucket(key=str(request.user.id),
-                                  redis_conn=cache, **SysOptions.throttling["user"])
-        can_consume, wait = user_bucket.consume()
+
+        can_consume, wait = make_limiter("user", request.user.id, cache).consume()
         if not can_consume:
             return "Please wait %d seconds" % (int(wait))
 
-        # ip_bucket = TokenBucket(key=request.session["ip"],
-        #                         redis_conn=cache, **SysOptions.throttling["ip"])
-        # can_consume, wait = ip_bucket.consume()
-        # if not can_consume:
-        #     return "Captcha is required"
+        # 同一 ip 下的用户可能很多(机房, 校园网), ip 超出限制的时候只要求验证码
+        if not captcha_passed:
+            can_consume, wait = make_limiter("ip", request.ip, cache).consume()
+            if not can_consume:
+                return "Captcha is required"
 
     @check_contest_permission(check_type="problems")
     def check_contest_permission(self, request):
@@ -40,7 +42,7 @@ class SubmissionAPI(APIView):
         if contest.status == ContestStatus.CONTEST_ENDED:
             return self.error("The contest have ended")
         if not request.user.is_contest_admin(contest):
-            user_ip = ipaddress.ip_address(request.session.get("ip"))
+            user_ip = ipaddress.ip_address(request.ip)
             if contest.allowed_ip_ranges:
                 if not any(user_ip in ipaddress.ip_network(cidr, strict=False) for cidr in contest.allowed_ip_ranges):
                     return self.error("Your IP is not allowed in this contest")
@@ -58,10 +60,12 @@ class SubmissionAPI(APIView):
             if not contest.problem_details_permission(request.user):
                 hide_id = True
 
+        captcha_passed = False
         if data.get("captcha"):
             if not Captcha(request).check(data["captcha"]):
                 return self.error("Invalid captcha")
-        error = self.throttling(request)
+            captcha_passed = True
+        error = self.throttling(request, captcha_passed)
         if error:
             return self.error(error)
 
@@ -76,7 +80,7 @@ class SubmissionAPI(APIView):
                                                language=data["language"],
                                                code=data["code"],
                                                problem_id=problem.id,
-                                               ip=request.session["ip"],
+                                               ip=request.ip,
                                                contest_id=data.get("contest_id"))
         # use this for debug
         # JudgeDispatcher(submission.id, problem.id).judge()
@@ -92,7 +96,7 @@ class SubmissionAPI(APIView):
         if not submission_id:
             return self.error("Parameter id doesn't exist")
         try:
-            submission = Submission.objects.select_related("problem").get(id=submission_id)
+            submission = SubmissionChain().select_related("problem").get(id=submission_id)
         except Submission.DoesNotExist:
             return self.error("Submission doesn't exist")
         if not submission.check_user_permission(request.user):
@@ -113,7 +117,7 @@ class SubmissionAPI(APIView):
         share submission
         """
         try:
-            submission = Submission.objects.select_related("problem").get(id=request.data["id"])
+            submission = SubmissionChain().select_related("problem").get(id=request.data["id"])
         except Submission.DoesNotExist:
             return self.error("Submission doesn't exist")
         if not submission.check_user_permission(request.user, check_share=False):
@@ -132,7 +136,7 @@ class SubmissionListAPI(APIView):
         if request.GET.get("contest_id"):
             return self.error("Parameter error")
 
-        submissions = Submission.objects.filter(contest_id__isnull=True).select_related("problem__created_by")
+        submissions = SubmissionChain().filter(contest_id__isnull=True).select_related("problem__created_by")
         problem_id = request.GET.get("problem_id")
         myself = request.GET.get("myself")
         result = request.GET.get("result")
@@ -161,7 +165,7 @@ class ContestSubmissionListAPI(APIView):
             return self.error("Limit is needed")
 
         contest = self.contest
-        submissions = Submission.objects.filter(contest_id=contest.id).select_related("problem__created_by")
+        submissions = SubmissionChain().filter(contest_id=contest.id).select_related("problem__created_by")
         problem_id = request.GET.get("problem_id")
         myself = request.GET.get("myself")
         result = request.GET.get("result")
@@ -199,5 +203,5 @@ class SubmissionExistsAPI(APIView):
         if not request.GET.get("problem_id"):
             return self.error("Parameter error, problem_id is required")
         return self.success(request.user.is_authenticated and
-                            Submission.objects.filter(problem_id=request.GET["problem_id"],
-                                                      user_id=request.user.id).exists())
+                            SubmissionChain().filter(problem_id=request.GET["problem_id"],
+                                                     user_id=request.user.id).exists())
@@ -1,14 +1,32 @@
 import functools
+import hashlib
 import json
 import logging
+import time
+import uuid
+from urllib.parse import urlencode
 
 from django.http import HttpResponse, QueryDict
+from django.utils.cache import get_conditional_response
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 from django.views.generic import View
 
+from utils.cache import cache
+from utils.constants import CacheKey
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 logger = logging.getLogger("")
 
+# 缓存未命中时只有一个请求重新计算, 其他请求最多等待 RESPONSE_CACHE_WAIT_TIMES * RESPONSE_CACHE_WAIT_INTERVAL 秒
+RESPONSE_CACHE_LOCK_TTL = 10
+RESPONSE_CACHE_WAIT_TIMES = 20
+RESPONSE_CACHE_WAIT_INTERVAL = 0.05
+
 
 class APIError(Exception):
     def __init__(self, msg, err=None):
@@ -40,12 +58,28 @@ class URLEncodedParser(object):
         return QueryDict(body)
 
 
+class JSONRenderer(object):
+    """
+    紧凑格式的 json, 安装了 orjson 的时候优先使用 orjson
+    """
+    @staticmethod
+    def render(data):
+        if orjson is not None:
+            try:
+                return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+            except TypeError:
+                # orjson 不支持的类型交给标准库处理
+                pass
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
 class JSONResponse(object):
     content_type = ContentType.json_response
+    renderer = JSONRenderer
 
     @classmethod
     def response(cls, data):
-        resp = HttpResponse(json.dumps(data, indent=4), content_type=cls.content_type)
+        resp = HttpResponse(cls.renderer.render(data), content_type=cls.content_type)
         resp.data = data
         return resp
 
@@ -110,6 +144,16 @@ class APIView(View):
     def server_error(self):
         return self.error(err="server-error", msg="server error")
 
+    def conditional_response(self, request, response):
+        """
+        GET 请求的响应根据内容计算 ETag, 和 If-None-Match 相同的时候返回 304
+        """
+        if request.method not in ("GET", "HEAD") or response.status_code != 200 or response.streaming:
+            return response
+        if not response.has_header("ETag"):
+            response["ETag"] = f'"{hashlib.md5(response.content).hexdigest()}"'
+        return get_conditional_response(request, etag=response["ETag"], response=response)
+
     def paginate_data(self, request, query_set, object_serializer=None):
         """
         :param request: django的request
@@ -146,7 +190,7 @@ class APIView(View):
             except ValueError as e:
                 return self.error(err="invalid-request", msg=str(e))
         try:
-            return super(APIView, self).dispatch(request, *args, **kwargs)
+            return self.conditional_response(request, super(APIView, self).dispatch(request, *args, **kwargs))
         except APIError as e:
             ret = {"msg": e.msg}
             if e.err:
@@ -185,3 +229,87 @@ def validate_serializer(serializer):
         return handle
 
     return validate
+
+
+# 所有缓存共用的 tag
+GLOBAL_TAG = "*"
+
+
+def _tag_key(tag):
+    return f"{CacheKey.response_cache_tag}:{tag}"
+
+
+def invalidate_response_cache(*tags):
+    """
+    更换 tag 的版本号之后旧的缓存不会再被访问, 等待过期即可. 没有 tags 的时候所有缓存失效
+    """
+    tags = tags or (GLOBAL_TAG, )
+    cache.set_many({_tag_key(tag): uuid.uuid4().hex for tag in tags}, timeout=None)
+
+
+def get_response_cache_stats():
+    """
+    :return: {view 方法名: {"hit": 命中次数, "miss": 未命中次数}}
+    """
+    stats = {}
+    for field, count in cache.hgetall(CacheKey.response_cache_stats).items():
+        name, kind = field.decode("utf-8").rsplit(":", 1)
+        stats.setdefault(name, {"hit": 0, "miss": 0})[kind] = int(count)
+    return stats
+
+
+def cache_response(ttl, tags=(), refresh=None):
+    """
+    缓存和用户无关的 GET 接口, 只缓存成功的响应, key 由方法名、排序之后的查询参数和 tag 的版本号组成
+    @cache_response(ttl=60, tags=["contest"])
+    def get(self, request):
+        ...
+
+    :param tags: 数据修改之后通过 invalidate_response_cache(tag) 让缓存失效
+    :param refresh: 缓存中的数据返回之前调用, 用于更新和当前时间相关的字段
+    """
+    tag_keys = [_tag_key(tag) for tag in (GLOBAL_TAG, *tags)]
+
+    def decorator(view_method):
+        name = view_method.__qualname__
+
+        @functools.wraps(view_method)
+        def handle(self, request, *args, **kwargs):
+            versions = cache.get_many(tag_keys)
+            query = urlencode(sorted((k, v) for k in request.GET for v in request.GET.getlist(k)))
+            digest = hashlib.md5(json.dumps([name, query, args, kwargs, [versions.get(key) for key in tag_keys]],
+                                            default=str).encode("utf-8")).hexdigest()
+            key = f"{CacheKey.response_cache}:{digest}"
+            lock_key = f"{key}:lock"
+
+            data = cache.get(key)
+            locked = False
+            if data is None:
+                locked = cache.add(lock_key, 1, RESPONSE_CACHE_LOCK_TTL)
+                if not locked:
+                    # 其他请求正在计算
+                    for _ in range(RESPONSE_CACHE_WAIT_TIMES):
+                        time.sleep(RESPONSE_CACHE_WAIT_INTERVAL)
+                        data = cache.get(key)
+                        if data is not None:
+                            break
+            if data is not None:
+                cache.hincrby(CacheKey.response_cache_stats, f"{name}:hit", 1)
+                if refresh:
+                    refresh(data["data"])
+                return self.response(data)
+
+            cache.hincrby(CacheKey.response_cache_stats, f"{name}:miss", 1)
+            try:
+                resp = view_method(self, request, *args, **kwargs)
+                data = getattr(resp, "data", None)
+                if resp.status_code == 200 and isinstance(data, dict) and data.get("error") is None:
+                    cache.set(key, data, ttl)
+            finally:
+                if locked:
+                    cache.delete(lock_key)
+            return resp
+
+        return handle
+
+    return decorator
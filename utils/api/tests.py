@@ -3,11 +3,17 @@ from django.test.testcases import TestCase
 from rest_framework.test import APIClient
 
 from account.models import AdminType, ProblemPermission, User, UserProfile
+from utils.api import invalidate_response_cache
 
 
 class APITestCase(TestCase):
     client_class = APIClient
 
+    def _pre_setup(self):
+        super()._pre_setup()
+        # redis 中的缓存不会随着测试数据库一起回滚
+        invalidate_response_cache()
+
     def create_user(self, username, password, admin_type=AdminType.REGULAR_USER, login=True,
                     problem_permission=ProblemPermission.NONE):
         user = User.objects.create(username=username, admin_type=admin_type, problem_permission=problem_permission)
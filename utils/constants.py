@@ -25,6 +25,32 @@ class CacheKey:
     waiting_queue = "waiting_queue"
     contest_rank_cache = "contest_rank_cache"
     website_config = "website_config"
+    submission_archive_version = "submission_archive_version"
+    submission_archive_count = "submission_archive_count"
+    problem_cache = "problem_cache"
+    problem_cache_version = "problem_cache_version"
+    problem_tag_count = "problem_tag_count"
+    problem_display_ids = "problem_display_ids"
+    problem_browse_state = "problem_browse_state"
+    problem_browse_ready = "problem_browse_ready"
+    problem_export = "problem_export"
+    problem_import = "problem_import"
+    user_sessions = "user_sessions"
+    appkey_user = "appkey_user"
+    appkey_usage = "appkey_usage"
+    user_rank_acm = "user_rank_acm"
+    user_rank_oi = "user_rank_oi"
+    user_rank_ready = "user_rank_ready"
+    user_rank_fresh = "user_rank_fresh"
+    user_rank_lock = "user_rank_lock"
+    user_rank_dirty = "user_rank_dirty"
+    generate_user = "generate_user"
+    options_version = "options_version"
+    response_cache = "response_cache"
+    response_cache_tag = "response_cache_tag"
+    response_cache_stats = "response_cache_stats"
+    profiler_stats = "profiler_stats"
+    profiler_duplicates = "profiler_duplicates"
 
 
 class Difficulty(Choices):
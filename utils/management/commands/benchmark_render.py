@@ -0,0 +1,36 @@
+import json
+import timeit
+
+from django.core.management.base import BaseCommand
+from django.test import Client
+
+from account.models import User
+from utils.api import JSONRenderer
+
+
+class Command(BaseCommand):
+    help = "比较各个接口的 json 序列化耗时和响应大小, 例如 benchmark_render /api/problem?limit=50 /api/user_rank?rule=ACM"
+
+    def add_arguments(self, parser):
+        parser.add_argument("urls", nargs="+", type=str)
+        parser.add_argument("--username", type=str, help="以这个用户的身份请求")
+        parser.add_argument("--number", type=int, default=50, help="每种方式重复的次数")
+
+    def handle(self, *args, **options):
+        client = Client()
+        if options["username"]:
+            client.force_login(User.objects.get(username=options["username"]))
+        renderers = {"indent": lambda data: json.dumps(data, indent=4).encode("utf-8"),
+                     "compact": lambda data: json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                     "renderer": JSONRenderer.render}
+        number = options["number"]
+        for url in options["urls"]:
+            resp = client.get(url)
+            data = getattr(resp, "data", None)
+            if data is None:
+                self.stdout.write(self.style.ERROR(f"{url}: not a json api, status {resp.status_code}"))
+                continue
+            self.stdout.write(self.style.SUCCESS(url))
+            for name, render in renderers.items():
+                cost = timeit.timeit(lambda: render(data), number=number) / number
+                self.stdout.write(f"    {name:<10}{cost * 1000:>10.3f} ms{len(render(data)):>12} bytes")
@@ -0,0 +1,58 @@
+import timeit
+
+from django.core.management.base import BaseCommand
+
+from problem.models import Problem
+from utils import sanitizer
+from utils.xss_filter import XSSHtml
+
+SAMPLE_STATEMENT = """<p>给定一个长度为 <code>n</code> 的整数序列 <code>a<sub>1</sub>, a<sub>2</sub>, ..., a<sub>n</sub></code>,
+请你求出其中和最大的连续子序列, 并输出这个和.</p>
+<p><img src="/public/upload/sample.png" width="400" alt="sample" /></p>
+<table border="1"><thead><tr><th>n</th><th>a<sub>i</sub></th></tr></thead>
+<tbody><tr><td>1 &le; n &le; 10<sup>5</sup></td><td>|a<sub>i</sub>| &le; 10<sup>9</sup></td></tr></tbody></table>
+<pre><code>int main() { return 0; }</code></pre>
+<p style="color: red">注意: 答案可能超过 32 位整数的范围, 更多说明参见 <a href="https://oj.example.com/faq">FAQ</a>.</p>
+"""
+
+
+def clean_with_xss_html(content):
+    with XSSHtml() as parser:
+        return parser.clean(content)
+
+
+class Command(BaseCommand):
+    help = "比较 XSSHtml 和 utils.sanitizer 清理题目描述的耗时, 默认使用数据库中的题目"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--limit", type=int, default=200, help="最多使用多少道题目")
+        parser.add_argument("--number", type=int, default=5, help="重复的次数")
+
+    def handle(self, *args, **options):
+        contents = []
+        for problem in Problem.objects.order_by("-id")[:options["limit"]]:
+            contents.extend([problem.description, problem.input_description,
+                             problem.output_description, problem.hint or ""])
+        if not contents:
+            contents = [f"<h3>Problem {i}</h3>{SAMPLE_STATEMENT}" for i in range(100)]
+        number = options["number"]
+        size = sum(len(item) for item in contents)
+        self.stdout.write(f"{len(contents)} fields, {size} characters")
+
+        for content in contents:
+            if sanitizer._clean(content) != clean_with_xss_html(content):
+                self.stdout.write(self.style.ERROR("result differs from XSSHtml"))
+                return
+
+        def cold():
+            sanitizer._memo.items.clear()
+            for content in contents:
+                sanitizer.sanitize(content)
+
+        cases = {"XSSHtml": lambda: [clean_with_xss_html(content) for content in contents],
+                 "sanitize cold": cold,
+                 "sanitize warm": lambda: [sanitizer.sanitize(content) for content in contents],
+                 "sanitize_many": lambda: (sanitizer._memo.items.clear(), sanitizer.sanitize_many(contents))}
+        for name, func in cases.items():
+            cost = timeit.timeit(func, number=number) / number
+            self.stdout.write(f"    {name:<16}{cost * 1000:>10.3f} ms")
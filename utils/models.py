@@ -1,10 +1,9 @@
 from django.db.models import JSONField  # NOQA
 from django.db import models
 
-from utils.xss_filter import XSSHtml
+from utils.sanitizer import sanitize
 
 
 class RichTextField(models.TextField):
     def get_prep_value(self, value):
-        with XSSHtml() as parser:
-            return parser.clean(value or "")
+        return sanitize(value)
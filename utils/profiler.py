@@ -0,0 +1,110 @@
+import logging
+import re
+import time
+from collections import Counter
+
+from utils.cache import cache
+from utils.constants import CacheKey
+
+logger = logging.getLogger(__name__)
+
+# 统计数据最后一次写入之后保留的时间
+PROFILER_TTL = 3600 * 24 * 7
+# 超过这个时间的请求计为慢请求, 单位秒
+PROFILER_SLOW_THRESHOLD = 0.5
+# 最多保留的重复查询数量, 按重复次数从多到少
+PROFILER_DUPLICATES_SIZE = 1000
+PROFILER_FIELDS = ("count", "queries", "duplicate_queries", "db_time", "wall_time", "slow")
+
+# 参数已经是 %s, 但是 LIMIT 之类的数字和部分字符串会直接拼接在 sql 中, IN 的参数个数也不固定
+_STRING_PATTERN = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_PATTERN = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_PATTERN = re.compile(r"%s|\?")
+_LIST_PATTERN = re.compile(r"\(\?(?:, \?)+\)")
+
+
+def fingerprint(sql):
+    sql = _STRING_PATTERN.sub("?", sql)
+    sql = _NUMBER_PATTERN.sub("?", sql)
+    sql = _PLACEHOLDER_PATTERN.sub("?", sql)
+    return _LIST_PATTERN.sub("(...)", sql)
+
+
+class QueryRecorder:
+    """
+    通过 connection.execute_wrapper 记录查询, 不依赖 DEBUG 和 connection.queries
+    """
+    def __init__(self):
+        self.queries = Counter()
+        self.db_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries[sql] += 1
+
+
+def record(endpoint, recorder, wall_time):
+    fingerprints = Counter()
+    for sql, count in recorder.queries.items():
+        fingerprints[fingerprint(sql)] += count
+    duplicates = {fp: count - 1 for fp, count in fingerprints.items() if count > 1}
+
+    pipe = cache.pipeline()
+    pipe.hincrby(CacheKey.profiler_stats, f"{endpoint}|count", 1)
+    pipe.hincrby(CacheKey.profiler_stats, f"{endpoint}|queries", sum(fingerprints.values()))
+    pipe.hincrby(CacheKey.profiler_stats, f"{endpoint}|duplicate_queries", sum(duplicates.values()))
+    pipe.hincrbyfloat(CacheKey.profiler_stats, f"{endpoint}|db_time", recorder.db_time)
+    pipe.hincrbyfloat(CacheKey.profiler_stats, f"{endpoint}|wall_time", wall_time)
+    if wall_time >= PROFILER_SLOW_THRESHOLD:
+        pipe.hincrby(CacheKey.profiler_stats, f"{endpoint}|slow", 1)
+    for fp, count in duplicates.items():
+        pipe.zincrby(CacheKey.profiler_duplicates, count, f"{endpoint}|{fp}")
+    if duplicates:
+        pipe.zremrangebyrank(CacheKey.profiler_duplicates, 0, -PROFILER_DUPLICATES_SIZE - 1)
+    pipe.expire(CacheKey.profiler_stats, PROFILER_TTL)
+    pipe.expire(CacheKey.profiler_duplicates, PROFILER_TTL)
+    try:
+        pipe.execute()
+    except Exception:
+        # 统计失败不影响请求本身
+        logger.exception("Failed to record profile of %s", endpoint)
+
+
+def get_profiler_stats(order_by="queries", duplicates_limit=5):
+    """
+    :param order_by: 按照哪一项的平均值从大到小排序, PROFILER_FIELDS 之一
+    :return: [{"endpoint": "GET problem_api", "count": 1, "avg_queries": 1.0, ..., "duplicates": [{"sql": "", "count": 1}]}]
+    """
+    totals = {}
+    for field, value in cache.hgetall(CacheKey.profiler_stats).items():
+        endpoint, name = field.decode("utf-8").rsplit("|", 1)
+        totals.setdefault(endpoint, dict.fromkeys(PROFILER_FIELDS, 0))[name] = float(value)
+
+    duplicates = {}
+    for member, count in cache.zrevrange(CacheKey.profiler_duplicates, 0, -1, withscores=True):
+        endpoint, sql = member.decode("utf-8").split("|", 1)
+        items = duplicates.setdefault(endpoint, [])
+        if len(items) < duplicates_limit:
+            items.append({"sql": sql, "count": int(count)})
+
+    result = []
+    for endpoint, total in totals.items():
+        count = int(total["count"]) or 1
+        item = {"endpoint": endpoint, "count": int(total["count"]), "slow": int(total["slow"]),
+                "duplicates": duplicates.get(endpoint, [])}
+        for name in ("queries", "duplicate_queries"):
+            item[f"avg_{name}"] = round(total[name] / count, 2)
+        # 时间的单位为毫秒
+        for name in ("db_time", "wall_time"):
+            item[f"avg_{name}"] = round(total[name] * 1000 / count, 3)
+        result.append(item)
+    result.sort(key=lambda x: x.get(f"avg_{order_by}", x.get(order_by, 0)), reverse=True)
+    return result
+
+
+def reset_profiler():
+    cache.delete_many([CacheKey.profiler_stats, CacheKey.profiler_duplicates])
@@ -0,0 +1,109 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.xss_filter import XSSHtml
+
+# 最近清理过的内容, 按照内容的 hash 保存清理之后的结果
+SANITIZE_MEMO_SIZE = 1024
+# 待清理的内容总长度达到这个值时使用多进程, 内容较少时进程间传递数据的开销比清理本身还大
+SANITIZE_POOL_MIN_SIZE = 1024 * 1024
+# 进程池的进程数, 不超过 CPU 核数
+SANITIZE_POOL_WORKERS = min(4, os.cpu_count() or 1)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class _Memo:
+    def __init__(self, size):
+        self.size = size
+        self.lock = threading.Lock()
+        self.items = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.items.get(key)
+            if value is not None:
+                self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+
+_memo = _Memo(SANITIZE_MEMO_SIZE)
+
+
+def _digest(content):
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
+
+def _escape(text):
+    return text.replace("<", "&lt;").replace(">", "&gt;").replace('"', "&quot;").replace("'", "&#039;")
+
+
+def _clean(content):
+    # 没有标签和实体的纯文本, 结果和 XSSHtml 相同, 不需要逐个字符解析
+    if "<" not in content and "&" not in content:
+        return _escape(content) if content.strip("\n") else ""
+    with XSSHtml() as parser:
+        return parser.clean(content)
+
+
+def _get_pool():
+    """
+    每个进程共用一个进程池, 同时运行的导入任务不会各自启动 cpu_count 个进程
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=SANITIZE_POOL_WORKERS)
+        return _pool
+
+
+def _clean_in_pool(contents):
+    global _pool
+    try:
+        return list(_get_pool().map(_clean, contents, chunksize=4))
+    except BrokenProcessPool:
+        # 子进程异常退出之后进程池不能再使用, 下一次重新创建
+        with _pool_lock:
+            _pool = None
+        raise
+
+
+def sanitize(content):
+    content = content or ""
+    digest = _digest(content)
+    cleaned = _memo.get(digest)
+    if cleaned is None:
+        cleaned = _clean(content)
+        _memo.set(digest, cleaned)
+    return cleaned
+
+
+def sanitize_many(contents):
+    """
+    批量清理, 用于导入题目, 结果放入缓存之后保存 RichTextField 时不会再次清理
+    :return: 和 contents 顺序相同的结果
+    """
+    contents = [content or "" for content in contents]
+    digests = [_digest(content) for content in contents]
+    results = {digest: _memo.get(digest) for digest in digests}
+    pending = {digest: content for digest, content in zip(digests, contents) if results[digest] is None}
+    if sum(len(content) for content in pending.values()) >= SANITIZE_POOL_MIN_SIZE:
+        cleaned = _clean_in_pool(list(pending.values()))
+    else:
+        cleaned = [_clean(content) for content in pending.values()]
+    for digest, item in zip(pending, cleaned):
+        _memo.set(digest, item)
+        results[digest] = item
+    return [results[digest] for digest in digests]
@@ -11,7 +11,7 @@ class InvalidLanguage(serializers.ValidationError):
 class LanguageNameChoiceField(serializers.CharField):
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
-        if data and data not in SysOptions.language_names:
+        if data and data not in SysOptions.language_registry.name_set:
             raise InvalidLanguage(data)
         return data
 
@@ -19,7 +19,7 @@ class LanguageNameChoiceField(serializers.CharField):
 class SPJLanguageNameChoiceField(serializers.CharField):
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
-        if data and data not in SysOptions.spj_language_names:
+        if data and data not in SysOptions.language_registry.spj_name_set:
             raise InvalidLanguage(data)
         return data
 
@@ -27,8 +27,9 @@ class SPJLanguageNameChoiceField(serializers.CharField):
 class LanguageNameMultiChoiceField(serializers.ListField):
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
+        names = SysOptions.language_registry.name_set
         for item in data:
-            if item not in SysOptions.language_names:
+            if item not in names:
                 raise InvalidLanguage(item)
         return data
 
@@ -36,7 +37,8 @@ class LanguageNameMultiChoiceField(serializers.ListField):
 class SPJLanguageNameMultiChoiceField(serializers.ListField):
     def to_internal_value(self, data):
         data = super().to_internal_value(data)
+        names = SysOptions.language_registry.spj_name_set
         for item in data:
-            if item not in SysOptions.spj_language_names:
+            if item not in names:
                 raise InvalidLanguage(item)
         return data
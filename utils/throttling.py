@@ -1,9 +1,75 @@
+import functools
+import hashlib
+import math
 import time
 
+from redis.exceptions import NoScriptError
+
+
+class LuaScript:
+    """
+    只保存脚本的 sha1, 正常情况下每次调用只有一次 EVALSHA, redis 重启或者脚本缓存被清空的时候退回 EVAL
+    """
+    def __init__(self, source):
+        self.source = source
+        self.sha = hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def __call__(self, redis_conn, keys, args):
+        try:
+            return redis_conn.evalsha(self.sha, len(keys), *keys, *args)
+        except NoScriptError:
+            return redis_conn.eval(self.source, len(keys), *keys, *args)
+
+
+# KEYS[1]: bucket key
+# ARGV: capacity, fill_rate, default_capacity, now, num, ttl
+TOKEN_BUCKET_SCRIPT = LuaScript("""
+local capacity = tonumber(ARGV[1])
+local fill_rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[4])
+local num = tonumber(ARGV[5])
+local state = redis.call("HMGET", KEYS[1], "last_capacity", "last_timestamp")
+local tokens = tonumber(state[1])
+local last_timestamp = tonumber(state[2])
+if tokens == nil or last_timestamp == nil then
+    tokens = tonumber(ARGV[3])
+    last_timestamp = now
+end
+tokens = math.min(capacity, tokens + math.max(now - last_timestamp, 0) * fill_rate)
+local allowed = 0
+local wait = 0
+if tokens >= num then
+    tokens = tokens - num
+    allowed = 1
+else
+    wait = (num - tokens) / fill_rate
+end
+redis.call("HSET", KEYS[1], "last_capacity", tostring(tokens), "last_timestamp", tostring(now))
+redis.call("EXPIRE", KEYS[1], ARGV[6])
+return {allowed, tostring(wait)}
+""")
+
+
+# KEYS[1]: window key
+# ARGV: limit, window, now, member
+SLIDING_WINDOW_SCRIPT = LuaScript("""
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now - window)
+if redis.call("ZCARD", KEYS[1]) < limit then
+    redis.call("ZADD", KEYS[1], now, ARGV[4])
+    redis.call("EXPIRE", KEYS[1], math.ceil(window))
+    return {1, "0"}
+end
+local oldest = redis.call("ZRANGE", KEYS[1], 0, 0, "WITHSCORES")
+return {0, tostring(tonumber(oldest[2]) + window - now)}
+""")
+
 
 class TokenBucket:
     """
-    注意：对于单个key的操作不是线程安全的
+    检查和消耗 token 在同一个 lua 脚本中完成, 一次往返, 并发请求也不会超发
     """
     def __init__(self, key, capacity, fill_rate, default_capacity, redis_conn):
         """
@@ -17,56 +83,91 @@ class TokenBucket:
         self._fill_rate = fill_rate
         self._default_capacity = default_capacity
         self._redis_conn = redis_conn
+        # 桶被填满之后 key 就没有保存的必要了
+        self._ttl = max(math.ceil(capacity / fill_rate), 1)
 
-        self._last_capacity_key = "last_capacity"
-        self._last_timestamp_key = "last_timestamp"
+    def consume(self, num=1):
+        """
+        消耗 num 个 token，返回是否成功
+        :param num:
+        :return: result: bool, wait_time: float
+        """
+        allowed, wait = TOKEN_BUCKET_SCRIPT(self._redis_conn, [self._key],
+                                            [self._capacity, self._fill_rate, self._default_capacity,
+                                             time.time(), num, self._ttl])
+        return bool(allowed), float(wait)
+
+
+class SlidingWindow:
+    """
+    滑动窗口计数, window 秒内最多 limit 次
+    """
+    def __init__(self, key, limit, window, redis_conn):
+        self._key = key
+        self._limit = limit
+        self._window = window
+        self._redis_conn = redis_conn
 
-    def _init_key(self):
-        self._last_capacity = self._default_capacity
+    def consume(self):
+        """
+        :return: result: bool, wait_time: float
+        """
         now = time.time()
-        self._last_timestamp = now
-        return self._default_capacity, now
+        allowed, wait = SLIDING_WINDOW_SCRIPT(self._redis_conn, [self._key],
+                                              [self._limit, self._window, now, f"{now}:{id(self)}"])
+        return bool(allowed), float(wait)
 
-    @property
-    def _last_capacity(self):
-        last_capacity = self._redis_conn.hget(self._key, self._last_capacity_key)
-        if last_capacity is None:
-            return self._init_key()[0]
-        else:
-            return float(last_capacity)
 
-    @_last_capacity.setter
-    def _last_capacity(self, value):
-        self._redis_conn.hset(self._key, self._last_capacity_key, value)
+def get_throttling_config(name):
+    from options.options import SysOptions, OptionDefaultValue
+    # 已经保存在数据库中的配置可能没有新加的项
+    return SysOptions.throttling.get(name) or OptionDefaultValue.throttling[name]
 
-    @property
-    def _last_timestamp(self):
-        return float(self._redis_conn.hget(self._key, self._last_timestamp_key))
 
-    @_last_timestamp.setter
-    def _last_timestamp(self, value):
-        self._redis_conn.hset(self._key, self._last_timestamp_key, value)
+def make_limiter(name, identity, redis_conn):
+    """
+    根据 SysOptions.throttling[name] 创建限流器, 配置中有 limit 的使用滑动窗口, 否则使用令牌桶
+    """
+    config = get_throttling_config(name)
+    key = f"throttling:{name}:{identity}"
+    if "limit" in config:
+        return SlidingWindow(key=key, redis_conn=redis_conn, **config)
+    return TokenBucket(key=key, redis_conn=redis_conn, **config)
 
-    def _try_to_fill(self, now):
-        delta = self._fill_rate * (now - self._last_timestamp)
-        return min(self._last_capacity + delta, self._capacity)
 
-    def consume(self, num=1):
-        """
-        消耗 num 个 token，返回是否成功
-        :param num:
-        :return: result: bool, wait_time: float
-        """
-        # print("capacity ", self.fill(time.time()))
-        if self._last_capacity >= num:
-            self._last_capacity -= num
-            return True, 0
-        else:
-            now = time.time()
-            cur_num = self._try_to_fill(now)
-            if cur_num >= num:
-                self._last_capacity = cur_num - num
-                self._last_timestamp = now
-                return True, 0
+def rate_limit(name, by="ip"):
+    """
+    view 方法的限流装饰器, by 可选 ip 和 user, 未登录的请求按 ip 计数
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def handle(*args, **kwargs):
+            from utils.cache import cache
+            self, request = args[0], args[1]
+            if by == "user" and request.user.is_authenticated:
+                identity = f"user:{request.user.id}"
             else:
-                return False, (num - cur_num) / self._fill_rate
+                identity = f"ip:{request.ip}"
+            can_consume, wait = make_limiter(name, identity, cache).consume()
+            if not can_consume:
+                return self.error("Too many requests, please wait %d seconds" % math.ceil(wait))
+            return view_method(*args, **kwargs)
+        return handle
+    return decorator
+
+
+if __name__ == "__main__":
+    # python utils/throttling.py [redis_url] 测试单次检查的延迟
+    import sys
+    import redis
+
+    conn = redis.Redis.from_url(sys.argv[1] if len(sys.argv) > 1 else "redis://127.0.0.1:6379/1")
+    n = 10000
+    for limiter in [TokenBucket("throttling:benchmark:bucket", capacity=n, fill_rate=1, default_capacity=n, redis_conn=conn),
+                    SlidingWindow("throttling:benchmark:window", limit=n, window=60, redis_conn=conn)]:
+        start = time.perf_counter()
+        for _ in range(n):
+            limiter.consume()
+        cost = time.perf_counter() - start
+        print(f"{limiter.__class__.__name__}: {cost / n * 1e6:.1f} us per check")
+    conn.delete("throttling:benchmark:bucket", "throttling:benchmark:window")
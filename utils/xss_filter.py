@@ -26,9 +26,12 @@ Cannot defense xss in browser which is belowed IE7
 浏览器版本：IE7+ 或其他浏览器，无法防御IE6及以下版本浏览器中的XSS
 """
 import re
-import copy
 from html.parser import HTMLParser
 
+URL_PATTERN = re.compile(r"(^(http|https|ftp)://.+)|(^/)", re.I | re.S)
+STYLE_ESCAPE_PATTERN = re.compile(r"(\\|&#|/\*|\*/)")
+STYLE_EXPRESSION_PATTERN = re.compile(r"e.*x.*p.*r.*e.*s.*s.*i.*o.*n")
+
 
 class XSSHtml(HTMLParser):
     allow_tags = ['a', 'img', 'br', 'strong', 'b', 'code', 'pre',
@@ -142,16 +145,15 @@ class XSSHtml(HTMLParser):
         return attrs
 
     def _true_url(self, url):
-        prog = re.compile(r"(^(http|https|ftp)://.+)|(^/)", re.I | re.S)
-        if prog.match(url):
+        if URL_PATTERN.match(url):
             return url
         else:
             return "http://%s" % url
 
     def _true_style(self, style):
         if style:
-            style = re.sub(r"(\\|&#|/\*|\*/)", "_", style)
-            style = re.sub(r"e.*x.*p.*r.*e.*s.*s.*i.*o.*n", "_", style)
+            style = STYLE_ESCAPE_PATTERN.sub("_", style)
+            style = STYLE_EXPRESSION_PATTERN.sub("_", style)
         return style
 
     def _get_style(self, attrs):
@@ -169,11 +171,8 @@ class XSSHtml(HTMLParser):
             other = self.tags_own_attrs.get(tag)
         else:
             other = []
-        if attrs:
-            for key, value in copy.deepcopy(attrs).items():
-                if key not in self.common_attrs + other:
-                    del attrs[key]
-        return attrs
+        allowed = self.common_attrs + other
+        return {key: value for key, value in attrs.items() if key in allowed}
 
     def _common_attr(self, attrs):
         attrs = self._get_style(attrs)